@@ -0,0 +1,7 @@
+"""
+Бенчмарки NutriTarget.
+
+Запуск: python -m benchmarks --sizes 1000 10000 --output bench.json
+Для каждого размера каталога создается временная тестовая БД, заполняется
+генератором синтетических данных и замеряются основные сценарии.
+"""
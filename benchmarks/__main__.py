@@ -0,0 +1,44 @@
+import argparse
+import os
+import sys
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog='python -m benchmarks', description="Бенчмарки планировщика и AJAX-эндпоинтов")
+    parser.add_argument('--sizes', type=int, nargs='+', default=[1000, 10000], help="Размеры каталога рецептов")
+    parser.add_argument('--runs', type=int, default=10, help="Повторов каждого сценария")
+    parser.add_argument('--users', type=int, default=20, help="Пользователей в синтетических данных")
+    parser.add_argument('--output', help="Файл для JSON-отчета")
+    args = parser.parse_args(argv)
+
+    os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'nutritarget.settings')
+    import django
+    django.setup()
+
+    from django.db import connection
+    from django.test.utils import setup_test_environment, teardown_test_environment
+
+    from .cases import run_cases
+    from .runner import environment, format_table, write_report
+
+    # Бенчмарки работают на временной тестовой БД и не трогают рабочую
+    setup_test_environment()
+    old_name = connection.creation.create_test_db(verbosity=0)
+    try:
+        meta = environment()
+        results = []
+        for size in args.sizes:
+            print(f"Каталог {size} рецептов...", file=sys.stderr)
+            results.extend(run_cases(size, args.runs, args.users))
+    finally:
+        connection.creation.destroy_test_db(old_name, verbosity=0)
+        teardown_test_environment()
+
+    print(format_table(results))
+    if args.output:
+        write_report(args.output, results, meta)
+        print(f"Отчет сохранен в {args.output}", file=sys.stderr)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,74 @@
+import json
+import random
+
+from django.test import Client
+from django.urls import reverse
+
+from core.catalog import CatalogSnapshot, catalog_version, get_catalog
+from core.logic import calculate_macros, calculate_macros_batch, scale_ingredients
+from core.models import Profile
+from core.plans import invalidate_plans
+from core.synthetic import DEFAULT_DIET_DIST, DEFAULT_MEAL_DIST, clear_synthetic_data, create_recipes, create_users
+
+from .runner import measure
+
+BENCH_SEED = 2024
+BATCH = 1000  # Размер пачки для микробенчмарков чистых функций
+
+
+def populate(size, users):
+    """Пересоздает каталог заданного размера и пользователей с фиксированным зерном."""
+    rng = random.Random(BENCH_SEED)
+    clear_synthetic_data()
+    create_recipes(size, rng, DEFAULT_DIET_DIST, DEFAULT_MEAL_DIST, 0.15, batch_size=5000)
+    create_users(users, rng, DEFAULT_DIET_DIST, 0.15, premium_share=1.0, favorites=10, batch_size=5000)
+
+
+def json_post(client, url, payload):
+    return client.post(url, json.dumps(payload), content_type='application/json')
+
+
+def check(response, expected=200):
+    if response.status_code != expected:
+        raise RuntimeError(f"{response.request['PATH_INFO']}: ожидался {expected}, получен {response.status_code}")
+    return response
+
+
+def run_cases(size, runs, users=20):
+    """Замеры всех сценариев для каталога из size рецептов."""
+    populate(size, users)
+    profile = Profile.objects.select_related('user').filter(user__username__startswith='synthetic_').order_by('id').first()
+    user = profile.user
+    client = Client()
+    client.force_login(user)
+    get_catalog()  # Снимок каталога загружается один раз на воркер и в замеры не входит
+
+    plan = check(client.get(reverse('results'))).context['weekly_plan']
+    meal = plan[0]['meals'][0]
+    rng = random.Random(BENCH_SEED)
+    answers = [{
+        'weight': rng.uniform(45, 120), 'height': rng.uniform(150, 200), 'age': rng.randint(18, 70),
+        'gender': rng.choice(['male', 'female']), 'activity': 1.375, 'goal': rng.choice(['lose', 'maintain', 'gain']),
+    } for _ in range(BATCH)]
+    columns = [[a[key] for a in answers] for key in ('weight', 'height', 'age', 'gender', 'activity', 'goal')]
+    descriptions = [m['ingredients'] for day in plan for m in day['meals']]
+
+    cases = {
+        'catalog snapshot load': (lambda: CatalogSnapshot.load(catalog_version()), None),
+        'results (generate)': (lambda: check(client.get(reverse('results'))), lambda: invalidate_plans(user)),
+        'results (stored plan)': (lambda: check(client.get(reverse('results'))), None),
+        'replace_meal_ajax': (lambda: check(json_post(client, reverse('replace_meal'), {'meal_type': meal['type_slug'], 'recipe_id': meal['id']})), None),
+        'toggle_favorite': (lambda: check(json_post(client, reverse('toggle_favorite'), {'recipe_id': meal['id']})), None),
+        'menu_types': (lambda: check(client.get(reverse('menu_types'))), None),
+        f'calculate_macros x{BATCH}': (lambda: [calculate_macros(a) for a in answers], None),
+        f'calculate_macros_batch x{BATCH}': (lambda: calculate_macros_batch(*columns), None),
+        f'scale_ingredients x{BATCH}': (lambda: [scale_ingredients(descriptions[i % len(descriptions)], 1 + i / BATCH) for i in range(BATCH)], None),
+    }
+
+    results = []
+    for name, (func, setup) in cases.items():
+        row = {'size': size, 'case': name}
+        row.update(measure(func, runs, setup))
+        results.append(row)
+    invalidate_plans(user)
+    return results
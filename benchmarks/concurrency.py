@@ -0,0 +1,177 @@
+"""
+Конкурентный бенчмарк SQLite: несколько процессов-воркеров одновременно открывают
+рацион и меняют избранное, как воркеры gunicorn под нагрузкой. Каждый профиль
+из nutritarget/sqlite.py прогоняется на своей копии одной и той же базы.
+
+    python -m benchmarks.concurrency --workers 4 --duration 10 --output concurrency.json
+"""
+import argparse
+import json
+import logging
+import os
+import random
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+BENCH_SEED = 2024
+
+
+def _env(db_path, profile):
+    env = dict(os.environ)
+    env.update({
+        'DJANGO_SETTINGS_MODULE': 'nutritarget.settings',
+        'NUTRITARGET_DB_PATH': db_path,
+        'NUTRITARGET_SQLITE_PROFILE': profile,
+    })
+    return env
+
+
+def prepare(db_path, recipes, users):
+    """Создает базу с синтетическими данными (один раз для всех профилей)."""
+    env = _env(db_path, 'default')
+    manage = [sys.executable, 'manage.py']
+    subprocess.run(manage + ['migrate', '--verbosity', '0'], env=env, check=True)
+    subprocess.run(
+        manage + ['generate_synthetic_data', '--recipes', str(recipes), '--users', str(users),
+                  '--seed', str(BENCH_SEED), '--premium-share', '1'],
+        env=env, check=True, stdout=subprocess.DEVNULL,
+    )
+
+
+def percentile(values, q):
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return values[min(len(values) - 1, int(q * len(values)))]
+
+
+def run_profile(template_path, profile, workers, duration, write_share):
+    """Прогон одного профиля на свежей копии базы; возвращает сводку по всем воркерам."""
+    workdir = tempfile.mkdtemp(prefix=f'nt-{profile}-')
+    db_path = os.path.join(workdir, 'db.sqlite3')
+    shutil.copy(template_path, db_path)
+    start_at = time.time() + 3  # Время на запуск воркеров: замер начинается у всех одновременно
+    try:
+        processes = [
+            subprocess.Popen(
+                [sys.executable, '-m', 'benchmarks.concurrency', '--worker', str(number),
+                 '--start-at', str(start_at), '--duration', str(duration), '--write-share', str(write_share)],
+                env=_env(db_path, profile), stdout=subprocess.PIPE, text=True,
+            )
+            for number in range(workers)
+        ]
+        reports = [json.loads(process.communicate()[0]) for process in processes]
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    reads = [ms for report in reports for ms in report['reads']]
+    writes = [ms for report in reports for ms in report['writes']]
+    return {
+        'profile': profile,
+        'workers': workers,
+        'requests': len(reads) + len(writes),
+        'rps': round((len(reads) + len(writes)) / duration, 1),
+        'read_p50_ms': round(percentile(reads, 0.5), 2),
+        'read_p95_ms': round(percentile(reads, 0.95), 2),
+        'write_p50_ms': round(percentile(writes, 0.5), 2),
+        'write_p95_ms': round(percentile(writes, 0.95), 2),
+        'errors': sum(report['errors'] for report in reports),
+    }
+
+
+def worker(number, start_at, duration, write_share):
+    """Цикл одного воркера: вход синтетическим пользователем, затем чтение рациона и изменение избранного."""
+    import django
+    django.setup()
+    # Ошибки считаются в отчете, трейсбеки каждого "database is locked" не нужны
+    logging.getLogger('django.request').setLevel(logging.CRITICAL)
+
+    from django.contrib.auth.models import User
+    from django.test import Client
+
+    from core.models import Recipe
+    from core.synthetic import SYNTHETIC_USER_PREFIX
+
+    rng = random.Random(BENCH_SEED + number)
+    users = list(User.objects.filter(username__startswith=SYNTHETIC_USER_PREFIX).order_by('id'))
+    recipe_ids = list(Recipe.objects.values_list('id', flat=True))
+    client = Client(raise_request_exception=False, HTTP_HOST='localhost')
+    client.force_login(users[number % len(users)])
+    client.get('/results/')  # Прогрев: снимок каталога и сохраненный рацион
+
+    reads, writes, errors = [], [], 0
+    time.sleep(max(0.0, start_at - time.time()))
+    deadline = time.time() + duration
+    while time.time() < deadline:
+        is_write = rng.random() < write_share
+        started = time.perf_counter()
+        if is_write:
+            response = client.post('/api/favorite/toggle/', json.dumps({'recipe_id': rng.choice(recipe_ids)}),
+                                   content_type='application/json')
+        else:
+            response = client.get('/results/')
+        elapsed = (time.perf_counter() - started) * 1000
+        if response.status_code >= 500:
+            errors += 1
+            continue
+        (writes if is_write else reads).append(elapsed)
+    print(json.dumps({'reads': reads, 'writes': writes, 'errors': errors}))
+
+
+def format_table(results):
+    header = (f"{'profile':<8} {'workers':>7} {'req/s':>8} {'read p50':>9} {'read p95':>9} "
+              f"{'write p50':>9} {'write p95':>9} {'errors':>6}")
+    lines = [header, '-' * len(header)]
+    for row in results:
+        lines.append(
+            f"{row['profile']:<8} {row['workers']:>7} {row['rps']:>8.1f} {row['read_p50_ms']:>9.2f} {row['read_p95_ms']:>9.2f} "
+            f"{row['write_p50_ms']:>9.2f} {row['write_p95_ms']:>9.2f} {row['errors']:>6}"
+        )
+    return "\n".join(lines)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog='python -m benchmarks.concurrency', description="Конкурентный бенчмарк профилей SQLite")
+    parser.add_argument('--profiles', nargs='+', default=['default', 'tuned'], help="Профили из nutritarget/sqlite.py")
+    parser.add_argument('--workers', type=int, nargs='+', default=[1, 4, 8], help="Число процессов-воркеров")
+    parser.add_argument('--duration', type=float, default=10, help="Длительность замера, секунд")
+    parser.add_argument('--write-share', type=float, default=0.2, help="Доля запросов на запись (избранное)")
+    parser.add_argument('--recipes', type=int, default=5000, help="Рецептов в базе")
+    parser.add_argument('--users', type=int, default=50, help="Пользователей в базе")
+    parser.add_argument('--output', help="Файл для JSON-отчета")
+    parser.add_argument('--worker', type=int, help=argparse.SUPPRESS)
+    parser.add_argument('--start-at', type=float, help=argparse.SUPPRESS)
+    args = parser.parse_args(argv)
+
+    if args.worker is not None:
+        worker(args.worker, args.start_at, args.duration, args.write_share)
+        return
+
+    workdir = tempfile.mkdtemp(prefix='nt-concurrency-')
+    template_path = os.path.join(workdir, 'db.sqlite3')
+    try:
+        print("Подготовка базы...", file=sys.stderr)
+        prepare(template_path, args.recipes, args.users)
+        results = []
+        for workers in args.workers:
+            for profile in args.profiles:
+                print(f"Профиль {profile}, воркеров: {workers}...", file=sys.stderr)
+                results.append(run_profile(template_path, profile, workers, args.duration, args.write_share))
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    print(format_table(results))
+    if args.output:
+        os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'nutritarget.settings')
+        import django
+        django.setup()
+        from .runner import environment, write_report
+        write_report(args.output, results, environment())
+        print(f"Отчет сохранен в {args.output}", file=sys.stderr)
+
+
+if __name__ == '__main__':
+    main()
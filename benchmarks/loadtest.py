@@ -0,0 +1,335 @@
+"""
+Нагрузочный тест сквозного сценария: анкета (шаги 1-3) -> рацион -> замена блюда и избранное.
+
+Виртуальные пользователи - потоки со своими cookie - ходят
+в приложение по HTTP, как браузеры: гости проходят анкету и открывают рацион,
+premium-пользователи входят, открывают рацион (с If-None-Match), меняют блюда и
+избранное. Отчет по каждому эндпоинту: пропускная способность, p50/p95/p99 и доля ошибок.
+
+По умолчанию для каждого уровня конкурентности поднимается runserver на свежей копии
+базы с синтетическими данными. Свой сервер (gunicorn, uvicorn) - через --server-cmd
+или --url (база должна содержать синтетических пользователей, пароль 'synthetic').
+
+    python -m benchmarks.loadtest --concurrency 4 16 --duration 30 --output loadtest.json
+    python -m benchmarks.loadtest --server-cmd "gunicorn nutritarget.wsgi -w 4 -b 127.0.0.1:{port}"
+"""
+import argparse
+import http.client
+import http.cookies
+import json
+import os
+import random
+import re
+import shlex
+import shutil
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import urllib.parse
+
+from .concurrency import BENCH_SEED, _env, percentile, prepare
+
+MEAL_TYPES = ('breakfast', 'snack', 'lunch', 'dinner')
+RECIPE_ID_RE = re.compile(rb'data-recipe-id="(\d+)"')
+
+# Действия premium-пользователя после входа и их доли
+PREMIUM_ACTIONS = (('results', 0.4), ('replace_meal', 0.3), ('toggle_favorite', 0.3))
+
+
+class Session:
+    """HTTP-клиент одного виртуального пользователя: cookie, CSRF и, с keep_alive, одно соединение на все запросы."""
+
+    def __init__(self, base_url, timeout, keep_alive=False):
+        parts = urllib.parse.urlsplit(base_url)
+        self.host, self.port = parts.hostname, parts.port or 80
+        self.timeout = timeout
+        self.keep_alive = keep_alive
+        self.cookies = {}
+        self.connection = None
+
+    def request(self, method, path, body=None, headers=None):
+        headers = dict(headers or {})
+        if self.cookies:
+            headers['Cookie'] = '; '.join(f"{key}={value}" for key, value in self.cookies.items())
+        if 'csrftoken' in self.cookies and method == 'POST':
+            headers['X-CSRFToken'] = self.cookies['csrftoken']
+        if not self.keep_alive:
+            headers['Connection'] = 'close'
+        for attempt in range(2):
+            if self.connection is None:
+                self.connection = http.client.HTTPConnection(self.host, self.port, timeout=self.timeout)
+            try:
+                self.connection.request(method, path, body=body, headers=headers)
+                response = self.connection.getresponse()
+                content = response.read()
+                break
+            except (http.client.HTTPException, OSError):
+                # Сервер закрыл keep-alive соединение между запросами: одна повторная попытка на новом
+                self.close()
+                if attempt:
+                    raise
+        for header in response.headers.get_all('Set-Cookie') or []:
+            for key, morsel in http.cookies.SimpleCookie(header).items():
+                if morsel['max-age'] == '0' or not morsel.value:
+                    self.cookies.pop(key, None)
+                else:
+                    self.cookies[key] = morsel.value
+        if not self.keep_alive or response.getheader('Connection', '').lower() == 'close':
+            self.close()
+        return response.status, response.headers, content
+
+    def form(self, path, data):
+        body = urllib.parse.urlencode(data, doseq=True)
+        return self.request('POST', path, body, {'Content-Type': 'application/x-www-form-urlencoded'})
+
+    def json(self, path, data):
+        return self.request('POST', path, json.dumps(data), {'Content-Type': 'application/json'})
+
+    def close(self):
+        if self.connection is not None:
+            self.connection.close()
+            self.connection = None
+
+
+class Recorder:
+    """Замеры одного потока: имя эндпоинта -> длительности (мс) и число ошибок. Сводятся после прогона."""
+
+    def __init__(self):
+        self.timings = {}
+        self.errors = {}
+
+    def call(self, name, expected, func, *args):
+        started = time.perf_counter()
+        try:
+            status, headers, content = func(*args)
+        except (http.client.HTTPException, OSError):
+            status, headers, content = None, {}, b''
+        elapsed = (time.perf_counter() - started) * 1000
+        self.timings.setdefault(name, []).append(elapsed)
+        if status not in expected:
+            self.errors[name] = self.errors.get(name, 0) + 1
+        return status, headers, content
+
+
+def guest_journey(session, rng, rec):
+    """Новый гость: анкета от первого до третьего шага, рацион и его повторная проверка браузером."""
+    rec.call('step1 GET', {200}, session.request, 'GET', '/individual-menu/')
+    rec.call('step1 POST', {302}, session.form, '/individual-menu/?step=1', {
+        'goal': rng.choice(['lose', 'maintain', 'gain']), 'activity': rng.choice(['1.2', '1.375', '1.55']),
+    })
+    rec.call('step2 GET', {200}, session.request, 'GET', '/individual-menu/?step=2')
+    rec.call('step2 POST', {302}, session.form, '/individual-menu/?step=2', {
+        'gender': rng.choice(['male', 'female']), 'age': rng.randint(18, 70),
+        'weight': round(rng.uniform(50, 110), 1), 'height': rng.randint(150, 200),
+    })
+    rec.call('step3 GET', {200}, session.request, 'GET', '/individual-menu/?step=3')
+    rec.call('step3 POST', {302}, session.form, '/individual-menu/?step=3', {
+        'diet': rng.choice(['all', 'all', 'vege', 'pesca']),
+        'allergies': rng.sample(['лактоз', 'орех', 'глютен', 'морепродукт'], rng.randint(0, 1)),
+    })
+    # Гостевой рацион генерируется на каждый запрос, поэтому в отчете отдельно от рациона premium
+    _, headers, _ = rec.call('results guest', {200}, session.request, 'GET', '/results/')
+    if headers.get('ETag'):
+        rec.call('results guest', {200, 304}, session.request, 'GET', '/results/', None, {'If-None-Match': headers['ETag']})
+
+
+class PremiumUser:
+    """Вошедший premium-пользователь: рацион, замена блюд и избранное в случайном порядке."""
+
+    def __init__(self, session, rng, rec, username):
+        self.session, self.rng, self.rec = session, rng, rec
+        self.username = username
+        self.etag = None
+        self.recipe_ids = []
+
+    def login(self):
+        self.rec.call('login GET', {200}, self.session.request, 'GET', '/login/')
+        self.rec.call('login POST', {302}, self.session.form, '/login/', {'username': self.username, 'password': 'synthetic'})
+
+    def step(self):
+        action = self.rng.choices([name for name, _ in PREMIUM_ACTIONS], [w for _, w in PREMIUM_ACTIONS])[0]
+        if action == 'results' or not self.recipe_ids:
+            headers = {'If-None-Match': self.etag} if self.etag else {}
+            status, response_headers, content = self.rec.call('results', {200, 304}, self.session.request, 'GET', '/results/', None, headers)
+            if status == 200:
+                self.etag = response_headers.get('ETag')
+                self.recipe_ids = [int(rid) for rid in RECIPE_ID_RE.findall(content)]
+        elif action == 'replace_meal':
+            # 404 - штатный ответ "нет вариантов для замены"
+            self.rec.call('replace_meal', {200, 404}, self.session.json, '/api/meal/replace/', {
+                'recipe_id': self.rng.choice(self.recipe_ids), 'meal_type': self.rng.choice(MEAL_TYPES),
+            })
+        else:
+            self.rec.call('toggle_favorite', {200}, self.session.json, '/api/favorite/toggle/', {
+                'recipe_id': self.rng.choice(self.recipe_ids),
+            })
+
+
+def virtual_user(number, base_url, is_guest, users, deadline, options, rec):
+    rng = random.Random(BENCH_SEED + number)
+    session = Session(base_url, options.timeout, options.keep_alive)
+    try:
+        if is_guest:
+            while time.time() < deadline:
+                session.cookies.clear()  # Каждый проход - новый гость
+                guest_journey(session, rng, rec)
+                time.sleep(options.think_time)
+            return
+        user = PremiumUser(session, rng, rec, f"synthetic_{number % users + 1}")
+        user.login()
+        while time.time() < deadline:
+            user.step()
+            time.sleep(options.think_time)
+    finally:
+        session.close()
+
+
+def run_load(base_url, concurrency, options):
+    """Прогон одного уровня конкурентности; возвращает строки отчета по эндпоинтам и итоговую."""
+    guests = round(concurrency * options.guest_share)
+    recorders = [Recorder() for _ in range(concurrency)]
+    deadline = time.time() + options.duration
+    threads = [
+        threading.Thread(target=virtual_user, args=(
+            number, base_url, number < guests, options.users, deadline, options, recorders[number],
+        ))
+        for number in range(concurrency)
+    ]
+    started = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - started
+
+    timings, errors = {}, {}
+    for rec in recorders:
+        for name, values in rec.timings.items():
+            timings.setdefault(name, []).extend(values)
+        for name, count in rec.errors.items():
+            errors[name] = errors.get(name, 0) + count
+    timings['all'] = [ms for values in list(timings.values()) for ms in values]
+    errors['all'] = sum(errors.values())
+
+    return [
+        {
+            'concurrency': concurrency,
+            'guests': guests,
+            'endpoint': name,
+            'requests': len(values),
+            'rps': round(len(values) / elapsed, 1),
+            'p50_ms': round(percentile(values, 0.5), 2),
+            'p95_ms': round(percentile(values, 0.95), 2),
+            'p99_ms': round(percentile(values, 0.99), 2),
+            'error_rate': round(errors.get(name, 0) / len(values), 4) if values else 0.0,
+        }
+        for name, values in sorted(timings.items(), key=lambda item: (item[0] == 'all', item[0]))
+    ]
+
+
+def _free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def _wait_for_port(port, process, timeout=60):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError(f"Сервер завершился с кодом {process.returncode}")
+        try:
+            with socket.create_connection(('127.0.0.1', port), timeout=1):
+                return
+        except OSError:
+            time.sleep(0.2)
+    raise RuntimeError(f"Сервер не открыл порт {port} за {timeout} с")
+
+
+def start_server(server_cmd, env):
+    port = _free_port()
+    if server_cmd:
+        command = shlex.split(server_cmd.format(port=port))
+    else:
+        command = [sys.executable, 'manage.py', 'runserver', f'127.0.0.1:{port}', '--noreload']
+    process = subprocess.Popen(command, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    try:
+        _wait_for_port(port, process)
+    except RuntimeError:
+        process.kill()
+        raise
+    return process, f'http://127.0.0.1:{port}'
+
+
+def format_table(results):
+    header = (f"{'vus':>4} {'endpoint':<16} {'requests':>8} {'req/s':>8} {'p50 ms':>8} "
+              f"{'p95 ms':>8} {'p99 ms':>8} {'errors':>7}")
+    lines = [header, '-' * len(header)]
+    for row in results:
+        lines.append(
+            f"{row['concurrency']:>4} {row['endpoint']:<16} {row['requests']:>8} {row['rps']:>8.1f} {row['p50_ms']:>8.2f} "
+            f"{row['p95_ms']:>8.2f} {row['p99_ms']:>8.2f} {row['error_rate']:>7.2%}"
+        )
+    return "\n".join(lines)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog='python -m benchmarks.loadtest', description="Нагрузочный тест: анкета -> рацион -> замена и избранное")
+    parser.add_argument('--concurrency', type=int, nargs='+', default=[4, 16], help="Виртуальных пользователей (несколько значений - несколько прогонов)")
+    parser.add_argument('--guest-share', type=float, default=0.5, help="Доля гостей среди виртуальных пользователей, остальные - premium")
+    parser.add_argument('--duration', type=float, default=20, help="Длительность прогона, секунд")
+    parser.add_argument('--think-time', type=float, default=0.0, help="Пауза между запросами пользователя, секунд")
+    parser.add_argument('--timeout', type=float, default=30, help="Таймаут одного запроса, секунд")
+    # runserver не ставит TCP_NODELAY: на keep-alive соединении каждый ответ ждет отложенный ACK (~40 мс),
+    # поэтому по умолчанию каждый запрос идет в новом соединении. Для gunicorn/uvicorn включайте --keep-alive
+    parser.add_argument('--keep-alive', action='store_true', help="Переиспользовать соединение между запросами")
+    parser.add_argument('--recipes', type=int, default=2000, help="Рецептов в базе")
+    parser.add_argument('--users', type=int, default=50, help="Синтетических premium-пользователей")
+    parser.add_argument('--sqlite-profile', default='tuned', help="Профиль из nutritarget/sqlite.py")
+    parser.add_argument('--server-cmd', help="Команда запуска сервера с {port}, по умолчанию manage.py runserver")
+    parser.add_argument('--url', help="Уже запущенный сервер: без подготовки базы и запуска сервера")
+    parser.add_argument('--output', help="Файл для JSON-отчета")
+    args = parser.parse_args(argv)
+
+    results = []
+    if args.url:
+        for concurrency in args.concurrency:
+            print(f"Виртуальных пользователей: {concurrency}...", file=sys.stderr)
+            results += run_load(args.url, concurrency, args)
+    else:
+        workdir = tempfile.mkdtemp(prefix='nt-loadtest-')
+        template_path = os.path.join(workdir, 'template.sqlite3')
+        try:
+            print("Подготовка базы...", file=sys.stderr)
+            prepare(template_path, args.recipes, args.users)
+            for concurrency in args.concurrency:
+                # Каждый уровень - на свежей копии базы и новом сервере, чтобы прогоны были сравнимы
+                db_path = os.path.join(workdir, f'db-{concurrency}.sqlite3')
+                shutil.copy(template_path, db_path)
+                process, base_url = start_server(args.server_cmd, _env(db_path, args.sqlite_profile))
+                try:
+                    print(f"Виртуальных пользователей: {concurrency}...", file=sys.stderr)
+                    results += run_load(base_url, concurrency, args)
+                finally:
+                    process.terminate()
+                    process.wait()
+        finally:
+            shutil.rmtree(workdir, ignore_errors=True)
+
+    print(format_table(results))
+    if args.output:
+        os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'nutritarget.settings')
+        import django
+        django.setup()
+        from .runner import environment, write_report
+        meta = environment()
+        meta['loadtest'] = {key: value for key, value in vars(args).items() if key != 'output'}
+        write_report(args.output, results, meta)
+        print(f"Отчет сохранен в {args.output}", file=sys.stderr)
+
+
+if __name__ == '__main__':
+    main()
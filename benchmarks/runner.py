@@ -0,0 +1,81 @@
+import gc
+import json
+import platform
+import statistics
+import subprocess
+import time
+import tracemalloc
+
+import django
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+
+
+def measure(func, runs, setup=None):
+    """
+    Замер сценария: время каждого запуска, число SQL-запросов за один вызов
+    и пик памяти (отдельным прогоном, чтобы tracemalloc не искажал время).
+    """
+    timings = []
+    queries = []
+    for _ in range(runs):
+        if setup:
+            setup()
+        gc.collect()
+        with CaptureQueriesContext(connection) as ctx:
+            started = time.perf_counter()
+            func()
+            timings.append((time.perf_counter() - started) * 1000)
+        queries.append(len(ctx.captured_queries))
+
+    if setup:
+        setup()
+    gc.collect()
+    tracemalloc.start()
+    try:
+        func()
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+
+    return {
+        'runs': runs,
+        'mean_ms': round(statistics.fmean(timings), 3),
+        'p50_ms': round(statistics.median(timings), 3),
+        'min_ms': round(min(timings), 3),
+        'max_ms': round(max(timings), 3),
+        'queries': max(queries),
+        'peak_kb': round(peak / 1024, 1),
+    }
+
+
+def environment():
+    """Описание окружения, чтобы результаты разных запусков можно было сравнивать."""
+    try:
+        commit = subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True).stdout.strip()
+    except OSError:
+        commit = ''
+    return {
+        'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S%z'),
+        'commit': commit,
+        'python': platform.python_version(),
+        'django': django.get_version(),
+        'platform': platform.platform(),
+        'database': connection.vendor,
+    }
+
+
+def format_table(results):
+    header = f"{'size':>8}  {'case':<28} {'mean ms':>9} {'p50 ms':>9} {'max ms':>9} {'queries':>7} {'peak KB':>9}"
+    lines = [header, '-' * len(header)]
+    for row in results:
+        lines.append(
+            f"{row['size']:>8}  {row['case']:<28} {row['mean_ms']:>9.2f} {row['p50_ms']:>9.2f} "
+            f"{row['max_ms']:>9.2f} {row['queries']:>7} {row['peak_kb']:>9.1f}"
+        )
+    return "\n".join(lines)
+
+
+def write_report(path, results, meta):
+    with open(path, 'w', encoding='utf-8') as f:
+        json.dump({'meta': meta, 'results': results}, f, ensure_ascii=False, indent=2)
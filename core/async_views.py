@@ -0,0 +1,129 @@
+"""
+Асинхронные версии горячих представлений для запуска под ASGI (nutritarget/asgi.py).
+
+Запросы к БД идут через асинхронный ORM, поэтому частые AJAX-запросы (замена блюда,
+избранное) не занимают поток на время запроса. В поток уходят только рендеринг
+шаблона и генерация рациона при промахе хранилища. Подключаются в core/urls.py
+настройкой CORE_ASYNC_VIEWS.
+"""
+from functools import wraps
+
+from asgiref.sync import sync_to_async
+from django.contrib import messages
+from django.contrib.auth.decorators import login_required
+from django.contrib.auth.models import User
+from django.http import JsonResponse
+from django.shortcuts import redirect, render
+from django.utils import timezone
+from django.views.decorators.cache import cache_control
+from django.views.decorators.http import condition, require_POST
+
+from .catalog import aget_catalog
+from .etags import results_etag
+from .favorites import afavorite_ids
+from .models import Profile, Recipe
+from .plans import aget_stored_plan, ainvalidate_plans, astore_plan, generate_plan, plan_inputs, results_context
+from .replacement import replacement_meal
+from .views import json_object, json_recipe_id
+
+arender = sync_to_async(render)
+
+
+async def _auser(request):
+    """Пользователь запроса (вместе с профилем). Подставляется в request.user, чтобы шаблоны не делали повторный запрос."""
+    user = await request.auser()
+    # Сессии, созданные через ModelBackend, загружают пользователя без профиля: ленивая загрузка
+    # в асинхронном контексте невозможна, поэтому профиль догружается здесь
+    if user.is_authenticated and not User.profile.is_cached(user):
+        user.profile = await Profile.objects.aget(user=user)
+    request.user = user
+    return user
+
+
+def _preload(view):
+    """Заранее загружает пользователя, сессию (из нее могут читаться сообщения) и снимок каталога: condition вызывает etag_func синхронно."""
+    @wraps(view)
+    async def inner(request, *args, **kwargs):
+        await _auser(request)
+        await request.session.aitems()
+        # Снимок сохраняется в запросе: etag_func не должен сверять версию каталога с БД синхронно
+        request.catalog = await aget_catalog()
+        return await view(request, *args, **kwargs)
+    return inner
+
+
+@_preload
+@cache_control(private=True, no_cache=True)
+@condition(etag_func=results_etag)
+async def results(request):
+    inputs = plan_inputs(request)
+    if inputs is None: return redirect('individual_menu')
+    profile = inputs.profile
+
+    # Тот же снимок, по которому считался ETag (_preload)
+    catalog = request.catalog
+    weekly_plan = await aget_stored_plan(profile, catalog) if profile else None
+    if weekly_plan is None:
+        # Генерация не обращается к БД и нагружает процессор, поэтому идет в отдельном потоке, не блокируя цикл событий
+        weekly_plan = await sync_to_async(generate_plan, thread_sensitive=False)(
+            catalog, inputs.diet_pref, inputs.allergies, inputs.macros, inputs.seed,
+        )
+        if weekly_plan is None:
+            return await arender(request, 'core/results.html', {'error_message': "Нет рецептов под ваши фильтры."})
+        if profile:
+            await astore_plan(profile, catalog, weekly_plan)
+
+    favorite_recipe_ids = sorted(await afavorite_ids(profile)) if profile else []
+    return await arender(request, 'core/results.html', results_context(inputs, weekly_plan, favorite_recipe_ids))
+
+
+@login_required
+@require_POST
+async def toggle_favorite(request):
+    user = await _auser(request)
+    recipe_id = json_recipe_id(json_object(request))
+    if recipe_id is None or not await Recipe.objects.filter(pk=recipe_id).aexists():
+        return JsonResponse({'status': 'error', 'message': 'Рецепт не найден'}, status=404)
+    favorites = user.profile.favorite_recipes
+    if await favorites.filter(pk=recipe_id).aexists():
+        await favorites.aremove(recipe_id)
+        return JsonResponse({'status': 'success', 'action': 'removed'})
+    await favorites.aadd(recipe_id)
+    return JsonResponse({'status': 'success', 'action': 'added'})
+
+
+@login_required
+async def refresh_meal(request):
+    user = await _auser(request)
+    profile = user.profile
+    if profile.can_refresh_menu():
+        profile.last_weekly_refresh = timezone.now()
+        await profile.asave(update_fields=['last_weekly_refresh'])
+        await ainvalidate_plans(user)
+        messages.success(request, "Меню успешно обновлено на неделю!")
+    else:
+        messages.error(request, f"Бесплатное обновление будет доступно через {profile.days_until_next_refresh()} дн.")
+    return redirect('results')
+
+
+@login_required
+@require_POST
+async def replace_meal_ajax(request):
+    user = await _auser(request)
+    profile = user.profile
+    if not profile.has_active_subscription:
+        return JsonResponse({'status': 'error', 'message': 'Нужна подписка Premium'}, status=403)
+
+    data = json_object(request)
+    if data is None:
+        return JsonResponse({'status': 'error', 'message': 'Некорректный запрос'}, status=400)
+    meal_type = data.get('meal_type')
+    old_id = json_recipe_id(data)
+
+    if not profile.target_kcal:
+        return JsonResponse({'status': 'error', 'message': 'Сначала заполните анкету'}, status=400)
+
+    new_meal = replacement_meal(await aget_catalog(), profile, meal_type, old_id)
+    if new_meal is None:
+        return JsonResponse({'status': 'error', 'message': 'Нет вариантов для замены'}, status=404)
+    return JsonResponse({'status': 'success', 'new_meal': new_meal})
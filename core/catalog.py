@@ -0,0 +1,305 @@
+import hashlib
+import random
+import re
+import threading
+import time
+import uuid
+from array import array
+from collections import namedtuple
+
+import numpy as np
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.files.storage import default_storage
+
+from .images import default_rendition, srcset
+from .logic import parse_ingredients
+from .models import CatalogVersion, Recipe
+
+MEAL_CODES = tuple(slug for slug, _ in Recipe.MEAL_TYPES)
+DIET_CODES = tuple(slug for slug, _ in Recipe.DIET_TYPES)
+
+INGREDIENT_UNITS = {'г', 'гр', 'кг', 'мл', 'л', 'шт'}
+
+CatalogRecipe = namedtuple('CatalogRecipe', [
+    'id', 'title', 'meal_type', 'diet_type', 'calories', 'protein', 'fat', 'carbs', 'description', 'image_url',
+    'srcset_webp', 'srcset_jpeg',
+])
+
+
+# Последняя прочитанная из БД версия каталога и момент чтения (time.monotonic) в этом процессе
+_seen_version = (None, 0.0)
+
+
+def _fresh_version():
+    """Версия, прочитанная не раньше CATALOG_VERSION_CHECK_INTERVAL секунд назад, иначе None."""
+    version, checked_at = _seen_version
+    if version is not None and time.monotonic() - checked_at < settings.CATALOG_VERSION_CHECK_INTERVAL:
+        return version
+    return None
+
+
+def catalog_version():
+    """
+    Текущая версия каталога - токен из таблицы CatalogVersion, общий для всех процессов.
+    БД опрашивается не чаще раза в CATALOG_VERSION_CHECK_INTERVAL секунд: правка рецептов
+    в другом процессе становится видна с этой задержкой, а в своем - сразу.
+    """
+    global _seen_version
+    version = _fresh_version()
+    if version is None:
+        version = CatalogVersion.objects.filter(pk=1).values_list('version', flat=True).first() or ''
+        _seen_version = (version, time.monotonic())
+    return version
+
+
+def bump_catalog_version():
+    """Помечает устаревшими снимки каталога во всех процессах."""
+    global _seen_version
+    # Новый случайный токен, а не счетчик: после отката транзакции версия не может совпасть с уже виденной
+    version = uuid.uuid4().hex
+    CatalogVersion.objects.update_or_create(pk=1, defaults={'version': version})
+    _seen_version = (version, time.monotonic())
+
+
+def normalize_term(text):
+    """Нормализация продукта или аллергена: нижний регистр, ё -> е, без лишних пробелов."""
+    return " ".join(text.lower().replace('ё', 'е').split())
+
+
+def ingredient_names(description):
+    """
+    Разбирает состав на нормализованные названия продуктов без количеств.
+    Пример: "Йогурт 2% 150г, Семена чиа 5г" -> ["йогурт", "семена чиа"]
+    """
+    names = []
+    for part in description.split(','):
+        words = re.sub(r'[\d_%.,;:()]+', ' ', normalize_term(part)).split()
+        name = " ".join(w for w in words if w not in INGREDIENT_UNITS)
+        if name:
+            names.append(name)
+    return names
+
+
+def _image_src(image_url, image, thumbnails):
+    """Адрес фото рецепта: миниатюра, затем локальная копия, затем исходная внешняя ссылка."""
+    name = default_rendition(thumbnails) or image
+    return default_storage.url(name) if name else image_url
+
+
+class CatalogSnapshot:
+    """
+    Колоночный снимок таблицы рецептов.
+    Числовые поля хранятся в типизированных массивах, строки - в списках,
+    рецепт адресуется порядковым номером строки.
+    """
+
+    def __init__(self, version, rows):
+        self.version = version
+        # Хэш содержимого: в отличие от version (случайного токена из таблицы CatalogVersion), одинаков во всех процессах
+        # для одних и тех же рецептов, поэтому подходит для ключей сохраненных рационов
+        digest = hashlib.sha1()
+        self.ids = array('q')
+        self.meal_codes = array('b')
+        self.diet_codes = array('b')
+        self.calories = array('l')
+        self.protein = array('d')
+        self.fat = array('d')
+        self.carbs = array('d')
+        self.titles = []
+        self.descriptions = []
+        self.image_urls = []  # Адрес фото для src: локальная миниатюра, локальная копия или внешняя ссылка
+        self.srcsets = []  # (srcset WebP, srcset JPEG) или None, если миниатюр нет
+        self.templates = []  # Разобранный состав для пересчета граммовки
+        self.index_by_id = {}
+        # Инвертированный индекс: название продукта -> номера строк, где он встречается
+        self.ingredient_index = {}
+        self._term_rows = {}
+        self._pools = {}
+        self._filtered_pools = {}
+        self._nutrients = None
+
+        meal_index = {slug: code for code, slug in enumerate(MEAL_CODES)}
+        diet_index = {slug: code for code, slug in enumerate(DIET_CODES)}
+        for row in rows:
+            digest.update(repr(row).encode('utf-8'))
+            rid, title, meal_type, diet_type, kcal, p, f, c, description, image_url, image, thumbnails = row
+            self.index_by_id[rid] = len(self.ids)
+            self.ids.append(rid)
+            self.meal_codes.append(meal_index.get(meal_type, -1))
+            self.diet_codes.append(diet_index.get(diet_type, -1))
+            self.calories.append(kcal)
+            self.protein.append(p)
+            self.fat.append(f)
+            self.carbs.append(c)
+            self.titles.append(title)
+            self.descriptions.append(description)
+            self.image_urls.append(_image_src(image_url, image, thumbnails))
+            self.srcsets.append(
+                (srcset(thumbnails, 'webp', default_storage.url), srcset(thumbnails, 'jpeg', default_storage.url))
+                if thumbnails else None
+            )
+            self.templates.append(parse_ingredients(description))
+            for name in ingredient_names(description):
+                self.ingredient_index.setdefault(name, array('l')).append(len(self.ids) - 1)
+        self.content_hash = digest.hexdigest()
+
+    @classmethod
+    def load(cls, version):
+        rows = Recipe.objects.order_by('id').values_list(
+            'id', 'title', 'meal_type', 'diet_type', 'calories', 'protein', 'fat', 'carbs', 'description', 'image_url',
+            'image', 'thumbnails',
+        )
+        return cls(version, rows.iterator(chunk_size=2000))
+
+    def __len__(self):
+        return len(self.ids)
+
+    def recipe(self, index):
+        """Собирает легкий объект рецепта по номеру строки."""
+        return CatalogRecipe(
+            id=self.ids[index],
+            title=self.titles[index],
+            meal_type=MEAL_CODES[self.meal_codes[index]],
+            diet_type=DIET_CODES[self.diet_codes[index]],
+            calories=self.calories[index],
+            protein=self.protein[index],
+            fat=self.fat[index],
+            carbs=self.carbs[index],
+            description=self.descriptions[index],
+            image_url=self.image_urls[index],
+            srcset_webp=self.srcsets[index][0] if self.srcsets[index] else '',
+            srcset_jpeg=self.srcsets[index][1] if self.srcsets[index] else '',
+        )
+
+    def nutrient_matrix(self):
+        """КБЖУ на 100 г матрицей numpy: строка - рецепт, столбцы - ккал, белки, жиры, углеводы."""
+        if self._nutrients is None:
+            self._nutrients = np.column_stack([
+                np.array(self.calories, dtype=np.float64),
+                np.frombuffer(self.protein, dtype=np.float64),
+                np.frombuffer(self.fat, dtype=np.float64),
+                np.frombuffer(self.carbs, dtype=np.float64),
+            ])
+        return self._nutrients
+
+    def meal_code(self, meal_type):
+        """Код приема пищи в meal_codes; -2 для неизвестного (не совпадает ни с одной строкой)."""
+        return MEAL_CODES.index(meal_type) if meal_type in MEAL_CODES else -2
+
+    def get(self, recipe_id):
+        index = self.index_by_id.get(recipe_id)
+        return None if index is None else self.recipe(index)
+
+    def rows_with_term(self, term):
+        """
+        Строки, в составе которых есть продукт, содержащий term (например, "орех" -> "грецкий орех").
+        Поиск идет по словарю продуктов, а не по рецептам, и кэшируется на время жизни снимка.
+        """
+        term = normalize_term(term)
+        rows = self._term_rows.get(term)
+        if rows is None:
+            rows = set()
+            for name, postings in self.ingredient_index.items():
+                if term in name:
+                    rows.update(postings)
+            rows = frozenset(rows)
+            self._term_rows[term] = rows
+        return rows
+
+    def pool(self, diets=None, meal_type=None):
+        """
+        Номера строк с заданными диетами и приемом пищи.
+        Пулы строятся один раз на снимок, повторные обращения - поиск в словаре.
+        """
+        key = (None if diets is None else frozenset(diets), meal_type)
+        rows = self._pools.get(key)
+        if rows is None:
+            diet_codes = None if diets is None else {DIET_CODES.index(d) for d in diets if d in DIET_CODES}
+            meal_code = None if meal_type is None else self.meal_code(meal_type)
+            rows = array('l', (
+                i for i in range(len(self.ids))
+                if (diet_codes is None or self.diet_codes[i] in diet_codes)
+                and (meal_code is None or self.meal_codes[i] == meal_code)
+            ))
+            self._pools[key] = rows
+        return rows
+
+    def select(self, diets=None, meal_type=None, exclude_terms=(), exclude_ids=()):
+        """Номера строк, подходящих под диеты, прием пищи и без исключенных продуктов."""
+        excluded = {self.index_by_id[rid] for rid in exclude_ids if rid in self.index_by_id}
+        for term in exclude_terms:
+            if term.strip():
+                excluded |= self.rows_with_term(term)
+        rows = self.pool(diets, meal_type)
+        if not excluded:
+            return list(rows)
+        return [i for i in rows if i not in excluded]
+
+    def filtered_pool(self, diets=None, meal_type=None, exclude_terms=()):
+        """
+        Пул select() без исключения по id, закэшированный по (диеты, прием пищи, набор аллергенов).
+        Первый запрос строит пул, следующие с тем же набором фильтров - O(1).
+        """
+        terms = frozenset(normalize_term(t) for t in exclude_terms if t.strip())
+        key = (None if diets is None else frozenset(diets), meal_type, terms)
+        rows = self._filtered_pools.get(key)
+        if rows is None:
+            rows = array('l', self.select(diets, meal_type, terms))
+            self._filtered_pools[key] = rows
+        return rows
+
+    def sample(self, k, diets=None, meal_type=None, rng=None):
+        """
+        Случайные k рецептов (без повторов) из пула: O(k), без загрузки каталога в список.
+        rng - свой random.Random (по умолчанию новый на вызов, глобальный random не используется).
+        Возвращает объекты CatalogRecipe.
+        """
+        rng = rng or random.Random()
+        rows = self.pool(diets, meal_type)
+        positions = rng.sample(range(len(rows)), min(k, len(rows)))
+        return [self.recipe(rows[pos]) for pos in positions]
+
+
+_snapshot = None
+_snapshot_lock = threading.Lock()
+
+
+def get_catalog():
+    """
+    Снимок каталога текущего процесса; перечитывается из БД только при смене версии.
+    Ждут загрузки только запросы до первого снимка. При смене версии снимок перечитывает
+    один поток, остальные тем временем отдают прежний, а не ждут на блокировке.
+    """
+    global _snapshot
+    version = catalog_version()
+    snapshot = _snapshot
+    if snapshot is None:
+        with _snapshot_lock:
+            if _snapshot is None:
+                _snapshot = CatalogSnapshot.load(version)
+            return _snapshot
+    if snapshot.version != version and _snapshot_lock.acquire(blocking=False):
+        try:
+            if _snapshot.version != version:
+                _snapshot = CatalogSnapshot.load(version)
+            snapshot = _snapshot
+        finally:
+            _snapshot_lock.release()
+    return snapshot
+
+
+def request_catalog(request):
+    """Снимок каталога, общий для всего запроса (ETag, чтение, генерация и сохранение рациона)."""
+    snapshot = getattr(request, 'catalog', None)
+    if snapshot is None:
+        snapshot = request.catalog = get_catalog()
+    return snapshot
+
+
+async def aget_catalog():
+    """Асинхронный get_catalog: в поток уходят только проверка версии в БД и перечитывание снимка."""
+    snapshot = _snapshot
+    if snapshot is not None and snapshot.version == _fresh_version():
+        return snapshot
+    return await sync_to_async(get_catalog)()
@@ -0,0 +1,66 @@
+"""
+Валидаторы ETag для страниц results и profile.
+
+Хэш собирается только из уже загруженных данных (пользователь с профилем, анкета в cookie,
+снимок каталога в памяти, версия избранного в профиле), поэтому при совпадении ответ 304 отдается
+без генерации рациона и рендеринга шаблона.
+"""
+import datetime
+import hashlib
+
+from django.conf import settings
+from django.contrib import messages
+
+from .catalog import request_catalog
+from .models import Profile
+from .plans import profile_version, refresh_stamp
+from .questionnaire import QUESTIONNAIRE_KEYS, load_answers
+
+def _digest(parts):
+    return hashlib.sha1("|".join(map(str, parts)).encode('utf-8')).hexdigest()
+
+
+def _request_parts(request):
+    """Общее для всех страниц: дата (неделя рациона), CSRF-секрет для форм и пользователь в шапке."""
+    user = request.user
+    return [datetime.date.today().isoformat(), request.META.get('CSRF_COOKIE', ''), user.pk, user.get_username(), getattr(user, 'email', '')]
+
+
+def _profile_parts(profile):
+    """Все поля профиля (включая версию избранного) и зависящие от времени счетчики подписки и обновления меню."""
+    return [getattr(profile, field.attname) for field in profile._meta.concrete_fields] + [
+        profile.has_active_subscription, profile.can_refresh_menu(), profile.days_until_next_refresh(),
+    ]
+
+
+def _has_pending_messages(request):
+    # Непоказанные сообщения выводятся в шаблоне, такой ответ нельзя заменять на 304
+    return len(messages.get_messages(request)) > 0
+
+
+def results_etag(request):
+    if _has_pending_messages(request):
+        return None
+    parts = _request_parts(request)
+    if request.user.is_authenticated:
+        try:
+            profile = request.user.profile
+        except Profile.DoesNotExist:
+            return None
+        parts += _profile_parts(profile) + [refresh_stamp(profile), profile_version(profile, request_catalog(request))]
+    else:
+        answers = load_answers(request)
+        parts += [answers.get(key) for key in QUESTIONNAIRE_KEYS]
+        parts += [request_catalog(request).content_hash, settings.PLANNER_ENGINE]
+    return _digest(parts)
+
+
+def profile_etag(request):
+    if _has_pending_messages(request):
+        return None
+    try:
+        profile = request.user.profile
+    except Profile.DoesNotExist:
+        return None
+    # Содержимое каталога - карточки избранных рецептов
+    return _digest(_request_parts(request) + _profile_parts(profile) + [request_catalog(request).content_hash])
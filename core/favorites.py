@@ -0,0 +1,40 @@
+from django.core.cache import cache
+
+from .models import Profile
+
+# Набор id избранных рецептов; ключ включает версию избранного профиля (Profile.favorites_version),
+# поэтому при изменении избранного старый набор просто перестает читаться и истекает по таймауту
+FAVORITE_IDS_KEY = 'core:favorite_ids:{}:{}'
+FAVORITE_IDS_TIMEOUT = 3600
+
+
+def favorite_ids(profile):
+    """Множество id избранных рецептов профиля из кэша; при промахе - один запрос к промежуточной таблице."""
+    key = FAVORITE_IDS_KEY.format(profile.pk, profile.favorites_version)
+    ids = cache.get(key)
+    if ids is None:
+        ids = frozenset(Profile.favorite_recipes.through.objects.filter(profile_id=profile.pk).values_list('recipe_id', flat=True))
+        cache.set(key, ids, FAVORITE_IDS_TIMEOUT)
+    return ids
+
+
+async def afavorite_ids(profile):
+    key = FAVORITE_IDS_KEY.format(profile.pk, profile.favorites_version)
+    ids = cache.get(key)
+    if ids is None:
+        rows = Profile.favorite_recipes.through.objects.filter(profile_id=profile.pk).values_list('recipe_id', flat=True)
+        ids = frozenset([recipe_id async for recipe_id in rows])
+        cache.set(key, ids, FAVORITE_IDS_TIMEOUT)
+    return ids
+
+
+def is_favorite(profile, recipe_id):
+    """Проверка по уникальному индексу (profile_id, recipe_id) без загрузки рецептов."""
+    return profile.favorite_recipes.filter(pk=recipe_id).exists()
+
+
+def parse_recipe_ids(values):
+    """Список id рецептов из JSON запроса; ValueError, если это не список целых чисел (1.5, "1" и true отклоняются)."""
+    if not isinstance(values, list) or not all(isinstance(value, int) and not isinstance(value, bool) for value in values):
+        raise ValueError(values)
+    return set(values)
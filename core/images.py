@@ -0,0 +1,86 @@
+"""
+Фото рецептов: локальная копия исходника и адаптивные миниатюры WebP/JPEG.
+
+Имена файлов строятся из хэша содержимого, поэтому файл по одному имени никогда
+не меняется и отдается с Cache-Control: immutable (nutritarget/media.py).
+Обработка изображений не обращается к Django и выполняется в процессах-воркерах
+команды build_thumbnails.
+"""
+import hashlib
+import io
+import os
+import urllib.request
+
+from PIL import Image, ImageOps
+
+ORIGINALS_DIR = 'recipes'
+THUMBNAILS_DIR = 'recipes/thumbs'
+
+# Формат в Recipe.thumbnails -> (формат Pillow, расширение, параметры кодирования)
+THUMBNAIL_FORMATS = {
+    'webp': ('WEBP', 'webp', {'quality': 80, 'method': 6}),
+    'jpeg': ('JPEG', 'jpg', {'quality': 82, 'optimize': True, 'progressive': True}),
+}
+
+# Ширина, которую браузер берет без srcset (и для карточки по умолчанию)
+DEFAULT_WIDTH = 640
+
+MAX_SOURCE_BYTES = 20 * 1024 * 1024
+
+
+def hashed_name(directory, content, suffix):
+    """Имя файла по содержимому: recipes/thumbs/<sha1[:16]><suffix>."""
+    return f"{directory}/{hashlib.sha1(content).hexdigest()[:16]}{suffix}"
+
+
+def fetch_image(url, timeout=15):
+    """Скачивает исходное фото по ссылке (Recipe.image_url)."""
+    request = urllib.request.Request(url, headers={'User-Agent': 'NutriTarget/1.0 (thumbnails)'})
+    with urllib.request.urlopen(request, timeout=timeout) as response:
+        content = response.read(MAX_SOURCE_BYTES + 1)
+    if len(content) > MAX_SOURCE_BYTES:
+        raise ValueError(f"Файл больше {MAX_SOURCE_BYTES} байт: {url}")
+    return content
+
+
+def render_thumbnails(content, sizes):
+    """
+    Миниатюры фото заданных ширин (не шире исходника) во всех форматах THUMBNAIL_FORMATS.
+    Возвращает {формат: {ширина: (имя файла, байты)}}.
+    """
+    with Image.open(io.BytesIO(content)) as source:
+        image = ImageOps.exif_transpose(source).convert('RGB')
+    widths = sorted({min(size, image.width) for size in sizes})
+    result = {fmt: {} for fmt in THUMBNAIL_FORMATS}
+    for width in widths:
+        height = max(1, round(image.height * width / image.width))
+        resized = image if width == image.width else image.resize((width, height), Image.Resampling.LANCZOS)
+        for fmt, (pil_format, extension, options) in THUMBNAIL_FORMATS.items():
+            buffer = io.BytesIO()
+            resized.save(buffer, pil_format, **options)
+            data = buffer.getvalue()
+            result[fmt][width] = (hashed_name(THUMBNAILS_DIR, data, f"-{width}.{extension}"), data)
+    return result
+
+
+def original_name(content, source_name):
+    """Имя локальной копии исходника: хэш содержимого с расширением исходного файла."""
+    extension = os.path.splitext(source_name.split('?', 1)[0])[1].lower()
+    if extension not in ('.jpg', '.jpeg', '.png', '.webp'):
+        extension = '.jpg'
+    return hashed_name(ORIGINALS_DIR, content, extension)
+
+
+def srcset(thumbnails, fmt, url):
+    """Значение srcset для формата fmt; url - функция имя файла -> адрес (default_storage.url)."""
+    renditions = sorted((int(width), name) for width, name in thumbnails.get(fmt, {}).items())
+    return ", ".join(f"{url(name)} {width}w" for width, name in renditions)
+
+
+def default_rendition(thumbnails, fmt='jpeg'):
+    """Миниатюра для src без srcset: ширина, ближайшая к DEFAULT_WIDTH."""
+    renditions = thumbnails.get(fmt) or {}
+    if not renditions:
+        return None
+    width = min(renditions, key=lambda w: abs(int(w) - DEFAULT_WIDTH))
+    return renditions[width]
@@ -1,24 +1,53 @@
 import re
+from collections import namedtuple
+from functools import lru_cache
+
+import numpy as np
+
+# Коэффициенты цели: дефицит/профицит калорий
+GOAL_FACTORS = {'lose': 0.85, 'gain': 1.15}
+# Доли БЖУ от калорийности и калорийность 1 г нутриента
+MACRO_SPLIT = {'p': (0.30, 4), 'f': (0.30, 9), 'c': (0.40, 4)}
+
+# Количество перед единицей измерения: "150г", "100 мл", "0.5шт"
+QUANTITY_RE = re.compile(r'(\d+(?:\.\d+)?)(?=\s*(?:г|мл|шт))')
+
+IngredientTemplate = namedtuple('IngredientTemplate', ['literals', 'quantities'])
+
+def parse_ingredients(description):
+    """
+    Разбирает состав на шаблон: текстовые фрагменты и количества между ними.
+    Пример: "Курица 100г, Яйцо 1шт" -> literals=("Курица ", "г, Яйцо ", "шт"), quantities=(100.0, 1.0)
+    """
+    literals, quantities = [], []
+    pos = 0
+    for match in QUANTITY_RE.finditer(description or ""):
+        literals.append(description[pos:match.start()])
+        quantities.append(float(match.group(1)))
+        pos = match.end()
+    literals.append((description or "")[pos:])
+    return IngredientTemplate(tuple(literals), tuple(quantities))
+
+def render_ingredients(template, multiplier):
+    """Собирает состав из шаблона, умножая количества на коэффициент."""
+    parts = [template.literals[0]]
+    for quantity, literal in zip(template.quantities, template.literals[1:]):
+        parts.append(str(round(quantity * multiplier)))
+        parts.append(literal)
+    return "".join(parts)
+
+@lru_cache(maxsize=4096)
+def _cached_template(description):
+    return parse_ingredients(description)
 
 def scale_ingredients(description, multiplier):
     """
-    Функция ищет числа в строке состава и умножает их на коэффициент.
+    Пересчет граммовки ингредиентов: умножаются только количества с единицами (г, мл, шт).
     Пример: "Курица 100г" при multiplier=1.5 станет "Курица 150г"
     """
     if not description:
         return ""
-
-    def multiply(match):
-        # Находим число в строке
-        number = float(match.group(0))
-        # Умножаем на множитель и округляем
-        new_number = round(number * multiplier)
-        # Возвращаем как целое число (строкой)
-        return str(int(new_number))
-
-    # Регулярное выражение ищет любые числа в тексте
-    scaled_text = re.sub(r"\d+", multiply, description)
-    return scaled_text
+    return render_ingredients(_cached_template(description), multiplier)
 
 def calculate_macros(data):
     """
@@ -53,20 +82,36 @@ def calculate_macros(data):
     # 3. Учет активности (TDEE)
     tdee = bmr * activity
     
-    # 4. Учет цели 
-    if goal == 'lose':
-        tdee *= 0.85 # Дефицит 15%
-    elif goal == 'gain':
-        tdee *= 1.15 # Профицит 15%
+    # 4. Учет цели (дефицит/профицит 15%)
+    tdee *= GOAL_FACTORS.get(goal, 1.0)
         
     # 5. Расчет БЖУ 
-    protein = (tdee * 0.30) / 4
-    fat = (tdee * 0.30) / 9
-    carbs = (tdee * 0.40) / 4
-    
-    return {
-        'kcal': round(tdee),
-        'p': round(protein),
-        'f': round(fat),
-        'c': round(carbs)
-    }
\ No newline at end of file
+    result = {'kcal': round(tdee)}
+    for key, (share, kcal_per_gram) in MACRO_SPLIT.items():
+        result[key] = round((tdee * share) / kcal_per_gram)
+    return result
+
+def calculate_macros_batch(weight, height, age, gender, activity, goal):
+    """
+    Векторный расчет КБЖУ для массивов анкет (та же формула, что в calculate_macros).
+    gender и goal - массивы строк ('male'/'female', 'lose'/'maintain'/'gain').
+    Возвращает словарь целочисленных массивов с ключами kcal, p, f, c.
+    """
+    w = np.asarray(weight, dtype=np.float64)
+    h = np.asarray(height, dtype=np.float64)
+    a = np.asarray(age, dtype=np.float64)
+    activity = np.asarray(activity, dtype=np.float64)
+    gender = np.asarray(gender, dtype=object)
+    goal = np.asarray(goal, dtype=object)
+
+    bmr = (10 * w) + (6.25 * h) - (5 * a) + np.where(gender == 'male', 5, -161)
+    goal_factor = np.ones_like(w)
+    for name, factor in GOAL_FACTORS.items():
+        goal_factor[goal == name] = factor
+    tdee = bmr * activity * goal_factor
+
+    # np.rint, как и round(), округляет половины к четному
+    result = {'kcal': np.rint(tdee).astype(np.int64)}
+    for key, (share, kcal_per_gram) in MACRO_SPLIT.items():
+        result[key] = np.rint((tdee * share) / kcal_per_gram).astype(np.int64)
+    return result
\ No newline at end of file
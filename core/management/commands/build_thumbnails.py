@@ -0,0 +1,129 @@
+import multiprocessing
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+
+# Воркеры выполняют только _render: скачивание и обработку Pillow, без обращений к БД и хранилищу.
+# Файлы сохраняет родительский процесс через default_storage, поэтому команда работает и с внешним хранилищем
+
+
+def _render(recipe_id, path, content, url, sizes, timeout):
+    from core.images import fetch_image, original_name, render_thumbnails
+    try:
+        original = None
+        if path is not None:
+            with open(path, 'rb') as source:
+                content = source.read()
+        elif content is None:
+            content = fetch_image(url, timeout)
+            original = (original_name(content, url), content)
+        return recipe_id, original, render_thumbnails(content, sizes), None
+    except Exception as error:
+        return recipe_id, None, None, f"{type(error).__name__}: {error}"
+
+
+def _save(name, content):
+    """Файлы названы по содержимому: существующий файл с тем же именем уже нужный."""
+    if not default_storage.exists(name):
+        default_storage.save(name, ContentFile(content))
+
+
+def _source(recipe):
+    """Аргументы _render для локального фото: путь, если хранилище файловое, иначе содержимое."""
+    try:
+        return default_storage.path(recipe.image.name), None
+    except NotImplementedError:
+        with default_storage.open(recipe.image.name, 'rb') as source:
+            return None, source.read()
+
+
+class Command(BaseCommand):
+    help = (
+        "Сохраняет фото рецептов локально и строит адаптивные миниатюры WebP/JPEG "
+        "(RECIPE_THUMBNAIL_SIZES) в пуле процессов. Имена файлов - хэш содержимого."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--workers', type=int, default=os.cpu_count() or 1, help="Процессов обработки")
+        parser.add_argument('--chunk-size', type=int, default=200, help="Рецептов в одной пачке")
+        parser.add_argument('--sizes', type=int, nargs='+', help="Ширины миниатюр (по умолчанию RECIPE_THUMBNAIL_SIZES)")
+        parser.add_argument('--force', action='store_true', help="Перестроить миниатюры и для рецептов, где они уже есть")
+        parser.add_argument('--no-fetch', action='store_true', help="Не скачивать фото по image_url, только локальные")
+        parser.add_argument('--timeout', type=float, default=15, help="Таймаут скачивания, секунд")
+
+    def handle(self, *args, **options):
+        from core.catalog import bump_catalog_version
+        from core.models import Recipe
+
+        sizes = tuple(options['sizes'] or settings.RECIPE_THUMBNAIL_SIZES)
+        if options['workers'] < 1 or options['chunk_size'] < 1 or min(sizes) < 1:
+            raise CommandError("--workers, --chunk-size и --sizes должны быть положительными")
+
+        recipes = Recipe.objects.order_by('id').only('id', 'image', 'image_url', 'thumbnails')
+        if not options['force']:
+            recipes = recipes.filter(thumbnails={})
+
+        started = time.perf_counter()
+        total = built = skipped = 0
+        failures = []
+        context = multiprocessing.get_context('spawn')
+        with ProcessPoolExecutor(max_workers=options['workers'], mp_context=context) as pool:
+            last_id = 0
+            while True:
+                # Пачками по первичному ключу: в памяти только файлы текущей пачки
+                chunk = list(recipes.filter(id__gt=last_id)[:options['chunk_size']])
+                if not chunk:
+                    break
+                last_id = chunk[-1].id
+                total += len(chunk)
+
+                by_id = {recipe.id: recipe for recipe in chunk}
+                futures = []
+                for recipe in chunk:
+                    if recipe.image:
+                        path, content = _source(recipe)
+                        futures.append(pool.submit(_render, recipe.id, path, content, None, sizes, options['timeout']))
+                    elif recipe.image_url and not options['no_fetch']:
+                        futures.append(pool.submit(_render, recipe.id, None, None, recipe.image_url, sizes, options['timeout']))
+                    else:
+                        skipped += 1
+
+                updates = []
+                for future in as_completed(futures):
+                    recipe_id, original, renditions, error = future.result()
+                    if error:
+                        failures.append((recipe_id, error))
+                        continue
+                    recipe = by_id[recipe_id]
+                    if original:
+                        _save(*original)
+                        recipe.image = original[0]
+                    recipe.thumbnails = {}
+                    for fmt, files in renditions.items():
+                        for width, (name, content) in files.items():
+                            _save(name, content)
+                        recipe.thumbnails[fmt] = {str(width): name for width, (name, _) in files.items()}
+                    updates.append(recipe)
+
+                if updates:
+                    # bulk_update не отправляет post_save, версия каталога сбрасывается ниже один раз
+                    with transaction.atomic():
+                        Recipe.objects.bulk_update(updates, ['image', 'thumbnails'], batch_size=500)
+                    built += len(updates)
+                self.stdout.write(f"Обработано рецептов: {total}")
+
+        if built:
+            bump_catalog_version()
+        for recipe_id, error in failures[:20]:
+            self.stderr.write(f"Рецепт {recipe_id}: {error}")
+        elapsed = time.perf_counter() - started
+        self.stdout.write(self.style.SUCCESS(
+            f"Миниатюры построены для {built} из {total} рецептов за {elapsed:.1f} с. "
+            f"Без фото: {skipped}, ошибок: {len(failures)}."
+        ))
@@ -0,0 +1,55 @@
+import random
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from core.models import Recipe
+from core.synthetic import (
+    DEFAULT_DIET_DIST, DEFAULT_MEAL_DIST, clear_synthetic_data, create_recipes, create_users, parse_distribution,
+)
+
+
+def _format_dist(dist):
+    return ",".join(f"{key}={value}" for key, value in dist.items())
+
+
+class Command(BaseCommand):
+    help = "Генерирует синтетический каталог рецептов и пользователей для нагрузочного тестирования."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--recipes', type=int, default=10000, help="Количество рецептов")
+        parser.add_argument('--users', type=int, default=1000, help="Количество пользователей с профилями")
+        parser.add_argument('--favorites', type=int, default=5, help="Избранных рецептов на пользователя")
+        parser.add_argument('--seed', type=int, default=42, help="Зерно генератора (одинаковое зерно - одинаковые данные)")
+        parser.add_argument('--diet-dist', default=_format_dist(DEFAULT_DIET_DIST), help="Распределение диет, например all=0.4,vege=0.3")
+        parser.add_argument('--meal-dist', default=_format_dist(DEFAULT_MEAL_DIST), help="Распределение приемов пищи")
+        parser.add_argument('--allergen-freq', type=float, default=0.15, help="Доля рецептов с аллергенами и пользователей с аллергиями")
+        parser.add_argument('--premium-share', type=float, default=0.2, help="Доля пользователей с подпиской")
+        parser.add_argument('--batch-size', type=int, default=5000, help="Строк в одной транзакции")
+        parser.add_argument('--clear', action='store_true', help="Удалить все рецепты и синтетических пользователей перед генерацией")
+
+    def handle(self, *args, **options):
+        try:
+            diet_dist = parse_distribution(options['diet_dist'], [slug for slug, _ in Recipe.DIET_TYPES])
+            meal_dist = parse_distribution(options['meal_dist'], [slug for slug, _ in Recipe.MEAL_TYPES])
+        except ValueError as e:
+            raise CommandError(e)
+
+        rng = random.Random(options['seed'])
+        progress = lambda message: self.stdout.write(message)
+        started = time.perf_counter()
+
+        if options['clear']:
+            self.stdout.write("Удаление старых данных...")
+            clear_synthetic_data()
+
+        recipes = create_recipes(
+            options['recipes'], rng, diet_dist, meal_dist, options['allergen_freq'], options['batch_size'], progress,
+        )
+        users = create_users(
+            options['users'], rng, diet_dist, options['allergen_freq'], options['premium_share'],
+            options['favorites'], options['batch_size'], progress,
+        )
+
+        elapsed = time.perf_counter() - started
+        self.stdout.write(self.style.SUCCESS(f"Готово за {elapsed:.1f} с: {recipes} рецептов, {users} пользователей."))
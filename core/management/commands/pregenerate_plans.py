@@ -0,0 +1,91 @@
+import datetime
+import multiprocessing
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import django
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+
+# Модели импортируются внутри функций: процессы запускаются через spawn и импортируют
+# этот модуль до django.setup(), зато не наследуют соединения с БД родителя
+
+
+def _init_worker():
+    django.setup()
+
+
+def _pregenerate_chunk(user_ids, day):
+    from core.plans import pregenerate_plans
+    return len(user_ids), pregenerate_plans(user_ids, day)
+
+
+def next_monday(today=None):
+    today = today or datetime.date.today()
+    return today + datetime.timedelta(days=7 - today.weekday())
+
+
+class Command(BaseCommand):
+    help = (
+        "Заранее генерирует рационы на следующую неделю для всех активных профилей, "
+        "чтобы в понедельник results читал готовые рационы, и удаляет рационы прошедших недель. "
+        "Запускать по расписанию (cron) до начала недели."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--week-of', type=datetime.date.fromisoformat, help="Любая дата нужной недели (по умолчанию - следующий понедельник)")
+        parser.add_argument('--workers', type=int, default=os.cpu_count() or 1, help="Процессов генерации (1 - в текущем процессе, без пула)")
+        parser.add_argument('--chunk-size', type=int, default=500, help="Пользователей в одной задаче")
+        parser.add_argument('--active-days', type=int, default=30, help="Только пользователи, заходившие за последние N дней (0 - все)")
+        parser.add_argument('--no-prune', action='store_true', help="Не удалять рационы недель раньше текущей")
+
+    def handle(self, *args, **options):
+        from django.contrib.auth.models import User
+        from core.plans import prune_plans
+
+        day = options['week_of'] or next_monday()
+        if options['workers'] < 1 or options['chunk_size'] < 1:
+            raise CommandError("--workers и --chunk-size должны быть положительными")
+
+        users = User.objects.filter(is_active=True, profile__target_kcal__gt=0).order_by('id')
+        if options['active_days']:
+            users = users.filter(last_login__gte=timezone.now() - datetime.timedelta(days=options['active_days']))
+
+        def chunks():
+            # Постраничный обход по первичному ключу: в память попадают только id очередной пачки
+            last_id = 0
+            while True:
+                user_ids = list(users.filter(id__gt=last_id).values_list('id', flat=True)[:options['chunk_size']])
+                if not user_ids:
+                    return
+                last_id = user_ids[-1]
+                yield user_ids
+
+        started = time.perf_counter()
+        total = created = 0
+        for chunk_total, chunk_created in self._run(chunks(), day, options['workers']):
+            total += chunk_total
+            created += chunk_created
+            self.stdout.write(f"Обработано пользователей: {total}")
+
+        if not options['no_prune']:
+            self.stdout.write(f"Удалено рационов прошедших недель: {prune_plans()}")
+
+        iso_year, iso_week, _ = day.isocalendar()
+        elapsed = time.perf_counter() - started
+        self.stdout.write(self.style.SUCCESS(
+            f"Неделя {iso_year}-W{iso_week:02d}: создано рационов {created} для {total} пользователей за {elapsed:.1f} с."
+        ))
+
+    def _run(self, chunks, day, workers):
+        """Результаты _pregenerate_chunk по пачкам; при одном процессе генерация идет в текущем, без пула."""
+        if workers == 1:
+            for user_ids in chunks:
+                yield _pregenerate_chunk(user_ids, day)
+            return
+        context = multiprocessing.get_context('spawn')
+        with ProcessPoolExecutor(max_workers=workers, mp_context=context, initializer=_init_worker) as pool:
+            futures = [pool.submit(_pregenerate_chunk, user_ids, day) for user_ids in chunks]
+            for future in as_completed(futures):
+                yield future.result()
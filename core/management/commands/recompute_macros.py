@@ -0,0 +1,52 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from core.logic import calculate_macros_batch
+from core.models import Profile
+
+TARGET_FIELDS = ['target_kcal', 'target_protein', 'target_fat', 'target_carbs']
+
+
+class Command(BaseCommand):
+    help = "Пересчитывает целевые КБЖУ всех заполненных профилей (после изменения коэффициентов)."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--chunk-size', type=int, default=5000, help="Сколько профилей обрабатывать за раз")
+        parser.add_argument('--dry-run', action='store_true', help="Только посчитать, ничего не записывая")
+
+    def handle(self, *args, **options):
+        chunk_size = options['chunk_size']
+        filled = Profile.objects.filter(weight__isnull=False, height__isnull=False, age__isnull=False).order_by('id')
+
+        last_id = 0
+        total = changed = 0
+        while True:
+            # Постраничный обход по первичному ключу: память не зависит от числа профилей
+            rows = list(filled.filter(id__gt=last_id).values_list(
+                'id', 'weight', 'height', 'age', 'gender', 'activity', 'goal', *TARGET_FIELDS,
+            )[:chunk_size])
+            if not rows:
+                break
+            last_id = rows[-1][0]
+            total += len(rows)
+
+            ids, weight, height, age, gender, activity, goal, *current = zip(*rows)
+            macros = calculate_macros_batch(
+                weight, height, age, gender,
+                [a if a is not None else 1.2 for a in activity],
+                goal,
+            )
+            new_values = zip(macros['kcal'].tolist(), macros['p'].tolist(), macros['f'].tolist(), macros['c'].tolist())
+
+            updates = []
+            for pk, old, new in zip(ids, zip(*current), new_values):
+                if tuple(old) != new:
+                    updates.append(Profile(id=pk, **dict(zip(TARGET_FIELDS, new))))
+            changed += len(updates)
+
+            if updates and not options['dry_run']:
+                with transaction.atomic():
+                    Profile.objects.bulk_update(updates, TARGET_FIELDS, batch_size=500)
+
+        action = "Будет обновлено" if options['dry_run'] else "Обновлено"
+        self.stdout.write(self.style.SUCCESS(f"Проверено профилей: {total}. {action}: {changed}."))
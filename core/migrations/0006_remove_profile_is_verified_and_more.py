@@ -0,0 +1,42 @@
+# Generated by Django 6.0.1 on 2026-10-18 10:12
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0005_remove_profile_last_update_and_more'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.RemoveField(
+            model_name='profile',
+            name='is_verified',
+        ),
+        migrations.RemoveField(
+            model_name='profile',
+            name='verification_code',
+        ),
+        migrations.CreateModel(
+            name='WeeklyPlan',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('iso_year', models.PositiveSmallIntegerField(verbose_name='Год (ISO)')),
+                ('iso_week', models.PositiveSmallIntegerField(verbose_name='Неделя (ISO)')),
+                ('refresh_stamp', models.BigIntegerField(default=0, verbose_name='Метка обновления')),
+                ('profile_version', models.CharField(max_length=40, verbose_name='Версия профиля')),
+                ('days', models.JSONField(verbose_name='Рацион по дням')),
+                ('created_at', models.DateTimeField(auto_now_add=True, verbose_name='Создан')),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='weekly_plans', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'verbose_name': 'Недельный рацион',
+                'verbose_name_plural': 'Недельные рационы',
+                'constraints': [models.UniqueConstraint(fields=('user', 'iso_year', 'iso_week', 'refresh_stamp', 'profile_version'), name='core_weeklyplan_unique_key')],
+            },
+        ),
+    ]
@@ -0,0 +1,19 @@
+# Generated by Django 6.0.1 on 2026-10-18 11:05
+
+import core.models
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0009_catalogversion'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='profile',
+            name='favorites_version',
+            field=models.CharField(default=core.models.new_favorites_version, editable=False, max_length=32, verbose_name='Версия избранного'),
+        ),
+    ]
@@ -1,10 +1,12 @@
 from django.db import models
 from django.contrib.auth.models import User
 from django.core.validators import MinValueValidator, MaxValueValidator
-from django.db.models.signals import post_save
+from django.db import transaction
+from django.db.models.signals import pre_save, post_save, post_delete, m2m_changed
 from django.dispatch import receiver
 from django.utils import timezone
 import datetime 
+import uuid
 
 class Recipe(models.Model):
     DIET_TYPES = [
@@ -30,6 +32,9 @@ class Recipe(models.Model):
         
     description = models.TextField(verbose_name="Состав и рецепт")
     image_url = models.URLField(blank=True, null=True, verbose_name="Ссылка на фото")
+    # Локальная копия фото и адаптивные миниатюры {формат: {ширина: имя файла}} (manage.py build_thumbnails)
+    image = models.ImageField(upload_to='uploads/recipes/', blank=True, verbose_name="Фото")
+    thumbnails = models.JSONField(default=dict, blank=True, verbose_name="Миниатюры")
 
     class Meta:
         verbose_name = "Рецепт"
@@ -38,6 +43,21 @@ class Recipe(models.Model):
     def __str__(self):
         return f"{self.get_meal_type_display()}: {self.title}"
 
+class CatalogVersion(models.Model):
+    """
+    Версия каталога рецептов (одна строка): случайный токен, который меняется при любой правке рецептов.
+    Хранится в БД, а не в кэше процесса, чтобы правку из админки, команды или скрипта увидели все воркеры.
+    """
+    version = models.CharField(max_length=32, default='')
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        verbose_name = "Версия каталога"
+        verbose_name_plural = "Версия каталога"
+
+def new_favorites_version():
+    return uuid.uuid4().hex
+
 class Profile(models.Model):
     # Основная связь
     user = models.OneToOneField(User, on_delete=models.CASCADE, related_name='profile')
@@ -62,6 +82,8 @@ class Profile(models.Model):
         
     # ИЗБРАННОЕ (связь многие-ко-многим)
     favorite_recipes = models.ManyToManyField(Recipe, related_name='fans', blank=True, verbose_name="Избранные рецепты")
+    # Случайный токен, меняется при любом изменении избранного: входит в ETag страниц и ключ кэша набора избранного
+    favorites_version = models.CharField(max_length=32, default=new_favorites_version, editable=False, verbose_name="Версия избранного")
     
     # ПОДПИСКА И ЛИМИТЫ 
     is_subscribed = models.BooleanField(default=False, verbose_name="Премиум подписка")
@@ -80,6 +102,15 @@ class Profile(models.Model):
     def __str__(self):
         return f"Профиль {self.user.username}"
 
+    def save_changes(self, **values):
+        """Присваивает значения и сохраняет только изменившиеся поля. Возвращает список измененных полей."""
+        changed = [name for name, value in values.items() if getattr(self, name) != value]
+        for name in changed:
+            setattr(self, name, values[name])
+        if changed:
+            self.save(update_fields=changed)
+        return changed
+
     # --- ОБНОВЛЕННЫЙ МЕТОД: Проверка активной подписки ---
     @property
     def has_active_subscription(self):
@@ -119,12 +150,79 @@ class Profile(models.Model):
         # Округляем до целых дней, прибавляя 1, чтобы показать "через 3 дня" вместо "через 2.x дня"
         return time_until_next_refresh.days + 1
 
-# Автоматическое создание профиля при регистрации пользователя
+class WeeklyPlan(models.Model):
+    """Сгенерированный недельный рацион пользователя.
+
+    Рацион полностью определяется пользователем, ISO-неделей, меткой
+    последнего обновления и версией входных данных профиля, поэтому
+    генерируется один раз и дальше читается одним запросом.
+    """
+    # Отдельный индекс по user не нужен: уникальный индекс ключа начинается с user_id
+    # и обслуживает и чтение рациона, и удаление всех рационов пользователя
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='weekly_plans', db_index=False)
+    iso_year = models.PositiveSmallIntegerField(verbose_name="Год (ISO)")
+    iso_week = models.PositiveSmallIntegerField(verbose_name="Неделя (ISO)")
+    refresh_stamp = models.BigIntegerField(default=0, verbose_name="Метка обновления")
+    profile_version = models.CharField(max_length=40, verbose_name="Версия профиля")
+    days = models.JSONField(verbose_name="Рацион по дням")
+    created_at = models.DateTimeField(auto_now_add=True, verbose_name="Создан")
+
+    class Meta:
+        verbose_name = "Недельный рацион"
+        verbose_name_plural = "Недельные рационы"
+        constraints = [
+            models.UniqueConstraint(
+                fields=['user', 'iso_year', 'iso_week', 'refresh_stamp', 'profile_version'],
+                name='core_weeklyplan_unique_key',
+            ),
+        ]
+
+    def __str__(self):
+        return f"Рацион {self.user_id}: {self.iso_year}-W{self.iso_week}"
+
+# Автоматическое создание профиля при регистрации пользователя.
+# Профиль пишется только при создании пользователя: обычные сохранения User
+# (например, обновление last_login при каждом входе) профиль не трогают.
 @receiver(post_save, sender=User)
-def create_or_save_user_profile(sender, instance, created, **kwargs):
-    if created:
-        Profile.objects.create(user=instance)
-    # Если профиль уже существует, но, например, был создан вручную без is_verified = False,
-    # убедимся, что все новые поля инициализированы.
-    # Если профиль не создан при created=True, то он должен существовать, и мы его сохраняем.
-    instance.profile.save() # instance.profile это OneToOne связь к User
+def create_user_profile(sender, instance, created, raw=False, **kwargs):
+    if created and not raw:
+        Profile.objects.get_or_create(user=instance)
+
+# Новое фото делает миниатюры прежнего устаревшими: они очищаются (фото показывается как есть),
+# пока build_thumbnails не построит новые
+@receiver(pre_save, sender=Recipe)
+def reset_recipe_thumbnails(sender, instance, raw=False, update_fields=None, **kwargs):
+    if raw or instance._state.adding or not instance.thumbnails:
+        return
+    if update_fields is not None and 'image' not in update_fields:
+        return
+    stored = Recipe.objects.filter(pk=instance.pk).values_list('image', flat=True).first()
+    if stored is not None and stored != instance.image.name:
+        instance.thumbnails = {}
+        if update_fields is not None:
+            # save(update_fields=...) не запишет поле, которого нет в списке
+            Recipe.objects.filter(pk=instance.pk).update(thumbnails={})
+
+# Любое изменение рецептов делает устаревшими снимки каталога в памяти воркеров
+@receiver([post_save, post_delete], sender=Recipe)
+def bump_recipe_catalog_version(sender, **kwargs):
+    from .catalog import bump_catalog_version
+    transaction.on_commit(bump_catalog_version)
+
+# Изменение избранного меняет версию набора избранного (входит в ETag страниц).
+# Версия обновляется в той же транзакции, что и само избранное
+@receiver(m2m_changed, sender=Profile.favorite_recipes.through)
+def bump_profile_favorites_version(sender, instance, action, reverse, pk_set, **kwargs):
+    if reverse:
+        # Изменение со стороны рецепта (recipe.fans): затронуты все профили из pk_set
+        if action == 'pre_clear':
+            instance._cleared_fans = list(instance.fans.values_list('pk', flat=True))
+            return
+        profile_ids = instance.__dict__.pop('_cleared_fans', []) if action == 'post_clear' else list(pk_set or ())
+    else:
+        profile_ids = [instance.pk]
+    if action in ('post_add', 'post_remove', 'post_clear') and profile_ids:
+        version = new_favorites_version()
+        Profile.objects.filter(pk__in=profile_ids).update(favorites_version=version)
+        if not reverse:
+            instance.favorites_version = version
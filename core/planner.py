@@ -0,0 +1,257 @@
+"""
+Планировщик рациона: чистые функции над снимком каталога (core.catalog.CatalogSnapshot).
+
+Модуль не обращается к Django, БД и кэшу, а случайность берет только из своего
+random.Random, созданного из зерна на каждый вызов. Поэтому генерацию можно
+одновременно вызывать из нескольких потоков, из пакетных задач и из пула процессов,
+а одно и то же зерно всегда дает один и тот же рацион.
+"""
+import logging
+import random
+import time
+
+import numpy as np
+
+from .logic import render_ingredients
+
+logger = logging.getLogger(__name__)
+
+MEAL_DIST = {
+    'breakfast': {'ratio': 0.25, 'label': 'ЗАВТРАК'},
+    'snack': {'ratio': 0.15, 'label': 'ПЕРЕКУС'},
+    'lunch': {'ratio': 0.35, 'label': 'ОБЕД'},
+    'dinner': {'ratio': 0.25, 'label': 'УЖИН'},
+}
+DAYS = ['Понедельник', 'Вторник', 'Среда', 'Четверг', 'Пятница', 'Суббота', 'Воскресенье']
+
+# Иерархия диет: какие рецепты допустимы при выбранном типе питания
+DIET_HIERARCHY = {
+    'vegan': ['vegan'],
+    'vege': ['vegan', 'vege'],
+    'pesca': ['vegan', 'vege', 'pesca'],
+    'all': ['vegan', 'vege', 'pesca', 'all'],
+}
+
+# Режимы планировщика: случайный подбор под калорийность или подбор под все КБЖУ
+PLANNER_ENGINES = ('shuffle', 'optimize')
+
+MACRO_KEYS = ('kcal', 'p', 'f', 'c')
+
+# Настройки оптимизатора
+OPTIMIZER_POOL_SIZE = 64      # Кандидатов на прием пищи после отсева по соотношению БЖУ
+OPTIMIZER_DAY_SAMPLE = 24     # Кандидатов, рассматриваемых для одного дня (для разнообразия)
+OPTIMIZER_PASSES = 3          # Проходов покоординатного спуска по приемам пищи: предел работы на день
+PORTION_TOLERANCE = 0.25      # Допустимое отклонение калорийности приема пищи от его доли
+REPEAT_PENALTY = 0.05         # Штраф за повтор рецепта в течение недели
+DEFAULT_TIME_LIMIT = 1.0      # Аварийный предел времени генерации недели, секунд
+
+
+def allowed_diets(diet_pref):
+    return DIET_HIERARCHY.get(diet_pref, ['all'])
+
+
+def parse_allergies(allergies):
+    """Список аллергенов из строки профиля/сессии ("орех,глютен")."""
+    return [a.strip() for a in (allergies or '').split(',') if a.strip()]
+
+
+def candidate_rows(catalog, diet_pref, allergies, meal_type=None):
+    """Строки каталога, допустимые для пользователя: единые правила для рациона и замены блюд."""
+    return catalog.filtered_pool(allowed_diets(diet_pref), meal_type, parse_allergies(allergies))
+
+
+def make_meal(catalog, index, m_slug, multiplier):
+    """Карточка приема пищи: рецепт из каталога, пересчитанный на порцию."""
+    recipe = catalog.recipe(index)
+    return {
+        'id': recipe.id,
+        'type': MEAL_DIST[m_slug]['label'],
+        'type_slug': m_slug,
+        'title': recipe.title,
+        'weight': round(100 * multiplier),
+        'kcal': round(recipe.calories * multiplier),
+        'p': round(recipe.protein * multiplier),
+        'f': round(recipe.fat * multiplier),
+        'c': round(recipe.carbs * multiplier),
+        'image': recipe.image_url,
+        'srcset_webp': recipe.srcset_webp,
+        'srcset_jpeg': recipe.srcset_jpeg,
+        'ingredients': render_ingredients(catalog.templates[index], multiplier),
+    }
+
+
+def day_deviation(meals, macros):
+    """Отклонение суммы за день от целевых КБЖУ в процентах."""
+    deviation = {}
+    for key in MACRO_KEYS:
+        total = sum(meal[key] for meal in meals)
+        deviation[key] = round(100 * (total - macros[key]) / macros[key], 1) if macros[key] else 0.0
+    return deviation
+
+
+def build_weekly_plan(catalog, indexes, macros, seed, engine='shuffle', time_limit=DEFAULT_TIME_LIMIT):
+    """
+    Собирает рацион на неделю из подходящих строк каталога.
+    macros - целевые КБЖУ (результат calculate_macros), seed - зерно генерации.
+    Каждый день содержит 'deviation' - отклонение от целевых КБЖУ в процентах.
+    """
+    return list(iter_weekly_plan(catalog, indexes, macros, seed, engine, time_limit))
+
+
+def iter_weekly_plan(catalog, indexes, macros, seed, engine='shuffle', time_limit=DEFAULT_TIME_LIMIT, days=None):
+    """
+    Генератор дней того же рациона, что и build_weekly_plan, по одному дню.
+    days - номера дней (0 - понедельник), которые нужно выдать: остальные дни только
+    продвигают состояние генератора без сборки карточек, после последнего нужного
+    дня генерация прекращается.
+    """
+    if engine == 'optimize':
+        return _optimized_plan(catalog, indexes, macros, seed, time_limit, days)
+    return _shuffled_plan(catalog, indexes, macros, seed, days)
+
+
+def _shuffled_plan(catalog, indexes, macros, seed, days=None):
+    """Случайный подбор: рецепты перемешиваются, порция подгоняется под долю калорий."""
+    rng = random.Random(seed)
+    target_kcal = macros['kcal']
+    last_day = max(days) if days else len(DAYS) - 1
+
+    meal_codes = catalog.meal_codes
+    codes = {m: catalog.meal_code(m) for m in MEAL_DIST}
+    pools = {m: [i for i in indexes if meal_codes[i] == codes[m]] for m in MEAL_DIST.keys()}
+    for p in pools.values(): rng.shuffle(p)
+    iterators = {m: iter(p) for m, p in pools.items()}
+
+    for day_number, day_name in enumerate(DAYS[:last_day + 1]):
+        wanted = days is None or day_number in days
+        day_meals = []
+        for m_slug, details in MEAL_DIST.items():
+            try:
+                index = next(iterators[m_slug])
+            except (StopIteration, KeyError):
+                if not pools.get(m_slug): continue
+                rng.shuffle(pools[m_slug])
+                iterators[m_slug] = iter(pools[m_slug])
+                index = next(iterators[m_slug])
+
+            if not wanted:
+                continue
+            kcal = catalog.calories[index]
+            multiplier = (target_kcal * details['ratio']) / kcal if kcal > 0 else 1
+            day_meals.append(make_meal(catalog, index, m_slug, multiplier))
+        if wanted:
+            yield {'day_name': day_name, 'meals': day_meals, 'deviation': day_deviation(day_meals, macros)}
+
+
+def _prune_pools(catalog, indexes, target):
+    """
+    Отсев кандидатов: для каждого приема пищи остаются рецепты, чье соотношение
+    БЖУ (доли энергии) ближе всего к целевому. Работает за O(N) векторно.
+    """
+    nutrients = catalog.nutrient_matrix()
+    indexes = np.asarray(indexes, dtype=np.int64)
+    meal_codes = np.frombuffer(catalog.meal_codes, dtype=np.int8)[indexes]
+    energy = np.array([4.0, 9.0, 4.0])
+    target_split = target[1:] * energy / target[0]
+
+    pools = {}
+    for m_slug in MEAL_DIST:
+        pool = indexes[meal_codes == catalog.meal_code(m_slug)]
+        pool = pool[nutrients[pool, 0] > 0]
+        if not len(pool):
+            continue
+        split = nutrients[pool, 1:] * energy / nutrients[pool, :1]
+        distance = ((split - target_split) ** 2).sum(axis=1)
+        if len(pool) > OPTIMIZER_POOL_SIZE:
+            pool = pool[np.sort(np.argpartition(distance, OPTIMIZER_POOL_SIZE)[:OPTIMIZER_POOL_SIZE])]
+        pools[m_slug] = pool
+    return pools
+
+
+def _fit_portions(vectors, target, scale, low, high):
+    """
+    Подбор коэффициентов порций: минимизация относительного отклонения суммы от целевых КБЖУ
+    с ограничением калорийности каждого приема пищи (метод активного множества на 4 переменных).
+    """
+    a = vectors.T / scale[:, None]
+    b = target / scale
+    x = np.clip(np.linalg.lstsq(a, b, rcond=None)[0], low, high)
+    fixed = (x <= low) | (x >= high)
+    for _ in range(len(x)):
+        free = ~fixed
+        if not free.any():
+            break
+        residual = b - a[:, fixed] @ x[fixed]
+        x[free] = np.linalg.lstsq(a[:, free], residual, rcond=None)[0]
+        violated = free & ((x < low) | (x > high))
+        x = np.clip(x, low, high)
+        if not violated.any():
+            break
+        fixed |= violated
+    # Калорийность важнее остальных нутриентов: общий масштаб порций подгоняется под нее точно
+    kcal = vectors[:, 0] @ x
+    return x * (target[0] / kcal) if kcal > 0 else x
+
+
+def _optimized_plan(catalog, indexes, macros, seed, time_limit, days=None):
+    """
+    Подбор под все КБЖУ: для каждого дня покоординатный спуск по приемам пищи
+    на отсеянных пулах, затем подгонка порций. Объем работы ограничен не временем,
+    а числом кандидатов (OPTIMIZER_DAY_SAMPLE, не больше пула) и проходов
+    (OPTIMIZER_PASSES), поэтому рацион зависит только от зерна и не меняется
+    под нагрузкой на процессор. time_limit - аварийный предел на случай патологически
+    медленной генерации: при его исчерпании оставшиеся дни берут кандидатов без
+    улучшения. В предел входит только время самой генерации, а не паузы между днями
+    у потребителя генератора.
+    """
+    time_left = time_limit
+    rng = random.Random(seed)
+    nutrients = catalog.nutrient_matrix()
+    target = np.array([macros[key] for key in MACRO_KEYS], dtype=np.float64)
+    scale = np.where(target > 0, target, 1.0)
+
+    pools = _prune_pools(catalog, indexes, target)
+    slots = [m for m in MEAL_DIST if m in pools]
+    kcal_share = {m: macros['kcal'] * MEAL_DIST[m]['ratio'] for m in slots}
+    last_day = max(days) if days else len(DAYS) - 1
+
+    used = set()
+    for day_number, day_name in enumerate(DAYS[:last_day + 1]):
+        day_started = time.perf_counter()
+        deadline = day_started + time_left
+        candidates, contrib, penalty, choice = {}, {}, {}, {}
+        for m in slots:
+            pool = pools[m].tolist()
+            cand = np.array(rng.sample(pool, min(OPTIMIZER_DAY_SAMPLE, len(pool))), dtype=np.int64)
+            candidates[m] = cand
+            # Вклад кандидата в сумму дня при порции, равной доле калорий приема пищи
+            contrib[m] = nutrients[cand] * (kcal_share[m] / nutrients[cand, 0])[:, None]
+            penalty[m] = np.array([REPEAT_PENALTY if i in used else 0.0 for i in cand.tolist()])
+            choice[m] = int(np.argmin(penalty[m]))
+
+        for _ in range(OPTIMIZER_PASSES):
+            if time.perf_counter() > deadline:
+                logger.warning("Генерация рациона превысила аварийный предел %.2f с, день %s собран без улучшения", time_limit, day_name)
+                break
+            improved = False
+            for m in slots:
+                rest = sum((contrib[o][choice[o]] for o in slots if o != m), np.zeros(4))
+                error = (((rest + contrib[m] - target) / scale) ** 2).sum(axis=1) + penalty[m]
+                best = int(np.argmin(error))
+                if best != choice[m]:
+                    choice[m] = best
+                    improved = True
+            if not improved:
+                break
+
+        picks = [int(candidates[m][choice[m]]) for m in slots]
+        used.update(picks)
+        time_left -= time.perf_counter() - day_started
+        if days is not None and day_number not in days:
+            continue
+        low = np.array([kcal_share[m] * (1 - PORTION_TOLERANCE) for m in slots]) / nutrients[picks, 0]
+        high = np.array([kcal_share[m] * (1 + PORTION_TOLERANCE) for m in slots]) / nutrients[picks, 0]
+        multipliers = _fit_portions(nutrients[picks], target, scale, low, high)
+
+        day_meals = [make_meal(catalog, index, m, float(x)) for m, index, x in zip(slots, picks, multipliers)]
+        yield {'day_name': day_name, 'meals': day_meals, 'deviation': day_deviation(day_meals, macros)}
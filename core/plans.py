@@ -0,0 +1,195 @@
+import datetime
+import hashlib
+import json
+from collections import namedtuple
+
+from django.conf import settings
+from django.db.models import Q
+
+from .catalog import get_catalog
+from .logic import calculate_macros
+from .models import Profile, WeeklyPlan
+from .planner import candidate_rows, iter_weekly_plan
+from .questionnaire import load_answers
+
+# Поля профиля, от которых зависит сгенерированный рацион
+PLAN_INPUT_FIELDS = (
+    'goal', 'activity', 'age', 'weight', 'height', 'gender', 'diet_pref', 'allergies',
+    'target_kcal', 'target_protein', 'target_fat', 'target_carbs',
+)
+
+
+def profile_version(profile, catalog=None):
+    """
+    Хэш входных данных анкеты, содержимого каталога и режима планировщика: меняется при любом
+    изменении, влияющем на рацион, и одинаков во всех процессах (рационы, заранее сгенерированные
+    командой pregenerate_plans, находятся веб-воркерами).
+    """
+    catalog = catalog or get_catalog()
+    raw = "|".join([str(getattr(profile, field)) for field in PLAN_INPUT_FIELDS] + [catalog.content_hash, settings.PLANNER_ENGINE])
+    return hashlib.sha1(raw.encode('utf-8')).hexdigest()
+
+
+def refresh_stamp(profile):
+    """Метка последнего обновления меню (0, если меню ни разу не обновлялось)."""
+    if not profile.last_weekly_refresh:
+        return 0
+    return int(profile.last_weekly_refresh.timestamp())
+
+
+def plan_key(profile, day=None, catalog=None):
+    """Ключ рациона: пользователь, ISO-неделя, метка обновления и версия профиля."""
+    iso_year, iso_week, _ = (day or datetime.date.today()).isocalendar()
+    return {
+        'user_id': profile.user_id,
+        'iso_year': iso_year,
+        'iso_week': iso_week,
+        'refresh_stamp': refresh_stamp(profile),
+        'profile_version': profile_version(profile, catalog),
+    }
+
+
+def plan_seed(user, profile=None, day=None):
+    """Зерно генерации: пользователь, неделя и метка обновления (у гостей - общее на неделю)."""
+    user_seed = user.id if profile is not None else "guest"
+    refresh_seed = refresh_stamp(profile) if profile is not None else 0
+    return f"{user_seed}-{(day or datetime.date.today()).isocalendar()[1]}-{refresh_seed}"
+
+
+# Входные данные рациона запроса; profile - None у гостя
+PlanInputs = namedtuple('PlanInputs', ['profile', 'diet_pref', 'allergies', 'macros', 'seed'])
+
+
+def plan_inputs(request):
+    """
+    Входные данные рациона для results и plan_api: у пользователя - из профиля, у гостя - из анкеты
+    в cookie. None, если анкета еще не заполнена.
+    """
+    user = request.user
+    if user.is_authenticated:
+        profile = user.profile
+        if not profile.target_kcal:
+            return None
+        source, diet_pref, allergies = profile, profile.diet_pref, profile.allergies
+    else:
+        profile = None
+        source = load_answers(request)
+        if not source.get('age'):
+            return None
+        diet_pref, allergies = source.get('diet_pref'), source.get('allergies', '')
+    return PlanInputs(profile, diet_pref, allergies, calculate_macros(source), plan_seed(user, profile))
+
+
+def iter_plan(catalog, diet_pref, allergies, macros, seed, days=None):
+    """Генератор дней рациона (см. planner.iter_weekly_plan); None, если под фильтры нет рецептов."""
+    indexes = candidate_rows(catalog, diet_pref, allergies)
+    if not indexes:
+        return None
+    return iter_weekly_plan(
+        catalog, indexes, macros, seed,
+        engine=settings.PLANNER_ENGINE, time_limit=settings.PLANNER_TIME_LIMIT, days=days,
+    )
+
+
+def generate_plan(catalog, diet_pref, allergies, macros, seed):
+    """Генерирует недельный рацион по снимку каталога; None, если под фильтры нет рецептов."""
+    days = iter_plan(catalog, diet_pref, allergies, macros, seed)
+    return list(days) if days is not None else None
+
+
+def _content_key(value):
+    return hashlib.sha1(json.dumps(value, ensure_ascii=False, sort_keys=True).encode('utf-8')).hexdigest()
+
+
+def with_fragment_keys(weekly_plan):
+    """
+    Копия рациона с ключами кэша HTML-фрагментов results: у дня и у каждой карточки ключ -
+    хэш их содержимого. Карточка определяется рецептом и округленной порцией, поэтому
+    одинаковые блюда в разных днях и у разных пользователей берутся из одного фрагмента,
+    а правка рецепта меняет содержимое и, значит, ключ.
+    """
+    return [
+        dict(day, fragment_key=_content_key(day), meals=[dict(meal, fragment_key=_content_key(meal)) for meal in day['meals']])
+        for day in weekly_plan
+    ]
+
+
+def results_context(inputs, weekly_plan, favorite_recipe_ids):
+    """Контекст страницы results (общий для синхронного и асинхронного представлений)."""
+    profile = inputs.profile
+    return {
+        'weekly_plan': with_fragment_keys(weekly_plan),
+        'macros': inputs.macros,
+        'kcal': inputs.macros['kcal'],
+        'is_guest': profile is None,
+        'can_refresh': profile is not None and profile.can_refresh_menu(),
+        'days_left': profile.days_until_next_refresh() if profile else 0,
+        'favorite_recipe_ids': favorite_recipe_ids,
+        'is_subscribed': profile is not None and profile.has_active_subscription,
+        'hide_footer': True,
+    }
+
+
+def get_stored_plan(profile, day=None, catalog=None):
+    """Возвращает сохраненный рацион одним запросом или None, если его еще нет."""
+    return WeeklyPlan.objects.filter(**plan_key(profile, day, catalog)).values_list('days', flat=True).first()
+
+
+def store_plan(profile, days, day=None, catalog=None):
+    """Сохраняет рацион. Параллельная генерация того же ключа не приводит к ошибке."""
+    WeeklyPlan.objects.bulk_create([WeeklyPlan(days=days, **plan_key(profile, day, catalog))], ignore_conflicts=True)
+
+
+def pregenerate_plans(user_ids, day):
+    """
+    Заранее генерирует рационы на неделю, в которую попадает day, для заполненных профилей
+    пользователей user_ids и сохраняет их одним bulk_create. Уже сохраненные рационы
+    не пересчитываются. Возвращает число созданных рационов.
+    """
+    profiles = list(Profile.objects.select_related('user').filter(user_id__in=user_ids, target_kcal__gt=0))
+    if not profiles:
+        return 0
+    iso_year, iso_week, _ = day.isocalendar()
+    stored = set(WeeklyPlan.objects.filter(user_id__in=user_ids, iso_year=iso_year, iso_week=iso_week)
+                 .values_list('user_id', 'refresh_stamp', 'profile_version'))
+
+    catalog = get_catalog()
+    plans = []
+    for profile in profiles:
+        key = plan_key(profile, day, catalog)
+        if (key['user_id'], key['refresh_stamp'], key['profile_version']) in stored:
+            continue
+        days = generate_plan(catalog, profile.diet_pref, profile.allergies, calculate_macros(profile), plan_seed(profile.user, profile, day))
+        if days is not None:
+            plans.append(WeeklyPlan(days=days, **key))
+    WeeklyPlan.objects.bulk_create(plans, ignore_conflicts=True)
+    return len(plans)
+
+
+def prune_plans(day=None):
+    """
+    Удаляет рационы недель раньше той, в которую попадает day (по умолчанию - сегодня):
+    их ключ больше никогда не запрашивается. Возвращает число удаленных рационов.
+    """
+    iso_year, iso_week, _ = (day or datetime.date.today()).isocalendar()
+    deleted, _ = WeeklyPlan.objects.filter(Q(iso_year__lt=iso_year) | Q(iso_year=iso_year, iso_week__lt=iso_week)).delete()
+    return deleted
+
+
+def invalidate_plans(user):
+    """Удаляет все сохраненные рационы пользователя (после изменения анкеты или обновления меню)."""
+    WeeklyPlan.objects.filter(user=user).delete()
+
+
+# --- Асинхронные варианты для core.async_views ---
+
+async def aget_stored_plan(profile, catalog, day=None):
+    return await WeeklyPlan.objects.filter(**plan_key(profile, day, catalog)).values_list('days', flat=True).afirst()
+
+
+async def astore_plan(profile, catalog, days, day=None):
+    await WeeklyPlan.objects.abulk_create([WeeklyPlan(days=days, **plan_key(profile, day, catalog))], ignore_conflicts=True)
+
+
+async def ainvalidate_plans(user):
+    await WeeklyPlan.objects.filter(user=user).adelete()
@@ -0,0 +1,45 @@
+"""
+Ответы анкеты в подписанной cookie вместо сессии.
+
+Гость проходит анкету и смотрит рацион без единой записи в django_session: ответы
+хранятся у клиента в сжатом подписанном виде (django.core.signing), подделать их
+нельзя, а при неверной подписи анкета просто считается незаполненной.
+"""
+from django.conf import settings
+from django.core import signing
+
+QUESTIONNAIRE_COOKIE = 'nt_questionnaire'
+QUESTIONNAIRE_SALT = 'core.questionnaire'
+
+# Ответы анкеты, от которых зависят КБЖУ и рацион
+QUESTIONNAIRE_KEYS = ('goal', 'activity', 'age', 'weight', 'height', 'gender', 'diet_pref', 'allergies')
+
+
+def load_answers(request):
+    """Ответы анкеты из cookie (пустой словарь, если cookie нет или подпись неверна)."""
+    value = request.COOKIES.get(QUESTIONNAIRE_COOKIE)
+    if not value:
+        return {}
+    try:
+        data = signing.loads(value, salt=QUESTIONNAIRE_SALT, max_age=settings.SESSION_COOKIE_AGE)
+    except signing.BadSignature:
+        return {}
+    if not isinstance(data, dict):
+        return {}
+    return {key: data[key] for key in QUESTIONNAIRE_KEYS if key in data}
+
+
+def save_answers(response, answers):
+    """Записывает ответы анкеты в cookie ответа."""
+    value = signing.dumps(
+        {key: answers[key] for key in QUESTIONNAIRE_KEYS if key in answers},
+        salt=QUESTIONNAIRE_SALT, compress=True,
+    )
+    response.set_cookie(
+        QUESTIONNAIRE_COOKIE, value,
+        max_age=settings.SESSION_COOKIE_AGE,
+        secure=settings.SESSION_COOKIE_SECURE,
+        httponly=True,
+        samesite='Lax',
+    )
+    return response
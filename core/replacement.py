@@ -0,0 +1,36 @@
+import random
+
+from .planner import MEAL_DIST, candidate_rows, make_meal
+
+
+def pick_replacement(catalog, meal_type, diet_pref, allergies, old_id=None, rng=None):
+    """
+    Случайная строка каталога на замену блюду old_id за O(1).
+    Пул кандидатов берется из кэша снимка по (прием пищи, диета, аллергены);
+    старый рецепт исключается без копирования пула. Возвращает None, если замены нет.
+    rng - как в CatalogSnapshot.sample.
+    """
+    rng = rng or random.Random()
+    pool = candidate_rows(catalog, diet_pref, allergies, meal_type)
+    old_index = catalog.index_by_id.get(old_id)
+    size = len(pool)
+    if size == 0 or (size == 1 and pool[0] == old_index):
+        return None
+
+    pos = rng.randrange(size)
+    if pool[pos] == old_index:
+        # Равномерный выбор среди остальных: позиция из size-1 со сдвигом через старую
+        other = rng.randrange(size - 1)
+        pos = other + 1 if other >= pos else other
+    return pool[pos]
+
+
+def replacement_meal(catalog, profile, meal_type, old_id=None, rng=None):
+    """Карточка блюда на замену, пересчитанная на порцию профиля, или None."""
+    if meal_type not in MEAL_DIST:
+        return None
+    index = pick_replacement(catalog, meal_type, profile.diet_pref, profile.allergies, old_id, rng)
+    if index is None or catalog.calories[index] <= 0:
+        return None
+    multiplier = (profile.target_kcal * MEAL_DIST[meal_type]['ratio']) / catalog.calories[index]
+    return make_meal(catalog, index, meal_type, multiplier)
@@ -0,0 +1,169 @@
+from django.contrib.auth.hashers import make_password
+from django.contrib.auth.models import User
+from django.db import connection, transaction
+
+from .catalog import bump_catalog_version
+from .logic import calculate_macros_batch
+from .models import Profile, Recipe, new_favorites_version
+from .planner import DIET_HIERARCHY
+
+# Синтетические пользователи отличаются префиксом логина, чтобы их можно было удалить
+SYNTHETIC_USER_PREFIX = 'synthetic_'
+
+DEFAULT_DIET_DIST = {'all': 0.4, 'pesca': 0.2, 'vege': 0.25, 'vegan': 0.15}
+DEFAULT_MEAL_DIST = {'breakfast': 0.25, 'snack': 0.2, 'lunch': 0.3, 'dinner': 0.25}
+
+# Продукты по диетам: каждая диета может использовать продукты всех более строгих диет
+DIET_INGREDIENTS = {
+    'vegan': ["Овсянка", "Рис", "Гречка", "Киноа", "Нут", "Чечевица", "Тофу", "Брокколи", "Морковь",
+              "Кабачок", "Томаты", "Шпинат", "Авокадо", "Банан", "Яблоко", "Ягоды", "Картофель", "Грибы"],
+    'vege': ["Яйцо", "Творог", "Йогурт", "Сыр", "Кефир", "Сметана"],
+    'pesca': ["Лосось", "Треска", "Тунец", "Креветки", "Скумбрия"],
+    'all': ["Куриная грудка", "Индейка", "Говядина", "Свинина", "Куриный фарш"],
+}
+
+# Продукты с аллергенами (значения совпадают с вариантами анкеты) и диеты, в которых они допустимы
+ALLERGEN_INGREDIENTS = {
+    'орех': ("Грецкий орех", DIET_HIERARCHY['all']),
+    'глютен': ("Пшеничная мука (глютен)", DIET_HIERARCHY['all']),
+    'лактоз': ("Молоко (лактоза)", ['vege', 'pesca', 'all']),
+    'морепродукт': ("Морепродукты ассорти", ['pesca', 'all']),
+}
+
+# Диапазоны белков, жиров, углеводов на 100 г по приемам пищи
+MEAL_MACRO_RANGES = {
+    'breakfast': ((5, 25), (3, 20), (20, 60)),
+    'snack': ((2, 15), (2, 18), (8, 35)),
+    'lunch': ((15, 45), (5, 25), (15, 55)),
+    'dinner': ((15, 40), (4, 20), (5, 35)),
+}
+
+DISH_WORDS = ["Боул", "Салат", "Рагу", "Запеканка", "Суп", "Паста", "Каша", "Омлет", "Смузи", "Тарелка"]
+
+
+def parse_distribution(text, choices):
+    """Разбор распределения вида "all=0.4,vege=0.3" в нормированный словарь."""
+    dist = {}
+    for part in text.split(','):
+        key, _, value = part.partition('=')
+        key = key.strip()
+        if key not in choices:
+            raise ValueError(f"Неизвестное значение '{key}', допустимы: {', '.join(choices)}")
+        dist[key] = float(value)
+    total = sum(dist.values())
+    if total <= 0:
+        raise ValueError("Сумма весов распределения должна быть больше нуля")
+    return {key: weight / total for key, weight in dist.items()}
+
+
+def _weighted(rng, dist):
+    keys = list(dist)
+    return rng.choices(keys, weights=[dist[k] for k in keys])[0]
+
+
+def make_recipe(rng, number, diet_dist, meal_dist, allergen_freq):
+    """Один синтетический рецепт (без сохранения)."""
+    diet = _weighted(rng, diet_dist)
+    meal = _weighted(rng, meal_dist)
+    pool = [item for level in DIET_HIERARCHY[diet] for item in DIET_INGREDIENTS[level]]
+    items = rng.sample(pool, rng.randint(2, 4))
+    parts = [f"{item} {rng.randrange(20, 200, 10)}г" for item in items]
+    if rng.random() < allergen_freq:
+        allowed = [name for name, diets in ALLERGEN_INGREDIENTS.values() if diet in diets]
+        parts.append(f"{rng.choice(allowed)} {rng.randrange(10, 60, 5)}г")
+
+    (p_lo, p_hi), (f_lo, f_hi), (c_lo, c_hi) = MEAL_MACRO_RANGES[meal]
+    protein, fat, carbs = rng.uniform(p_lo, p_hi), rng.uniform(f_lo, f_hi), rng.uniform(c_lo, c_hi)
+    return Recipe(
+        title=f"{rng.choice(DISH_WORDS)}: {items[0].lower()} #{number}",
+        meal_type=meal,
+        diet_type=diet,
+        calories=round(4 * protein + 9 * fat + 4 * carbs),
+        protein=round(protein, 1),
+        fat=round(fat, 1),
+        carbs=round(carbs, 1),
+        description=", ".join(parts),
+        image_url=None,
+    )
+
+
+def clear_synthetic_data():
+    """Удаляет все рецепты и синтетических пользователей (вместе с профилями и рационами)."""
+    with transaction.atomic():
+        # Удаление без сигнала m2m_changed: версия избранного сбрасывается у всех профилей явно
+        Profile.favorite_recipes.through.objects.all().delete()
+        Profile.objects.update(favorites_version=new_favorites_version())
+        # Удаление одним запросом: ORM удалял бы рецепты по одному из-за обработчиков сигналов
+        with connection.cursor() as cursor:
+            cursor.execute(f"DELETE FROM {connection.ops.quote_name(Recipe._meta.db_table)}")
+        User.objects.filter(username__startswith=SYNTHETIC_USER_PREFIX).delete()
+    transaction.on_commit(bump_catalog_version)
+
+
+def create_recipes(count, rng, diet_dist, meal_dist, allergen_freq, batch_size, progress=None):
+    created = 0
+    while created < count:
+        size = min(batch_size, count - created)
+        batch = [make_recipe(rng, created + i + 1, diet_dist, meal_dist, allergen_freq) for i in range(size)]
+        with transaction.atomic():
+            Recipe.objects.bulk_create(batch)
+        created += size
+        if progress:
+            progress(f"Рецептов: {created}/{count}")
+    bump_catalog_version()
+    return created
+
+
+def create_users(count, rng, diet_dist, allergen_freq, premium_share, favorites, batch_size, progress=None):
+    # Хэширование пароля дорогое, поэтому у всех синтетических пользователей один и тот же хэш
+    password = make_password('synthetic')
+    recipe_ids = list(Recipe.objects.values_list('id', flat=True))
+    offset = User.objects.filter(username__startswith=SYNTHETIC_USER_PREFIX).count()
+    favorites_through = Profile.favorite_recipes.through
+
+    created = 0
+    while created < count:
+        size = min(batch_size, count - created)
+        numbers = range(offset + created + 1, offset + created + size + 1)
+        answers = [{
+            'age': rng.randint(18, 70),
+            'weight': round(rng.uniform(45, 120), 1),
+            'height': round(rng.uniform(150, 200), 1),
+            'gender': rng.choice(['male', 'female']),
+            'activity': rng.choice([1.2, 1.375, 1.55, 1.725]),
+            'goal': rng.choice(['lose', 'maintain', 'gain']),
+        } for _ in numbers]
+        macros = calculate_macros_batch(*[[a[key] for a in answers] for key in ('weight', 'height', 'age', 'gender', 'activity', 'goal')])
+
+        with transaction.atomic():
+            users = User.objects.bulk_create([
+                User(username=f"{SYNTHETIC_USER_PREFIX}{n}", email=f"{SYNTHETIC_USER_PREFIX}{n}@example.com", password=password)
+                for n in numbers
+            ])
+            profiles = []
+            for i, (user, a) in enumerate(zip(users, answers)):
+                allergies = []
+                if rng.random() < allergen_freq:
+                    allergies = rng.sample(sorted(ALLERGEN_INGREDIENTS), rng.randint(1, 2))
+                profiles.append(Profile(
+                    user=user,
+                    diet_pref=_weighted(rng, diet_dist),
+                    allergies=",".join(allergies),
+                    is_subscribed=rng.random() < premium_share,
+                    target_kcal=int(macros['kcal'][i]),
+                    target_protein=int(macros['p'][i]),
+                    target_fat=int(macros['f'][i]),
+                    target_carbs=int(macros['c'][i]),
+                    **a,
+                ))
+            profiles = Profile.objects.bulk_create(profiles)
+            if favorites and recipe_ids:
+                favorites_through.objects.bulk_create([
+                    favorites_through(profile_id=profile.id, recipe_id=recipe_id)
+                    for profile in profiles
+                    for recipe_id in rng.sample(recipe_ids, min(favorites, len(recipe_ids)))
+                ], batch_size=batch_size)
+        created += size
+        if progress:
+            progress(f"Пользователей: {created}/{count}")
+    return created
@@ -1,3 +1,932 @@
-from django.test import TestCase
+import datetime
+import io
+import itertools
+import json
+import os
+import random
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from types import SimpleNamespace
+from unittest import mock
 
-# Create your tests here.
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.contrib.sessions.models import Session
+from django.contrib.staticfiles.storage import staticfiles_storage
+from django.core.files.storage import default_storage
+from django.core.management import call_command
+from django.db import connection
+from django.http import HttpResponse
+from django.test import RequestFactory, SimpleTestCase, TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import include, path
+from django.utils import timezone
+from PIL import Image
+
+from nutritarget.media import IMMUTABLE_CACHE_CONTROL
+from nutritarget.metrics import registry
+from nutritarget.sqlite import sqlite_database
+from nutritarget.staticfiles import MUTABLE_CACHE_CONTROL, PrecompressedStaticMiddleware
+
+from . import async_views, catalog
+from .catalog import CatalogSnapshot, bump_catalog_version, get_catalog, ingredient_names
+from .logic import calculate_macros, calculate_macros_batch, parse_ingredients, scale_ingredients
+from .models import CatalogVersion, Profile, Recipe, WeeklyPlan
+from .planner import build_weekly_plan
+from .plans import plan_key, prune_plans
+from .questionnaire import QUESTIONNAIRE_COOKIE, load_answers
+from .replacement import pick_replacement, replacement_meal
+
+# Заполненная анкета профиля для тестов представлений
+PROFILE_FIELDS = {
+    'age': 30, 'weight': 70, 'height': 175, 'gender': 'male', 'goal': 'maintain', 'activity': 1.2, 'diet_pref': 'all',
+    'target_kcal': 2000, 'target_protein': 120, 'target_fat': 60, 'target_carbs': 230,
+}
+
+
+def make_user(username, **profile_fields):
+    """Пользователь с заполненной анкетой; profile_fields дополняют и переопределяют PROFILE_FIELDS."""
+    user = User.objects.create_user(username)
+    Profile.objects.filter(user=user).update(**{**PROFILE_FIELDS, **profile_fields})
+    return User.objects.get(pk=user.pk)
+
+
+def make_catalog(per_meal=2, **recipe_fields):
+    """По per_meal рецептов на каждый прием пищи (завтрак, перекус, обед, ужин - по кругу)."""
+    return Recipe.objects.bulk_create([
+        Recipe(**{
+            'title': f"Блюдо {n}", 'meal_type': meal, 'diet_type': 'all',
+            'calories': 200 + 10 * n, 'protein': 15, 'fat': 8, 'carbs': 30, 'description': "Рис 100г",
+            **recipe_fields,
+        })
+        for n, meal in enumerate(['breakfast', 'snack', 'lunch', 'dinner'] * per_meal)
+    ])
+
+
+def fill_questionnaire(client, weight=70, diet='all', allergies=()):
+    """Проходит шаги 1-3 анкеты; возвращает ответ последнего шага."""
+    client.post('/individual-menu/?step=1', {'goal': 'maintain', 'activity': '1.2'})
+    client.post('/individual-menu/?step=2', {'age': 30, 'weight': weight, 'height': 175, 'gender': 'male'})
+    return client.post('/individual-menu/?step=3', {'diet': diet, 'allergies': list(allergies)})
+
+
+class QueryPlanTests(TestCase):
+    """
+    Запросы горячих путей (results, menu_types, replace_meal_ajax, toggle_favorite)
+    должны идти по индексам: EXPLAIN QUERY PLAN не должен содержать полного SCAN таблицы.
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user('plan_user')
+        cls.profile = cls.user.profile
+        cls.recipe = Recipe.objects.create(
+            title="Тест", meal_type='lunch', diet_type='all',
+            calories=300, protein=20, fat=10, carbs=30, description="Рис 100г",
+        )
+
+    def query_plan(self, queryset):
+        sql, params = queryset.query.sql_with_params()
+        with connection.cursor() as cursor:
+            cursor.execute(f"EXPLAIN QUERY PLAN {sql}", params)
+            return [row[-1] for row in cursor.fetchall()]
+
+    def assertNoFullScan(self, queryset):
+        plan = self.query_plan(queryset)
+        scans = [step for step in plan if step.startswith('SCAN')]
+        self.assertEqual(scans, [], f"Полный просмотр таблицы: {plan}")
+
+    def test_stored_plan_lookup(self):
+        # results: чтение сохраненного рациона
+        self.assertNoFullScan(WeeklyPlan.objects.filter(**plan_key(self.profile)).values_list('days', flat=True)[:1])
+
+    def test_invalidate_plans(self):
+        # individual_menu, refresh_meal: удаление рационов пользователя
+        self.assertNoFullScan(WeeklyPlan.objects.filter(user=self.user))
+
+    def test_user_with_profile(self):
+        # Каждый запрос авторизованного пользователя: пользователь вместе с профилем
+        self.assertNoFullScan(User.objects.select_related('profile').filter(pk=self.user.pk))
+
+    def test_favorite_exists(self):
+        # toggle_favorite: проверка наличия в избранном
+        self.assertNoFullScan(Recipe.objects.filter(pk=self.recipe.pk))
+        self.assertNoFullScan(self.profile.favorite_recipes.filter(pk=self.recipe.pk))
+
+    def test_favorite_ids(self):
+        # results, profile_view: набор id избранного
+        through = Profile.favorite_recipes.through
+        self.assertNoFullScan(through.objects.filter(profile_id=self.profile.pk).values_list('recipe_id', flat=True))
+
+    def test_recipe_fans(self):
+        # Изменение избранного со стороны рецепта (сброс версий избранного)
+        self.assertNoFullScan(self.recipe.fans.values_list('pk', flat=True))
+
+    def test_catalog_views_do_not_filter_recipes(self):
+        # menu_types и замена блюда работают по снимку каталога: фильтрующих запросов к core_recipe нет,
+        # а единственный полный просмотр - загрузка снимка при смене версии каталога
+        bump_catalog_version()
+        get_catalog()
+        with self.assertNumQueries(0):
+            self.client.get('/menu-types/')
+
+
+class PlannerTests(SimpleTestCase):
+    """Планировщик детерминирован зерном и не зависит от глобального random и от соседних потоков."""
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        rng = random.Random(1)
+        cls.catalog = CatalogSnapshot('test', [
+            (n, f"Рецепт {n}", meal, 'all', rng.randint(80, 400), rng.uniform(2, 30), rng.uniform(1, 20), rng.uniform(5, 60),
+             "Рис 100г, Курица 50г", None, '', {})
+            for n, meal in enumerate(['breakfast', 'snack', 'lunch', 'dinner'] * 1000, start=1)
+        ])
+        cls.indexes = list(range(len(cls.catalog)))
+        cls.macros = {'kcal': 2000, 'p': 120, 'f': 60, 'c': 230}
+
+    def build(self, seed, engine):
+        # Рабочий предел времени из настроек: рацион не должен зависеть от загрузки процессора соседними потоками
+        return build_weekly_plan(self.catalog, self.indexes, self.macros, seed, engine, settings.PLANNER_TIME_LIMIT)
+
+    def test_seed_determines_plan(self):
+        for engine in ('shuffle', 'optimize'):
+            expected = self.build('7-42-0', engine)
+            random.seed(0)
+            self.assertEqual(self.build('7-42-0', engine), expected)
+            self.assertNotEqual(self.build('8-42-0', engine), expected)
+
+    def test_concurrent_generation(self):
+        seeds = [f"{user}-42-0" for user in range(8)] * 4
+        done = threading.Event()
+
+        def noise():
+            # Другой код процесса, пользующийся глобальным random
+            while not done.is_set():
+                random.seed()
+                random.random()
+
+        for engine in ('shuffle', 'optimize'):
+            expected = [self.build(seed, engine) for seed in seeds]
+            done.clear()
+            with ThreadPoolExecutor(max_workers=9) as pool:
+                pool.submit(noise)
+                try:
+                    self.assertEqual(list(pool.map(lambda seed: self.build(seed, engine), seeds)), expected)
+                finally:
+                    done.set()
+
+    def test_optimizer_deviation_not_worse_than_shuffle(self):
+        rng = random.Random(2)
+        catalog = CatalogSnapshot('small', [
+            (n, f"Рецепт {n}", meal, 'all', rng.randint(80, 400), rng.uniform(2, 30), rng.uniform(1, 20), rng.uniform(5, 60),
+             "Рис 100г", None, '', {})
+            for n, meal in enumerate(['breakfast', 'snack', 'lunch', 'dinner'] * 50, start=1)
+        ])
+        deviations = {}
+        for engine in ('shuffle', 'optimize'):
+            # Наибольшее по КБЖУ отклонение дня от цели, по всем дням десяти рационов
+            deviations[engine] = [
+                max(abs(value) for value in day['deviation'].values())
+                for seed in range(10)
+                for day in build_weekly_plan(catalog, list(range(len(catalog))), self.macros, f"{seed}-42-0", engine, settings.PLANNER_TIME_LIMIT)
+            ]
+        self.assertLessEqual(statistics.median(deviations['optimize']), statistics.median(deviations['shuffle']))
+        self.assertLess(statistics.median(deviations['optimize']), 10)
+
+    def test_planner_does_not_import_django(self):
+        code = "import sys, core.planner; print(any(m.split('.')[0] == 'django' for m in sys.modules))"
+        result = subprocess.run([sys.executable, '-c', code], cwd=settings.BASE_DIR, capture_output=True, text=True, check=True)
+        self.assertEqual(result.stdout.strip(), 'False')
+
+
+@override_settings(CATALOG_VERSION_CHECK_INTERVAL=0)
+class CatalogReloadTests(TestCase):
+    """Снимок перечитывается, когда версию в CatalogVersion сменил другой процесс."""
+
+    def setUp(self):
+        bump_catalog_version()
+        self.recipe = Recipe.objects.create(
+            title="Старое", meal_type='lunch', diet_type='all', calories=300, protein=20, fat=10, carbs=30, description="Рис 100г",
+        )
+
+    def bump_elsewhere(self, title):
+        # Правка из другого процесса: рецепт и версия меняются в БД, память этого процесса не трогается
+        Recipe.objects.filter(pk=self.recipe.pk).update(title=title)
+        CatalogVersion.objects.filter(pk=1).update(version=f"other-{title}")
+
+    def test_reload_after_version_bump(self):
+        self.bump_elsewhere("Первое")
+        self.assertEqual(get_catalog().get(self.recipe.pk).title, "Первое")
+        self.bump_elsewhere("Второе")
+        self.assertEqual(get_catalog().get(self.recipe.pk).title, "Второе")
+
+    def test_reload_does_not_block_other_threads(self):
+        self.bump_elsewhere("Первое")
+        old = get_catalog()
+        self.bump_elsewhere("Второе")
+        # Пока другой поток перечитывает снимок, запрос получает прежний и не ждет
+        with catalog._snapshot_lock:
+            self.assertIs(get_catalog(), old)
+        self.assertEqual(get_catalog().get(self.recipe.pk).title, "Второе")
+
+
+class CatalogSampleTests(SimpleTestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.catalog = CatalogSnapshot('test', [
+            (n, f"Рецепт {n}", meal, diet, 200, 10, 5, 30, "Рис 100г", None, '', {})
+            for n, (meal, diet) in enumerate(
+                list(itertools.product(['breakfast', 'snack', 'lunch', 'dinner'], ['vegan', 'vege', 'pesca', 'all'])) * 5, start=1,
+            )
+        ])
+
+    def test_seeded_rng_is_deterministic(self):
+        first = self.catalog.sample(10, diets=['vegan', 'vege'], rng=random.Random(3))
+        random.seed(0)
+        self.assertEqual(self.catalog.sample(10, diets=['vegan', 'vege'], rng=random.Random(3)), first)
+        self.assertNotEqual(self.catalog.sample(10, diets=['vegan', 'vege'], rng=random.Random(4)), first)
+
+    def test_only_matching_rows(self):
+        recipes = self.catalog.sample(8, diets=['vegan', 'pesca'], meal_type='lunch', rng=random.Random(1))
+        self.assertEqual(len(recipes), 8)
+        self.assertEqual(len({recipe.id for recipe in recipes}), 8)
+        for recipe in recipes:
+            self.assertEqual(recipe.meal_type, 'lunch')
+            self.assertIn(recipe.diet_type, {'vegan', 'pesca'})
+
+    def test_k_larger_than_pool(self):
+        # Под фильтры подходят 5 рецептов: возвращаются все, без повторов
+        recipes = self.catalog.sample(50, diets=['vegan'], meal_type='snack', rng=random.Random(1))
+        self.assertEqual(sorted(recipe.id for recipe in recipes), [
+            index + 1 for index in self.catalog.pool(['vegan'], 'snack')
+        ])
+        self.assertEqual(self.catalog.sample(3, diets=['keto'], rng=random.Random(1)), [])
+
+
+class IngredientNamesTests(SimpleTestCase):
+
+    def test_names_without_quantities(self):
+        self.assertEqual(ingredient_names("Йогурт 2% 150г, Семена чиа 5г"), ["йогурт", "семена чиа"])
+        self.assertEqual(ingredient_names("Яйцо 2 шт, Молоко 0.5 л, Соль"), ["яйцо", "молоко", "соль"])
+        self.assertEqual(ingredient_names(""), [])
+
+    def test_cyrillic_case_folding(self):
+        self.assertEqual(ingredient_names("ГРЕЦКИЙ Орех 30г, Свёкла 100г"), ["грецкий орех", "свекла"])
+
+    def test_allergen_matching(self):
+        rows = [
+            (1, "Салат", 'lunch', 'all', 300, 10, 10, 30, "Свёкла 100г, Грецкий ОРЕХ 30г", None, '', {}),
+            (2, "Каша", 'lunch', 'all', 300, 10, 10, 30, "Овсянка 50г, Молоко 200мл", None, '', {}),
+            (3, "Омлет", 'lunch', 'all', 300, 10, 10, 30, "Яйцо 2шт, Творог 5% 100г", None, '', {}),
+        ]
+        catalog = CatalogSnapshot('test', rows)
+        ids = lambda terms: sorted(catalog.ids[i] for i in catalog.select(exclude_terms=terms))
+        self.assertEqual(ids(['орех']), [2, 3])
+        self.assertEqual(ids(['Орех', 'МОЛОКО']), [3])
+        self.assertEqual(ids(['Свекла']), [2, 3])
+        self.assertEqual(ids(['глютен', ' ']), [1, 2, 3])
+
+
+class ParseIngredientsTests(SimpleTestCase):
+
+    def test_template(self):
+        template = parse_ingredients("Курица 100г, Яйцо 1шт, Молоко 200 мл")
+        self.assertEqual(template.literals, ("Курица ", "г, Яйцо ", "шт, Молоко ", " мл"))
+        self.assertEqual(template.quantities, (100.0, 1.0, 200.0))
+
+    def test_percentages_are_not_quantities(self):
+        template = parse_ingredients("Йогурт 2% 150г, Творог 5.5% 100г")
+        self.assertEqual(template.quantities, (150.0, 100.0))
+        self.assertEqual(scale_ingredients("Йогурт 2% 150г, Творог 5.5% 100г", 2), "Йогурт 2% 300г, Творог 5.5% 200г")
+
+    def test_without_quantities(self):
+        self.assertEqual(parse_ingredients("Соль, перец по вкусу").quantities, ())
+        self.assertEqual(scale_ingredients("Соль, перец по вкусу", 1.5), "Соль, перец по вкусу")
+        self.assertEqual(parse_ingredients(None).literals, ("",))
+        self.assertEqual(scale_ingredients("", 2), "")
+
+    def test_scaling_rounds_quantities(self):
+        self.assertEqual(scale_ingredients("Курица 100г, Рис 33г", 1.2), "Курица 120г, Рис 40г")
+
+
+class MacrosBatchTests(SimpleTestCase):
+
+    def test_batch_matches_scalar(self):
+        rng = random.Random(4)
+        answers = [
+            {
+                'weight': round(rng.uniform(30, 300), 1), 'height': round(rng.uniform(120, 250), 1), 'age': rng.randint(12, 110),
+                'gender': gender, 'activity': activity, 'goal': goal,
+            }
+            for gender, activity, goal in itertools.product(
+                ['male', 'female', None], [1.2, 1.375, 1.55, 1.725, 1.9], ['lose', 'maintain', 'gain', None, 'unknown'],
+            )
+        ]
+        batch = calculate_macros_batch(*[[a[key] for a in answers] for key in ('weight', 'height', 'age', 'gender', 'activity', 'goal')])
+        for i, a in enumerate(answers):
+            self.assertEqual(
+                calculate_macros(SimpleNamespace(**a)),
+                {key: batch[key][i] for key in ('kcal', 'p', 'f', 'c')},
+                a,
+            )
+
+
+class RecomputeMacrosTests(TestCase):
+
+    def test_command_updates_filled_profiles(self):
+        filled = make_user('macros_filled', gender='female', goal='lose', activity=1.55, target_kcal=1, target_protein=1)
+        no_activity = make_user('macros_no_activity', activity=None, target_kcal=1)
+        empty = User.objects.create_user('macros_empty')
+        Profile.objects.filter(user=empty).update(target_kcal=5)
+
+        call_command('recompute_macros', '--dry-run', stdout=io.StringIO())
+        self.assertEqual(Profile.objects.get(user=filled).target_kcal, 1)
+
+        out = io.StringIO()
+        call_command('recompute_macros', '--chunk-size', '1', stdout=out)
+        self.assertIn("Обновлено: 2", out.getvalue())
+        for user, activity in [(filled, 1.55), (no_activity, 1.2)]:
+            profile = Profile.objects.get(user=user)
+            expected = calculate_macros(SimpleNamespace(
+                weight=profile.weight, height=profile.height, age=profile.age, gender=profile.gender, activity=activity, goal=profile.goal,
+            ))
+            self.assertEqual(
+                (profile.target_kcal, profile.target_protein, profile.target_fat, profile.target_carbs),
+                (expected['kcal'], expected['p'], expected['f'], expected['c']),
+            )
+        self.assertEqual(Profile.objects.get(user=empty).target_kcal, 5)
+
+
+class InstrumentationTests(TestCase):
+
+    def setUp(self):
+        registry.reset()
+
+    def test_server_timing(self):
+        response = self.client.get('/')
+        self.assertRegex(
+            response['Server-Timing'],
+            r'^db;dur=[\d.]+;desc="\d+ queries", tpl;dur=[\d.]+, app;dur=[\d.]+, total;dur=[\d.]+$',
+        )
+
+    def test_metrics(self):
+        self.client.get('/')
+        self.client.get('/')
+        response = self.client.get('/metrics')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response['Content-Type'], 'text/plain; version=0.0.4; charset=utf-8')
+        text = response.content.decode()
+        self.assertIn('nutritarget_request_duration_seconds_count{view="index"} 2', text)
+        self.assertIn('nutritarget_request_duration_seconds_bucket{view="index",le="+Inf"} 2', text)
+        self.assertIn('nutritarget_requests_total{view="index",status="2xx"} 2', text)
+
+    def test_metrics_forbidden_for_other_addresses(self):
+        self.assertEqual(self.client.get('/metrics', REMOTE_ADDR='203.0.113.5').status_code, 403)
+
+    @override_settings(METRICS_TOKEN='secret')
+    def test_metrics_token(self):
+        # С токеном адрес не проверяется: за прокси все запросы приходят с 127.0.0.1
+        self.assertEqual(self.client.get('/metrics').status_code, 403)
+        self.assertEqual(self.client.get('/metrics', headers={'Authorization': 'Bearer wrong'}).status_code, 403)
+        response = self.client.get('/metrics', REMOTE_ADDR='203.0.113.5', headers={'Authorization': 'Bearer secret'})
+        self.assertEqual(response.status_code, 200)
+
+
+class PrecompressedStaticTests(SimpleTestCase):
+    """collectstatic кладет рядом со статикой .gz и .br, middleware выбирает копию по Accept-Encoding."""
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.static_root = tempfile.mkdtemp()
+        cls.addClassCleanup(shutil.rmtree, cls.static_root)
+        cls.enterClassContext(override_settings(DEBUG=False, STATIC_ROOT=cls.static_root))
+        # Статика админки не нужна, а ее сжатие brotli занимает секунды
+        call_command('collectstatic', interactive=False, verbosity=0, ignore_patterns=['admin'])
+        cls.hashed_name = staticfiles_storage.stored_name('css/style.css')
+        cls.middleware = PrecompressedStaticMiddleware(lambda request: HttpResponse("app"))
+
+    def get(self, name, accept_encoding=''):
+        return self.middleware(RequestFactory().get(f'/static/{name}', headers={'Accept-Encoding': accept_encoding}))
+
+    def test_post_process_writes_compressed_copies(self):
+        self.assertNotEqual(self.hashed_name, 'css/style.css')
+        for name in ('css/style.css', self.hashed_name):
+            for suffix in ('.gz', '.br'):
+                self.assertTrue(os.path.exists(os.path.join(self.static_root, name + suffix)), name + suffix)
+
+    def test_encoding_from_accept_encoding(self):
+        for accept_encoding, encoding in [('gzip, deflate, br', 'br'), ('gzip', 'gzip'), ('br;q=0, gzip', 'gzip'), ('', None)]:
+            with self.subTest(accept_encoding=accept_encoding):
+                response = self.get(self.hashed_name, accept_encoding)
+                self.assertEqual(response.get('Content-Encoding'), encoding)
+                self.assertEqual(response['Vary'], 'Accept-Encoding')
+                self.assertEqual(response['Content-Type'], 'text/css')
+                suffix = {'br': '.br', 'gzip': '.gz', None: ''}[encoding]
+                with open(os.path.join(self.static_root, self.hashed_name + suffix), 'rb') as f:
+                    self.assertEqual(b''.join(response.streaming_content), f.read())
+
+    def test_cache_control(self):
+        self.assertEqual(self.get(self.hashed_name)['Cache-Control'], IMMUTABLE_CACHE_CONTROL)
+        self.assertEqual(self.get('css/style.css')['Cache-Control'], MUTABLE_CACHE_CONTROL)
+
+    def test_unknown_files_pass_through(self):
+        self.assertEqual(self.get('css/missing.css').content, b"app")
+
+
+class SqliteProfileTests(SimpleTestCase):
+
+    def test_persistent_connections_only_without_asgi(self):
+        self.assertEqual(sqlite_database('db.sqlite3', 'tuned')['CONN_MAX_AGE'], 600)
+        self.assertEqual(sqlite_database('db.sqlite3', 'tuned', asgi=True)['CONN_MAX_AGE'], 0)
+        self.assertNotIn('CONN_MAX_AGE', sqlite_database('db.sqlite3', 'default', asgi=True))
+
+
+class RegistrationTests(TestCase):
+
+    def test_register_logs_in(self):
+        response = self.client.post('/register/', {
+            'username': 'new_user', 'email': 'new_user@example.com',
+            'password': 'Secret-pass-123', 'password_confirm': 'Secret-pass-123',
+        })
+        self.assertRedirects(response, '/profile/', fetch_redirect_response=False)
+        user = User.objects.get(username='new_user')
+        self.assertEqual(self.client.session['_auth_user_id'], str(user.pk))
+        self.assertEqual(self.client.session['_auth_user_backend'], 'core.backends.ProfileModelBackend')
+        self.assertTrue(Profile.objects.filter(user=user).exists())
+
+
+class FavoritesApiTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = make_user('favorites_user')
+        cls.recipes = make_catalog()
+
+    def setUp(self):
+        bump_catalog_version()
+        self.client.force_login(self.user)
+
+    def post(self, url, data):
+        body = data if isinstance(data, (str, bytes)) else json.dumps(data)
+        return self.client.post(url, body, content_type='application/json')
+
+    def favorites(self):
+        return set(Profile.objects.get(user=self.user).favorite_recipes.values_list('pk', flat=True))
+
+    def test_add_and_remove_are_idempotent(self):
+        recipe_id = self.recipes[0].pk
+        for _ in range(2):
+            self.assertEqual(self.post('/api/favorite/add/', {'recipe_id': recipe_id}).json()['action'], 'added')
+            self.assertEqual(self.favorites(), {recipe_id})
+        for _ in range(2):
+            self.assertEqual(self.post('/api/favorite/remove/', {'recipe_id': recipe_id}).json()['action'], 'removed')
+            self.assertEqual(self.favorites(), set())
+
+    def test_unknown_and_malformed(self):
+        for url in ['/api/favorite/add/', '/api/favorite/toggle/']:
+            self.assertEqual(self.post(url, {'recipe_id': 999999}).status_code, 404)
+            for body in ['{"recipe_id": ', '[1]', '{}']:
+                self.assertEqual(self.post(url, body).status_code, 404, body)
+        self.assertEqual(self.favorites(), set())
+
+    def test_sync(self):
+        first, second, third = (recipe.pk for recipe in self.recipes[:3])
+        response = self.post('/api/favorite/sync/', {'add': [first, second, 999999]})
+        self.assertEqual(response.json()['favorite_ids'], sorted([first, second]))
+        response = self.post('/api/favorite/sync/', {'add': [third], 'remove': [first]})
+        self.assertEqual(response.json()['favorite_ids'], sorted([second, third]))
+        self.assertEqual(self.favorites(), {second, third})
+
+    def test_sync_rejects_non_integer_ids(self):
+        for data in [{'add': [1.5]}, {'add': ["1"]}, {'remove': [True]}, {'add': 1}, '[1]', '{"add": ']:
+            self.assertEqual(self.post('/api/favorite/sync/', data).status_code, 400, data)
+        self.assertEqual(self.favorites(), set())
+
+    def test_change_bumps_version_and_results_etag(self):
+        version = Profile.objects.get(user=self.user).favorites_version
+        self.client.get('/results/')
+        etag = self.client.get('/results/')['ETag']
+        self.post('/api/favorite/sync/', {'add': [self.recipes[0].pk]})
+        self.assertNotEqual(Profile.objects.get(user=self.user).favorites_version, version)
+        response = self.client.get('/results/', headers={'If-None-Match': etag})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.context['favorite_recipe_ids'], [self.recipes[0].pk])
+
+    def test_reverse_change_bumps_version(self):
+        self.post('/api/favorite/add/', {'recipe_id': self.recipes[0].pk})
+        version = Profile.objects.get(user=self.user).favorites_version
+        self.recipes[0].fans.clear()
+        self.assertNotEqual(Profile.objects.get(user=self.user).favorites_version, version)
+
+
+class ReplacementTests(SimpleTestCase):
+    """Замена блюда соблюдает иерархию диет, аллергены и прием пищи и не возвращает заменяемый рецепт."""
+
+    def setUp(self):
+        rows = [
+            (1, "Овощи", 'lunch', 'vegan', 300, 10, 10, 40, "Кабачок 200г", None, '', {}),
+            (2, "Сырники", 'lunch', 'vege', 300, 15, 10, 30, "Творог 150г", None, '', {}),
+            (3, "Тофу", 'lunch', 'vegan', 300, 20, 10, 20, "Тофу 150г", None, '', {}),
+            (4, "Рыба", 'lunch', 'pesca', 300, 25, 10, 10, "Треска 150г", None, '', {}),
+            (5, "Курица", 'lunch', 'all', 300, 30, 10, 10, "Курица 150г", None, '', {}),
+            (6, "Салат с орехами", 'lunch', 'vegan', 300, 10, 20, 20, "Салат 100г, Грецкий ОРЕХ 30г", None, '', {}),
+            (7, "Овсянка", 'breakfast', 'vegan', 300, 10, 5, 50, "Овсянка 60г", None, '', {}),
+        ]
+        self.catalog = CatalogSnapshot('test', rows)
+
+    def draws(self, diet_pref, allergies, old_id, count=500):
+        rng = random.Random(7)
+        picks = (pick_replacement(self.catalog, 'lunch', diet_pref, allergies, old_id, rng) for _ in range(count))
+        return {self.catalog.ids[index] for index in picks}
+
+    def test_rules(self):
+        # Вегетарианцу: веганские и вегетарианские обеды без орехов, кроме заменяемого
+        self.assertEqual(self.draws('vege', 'орех', old_id=1), {2, 3})
+        self.assertEqual(self.draws('vegan', 'орех', old_id=3), {1})
+        self.assertEqual(self.draws('pesca', '', old_id=4), {1, 2, 3, 6})
+        self.assertEqual(self.draws('all', 'Орех,творог', old_id=None), {1, 3, 4, 5})
+
+    def test_no_other_candidate(self):
+        self.assertIsNone(pick_replacement(self.catalog, 'lunch', 'vegan', 'орех,кабачок', old_id=3))
+        self.assertIsNone(pick_replacement(self.catalog, 'dinner', 'all', '', old_id=None))
+
+    def test_replacement_meal(self):
+        profile = SimpleNamespace(diet_pref='vegan', allergies='орех', target_kcal=2000)
+        meal = replacement_meal(self.catalog, profile, 'lunch', old_id=1, rng=random.Random(1))
+        self.assertEqual(meal['id'], 3)
+        self.assertEqual(meal['type_slug'], 'lunch')
+        self.assertIsNone(replacement_meal(self.catalog, profile, 'brunch', old_id=1))
+
+
+class ReplaceMealTests(TestCase):
+
+    def test_malformed_body(self):
+        self.client.force_login(make_user('replace_user', is_subscribed=True))
+        for body in ['{"recipe_id": ', '[1, 2]', '"lunch"', b'\xff']:
+            response = self.client.post('/api/meal/replace/', body, content_type='application/json')
+            self.assertEqual(response.status_code, 400, body)
+
+    def test_replacement_follows_profile(self):
+        self.client.force_login(make_user('vegan_user', is_subscribed=True, diet_pref='vegan', allergies='орех'))
+        allowed = make_catalog(per_meal=3, diet_type='vegan')
+        make_catalog(diet_type='vege')
+        make_catalog(description="Грецкий орех 30г", diet_type='vegan')
+        bump_catalog_version()
+        lunches = {recipe.pk for recipe in allowed if recipe.meal_type == 'lunch'}
+        old_id = min(lunches)
+        for _ in range(30):
+            response = self.client.post(
+                '/api/meal/replace/', json.dumps({'recipe_id': old_id, 'meal_type': 'lunch'}), content_type='application/json',
+            )
+            self.assertIn(response.json()['new_meal']['id'], lunches - {old_id})
+
+
+class RecipeThumbnailsTests(TestCase):
+
+    def setUp(self):
+        self.recipe = Recipe.objects.create(
+            title="Фото", meal_type='lunch', diet_type='all', calories=300, protein=20, fat=10, carbs=30,
+            description="Рис 100г", image='recipes/old.jpg', thumbnails={'jpeg': {'640': 'recipes/thumbs/old-640.jpg'}},
+        )
+
+    def test_new_image_resets_thumbnails(self):
+        self.recipe.image = 'uploads/recipes/new.jpg'
+        self.recipe.save()
+        self.recipe.refresh_from_db()
+        self.assertEqual(self.recipe.thumbnails, {})
+
+    def test_new_image_with_update_fields(self):
+        self.recipe.image = 'uploads/recipes/new.jpg'
+        self.recipe.save(update_fields=['image'])
+        self.recipe.refresh_from_db()
+        self.assertEqual(self.recipe.thumbnails, {})
+
+    def test_other_changes_keep_thumbnails(self):
+        self.recipe.title = "Фото 2"
+        self.recipe.save()
+        self.recipe.refresh_from_db()
+        self.assertEqual(self.recipe.thumbnails, {'jpeg': {'640': 'recipes/thumbs/old-640.jpg'}})
+
+
+class BuildThumbnailsCommandTests(TestCase):
+
+    def setUp(self):
+        media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, media_root)
+        settings_override = override_settings(MEDIA_ROOT=media_root)
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+
+        buffer = io.BytesIO()
+        Image.new('RGB', (1200, 800), (200, 120, 40)).save(buffer, 'JPEG')
+        self.recipe = Recipe.objects.create(
+            title="Фото", meal_type='lunch', diet_type='all', calories=300, protein=20, fat=10, carbs=30,
+            description="Рис 100г", image=default_storage.save('uploads/recipes/photo.jpg', io.BytesIO(buffer.getvalue())),
+        )
+
+    def test_builds_thumbnails(self):
+        version = CatalogVersion.objects.filter(pk=1).values_list('version', flat=True).first()
+        call_command('build_thumbnails', workers=1, sizes=[320, 640, 1600], stdout=io.StringIO())
+        self.recipe.refresh_from_db()
+
+        # Миниатюры не шире исходника: 1600 превращается в 1200
+        self.assertEqual(set(self.recipe.thumbnails), {'webp', 'jpeg'})
+        for fmt, extension in [('webp', 'webp'), ('jpeg', 'jpg')]:
+            renditions = self.recipe.thumbnails[fmt]
+            self.assertEqual(set(renditions), {'320', '640', '1200'})
+            for width, name in renditions.items():
+                self.assertRegex(name, rf'^recipes/thumbs/[0-9a-f]{{16}}-{width}\.{extension}$')
+                with default_storage.open(name) as f, Image.open(f) as image:
+                    self.assertEqual((image.format, image.width), (fmt.upper(), int(width)))
+        self.assertEqual(self.recipe.image.name, 'uploads/recipes/photo.jpg')
+        self.assertNotEqual(CatalogVersion.objects.get(pk=1).version, version)
+
+    def test_skips_recipes_with_thumbnails(self):
+        call_command('build_thumbnails', workers=1, sizes=[320], stdout=io.StringIO())
+        self.recipe.refresh_from_db()
+        thumbnails = self.recipe.thumbnails
+        out = io.StringIO()
+        call_command('build_thumbnails', workers=1, sizes=[640], stdout=out)
+        self.recipe.refresh_from_db()
+        self.assertEqual(self.recipe.thumbnails, thumbnails)
+        self.assertIn("Миниатюры построены для 0 из 0 рецептов", out.getvalue())
+
+
+class ResultsETagTests(TestCase):
+    """results отвечает 304 на повторный запрос и 200 после любого изменения, влияющего на страницу."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = make_user('etag_user')
+        cls.recipes = make_catalog()
+
+    def setUp(self):
+        bump_catalog_version()
+        self.client.force_login(self.user)
+        # Первый ответ выдает CSRF-cookie, которая входит в ETag: проверяются ответы после него
+        self.client.get('/results/')
+
+    def get_results(self, etag=None):
+        return self.client.get('/results/', headers={'If-None-Match': etag} if etag else {})
+
+    def current_etag(self):
+        response = self.get_results()
+        self.assertEqual(response.status_code, 200)
+        return response['ETag']
+
+    def test_repeat_request_not_modified(self):
+        etag = self.current_etag()
+        self.assertEqual(self.get_results(etag).status_code, 304)
+
+    def test_favorite_toggle(self):
+        etag = self.current_etag()
+        self.client.post('/api/favorite/toggle/', json.dumps({'recipe_id': self.recipes[0].pk}), content_type='application/json')
+        self.assertEqual(self.get_results(etag).status_code, 200)
+
+    def test_refresh(self):
+        etag = self.current_etag()
+        self.client.get('/refresh-meal/')
+        self.get_results()  # Показ сообщения об обновлении
+        self.assertEqual(self.get_results(etag).status_code, 200)
+
+    def test_questionnaire_change(self):
+        etag = self.current_etag()
+        fill_questionnaire(self.client, weight=80)
+        self.assertEqual(self.get_results(etag).status_code, 200)
+
+    def test_catalog_edit(self):
+        etag = self.current_etag()
+        Recipe.objects.filter(pk=self.recipes[0].pk).update(title="Новое название")
+        bump_catalog_version()
+        self.assertEqual(self.get_results(etag).status_code, 200)
+
+    def test_no_etag_with_pending_messages(self):
+        etag = self.current_etag()
+        self.client.get('/refresh-meal/')
+        response = self.get_results(etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotIn('ETag', response)
+        self.assertContains(response, "Меню успешно обновлено")
+        # Сообщение показано: следующий ответ снова с ETag
+        self.assertIn('ETag', self.get_results())
+
+    def test_profile_not_modified(self):
+        self.client.get('/profile/')
+        etag = self.client.get('/profile/')['ETag']
+        self.assertEqual(self.client.get('/profile/', headers={'If-None-Match': etag}).status_code, 304)
+        self.client.post('/api/favorite/toggle/', json.dumps({'recipe_id': self.recipes[0].pk}), content_type='application/json')
+        self.assertEqual(self.client.get('/profile/', headers={'If-None-Match': etag}).status_code, 200)
+
+
+class GuestResultsETagTests(TestCase):
+
+    def test_questionnaire_and_catalog_change(self):
+        make_catalog()
+        bump_catalog_version()
+        fill_questionnaire(self.client)
+        self.client.get('/results/')
+        etag = self.client.get('/results/')['ETag']
+        self.assertEqual(self.client.get('/results/', headers={'If-None-Match': etag}).status_code, 304)
+
+        fill_questionnaire(self.client, weight=80)
+        self.assertEqual(self.client.get('/results/', headers={'If-None-Match': etag}).status_code, 200)
+
+        etag = self.client.get('/results/')['ETag']
+        Recipe.objects.filter(meal_type='lunch').update(calories=300)
+        bump_catalog_version()
+        self.assertEqual(self.client.get('/results/', headers={'If-None-Match': etag}).status_code, 200)
+
+
+@override_settings(ROOT_URLCONF='core.tests')
+class AsyncResultsETagTests(ResultsETagTests):
+    """То же для асинхронного представления results."""
+
+
+class GuestQuestionnaireTests(TestCase):
+    """Анкета гостя хранится в подписанной cookie: django_session не используется."""
+
+    @classmethod
+    def setUpTestData(cls):
+        make_catalog()
+
+    def setUp(self):
+        bump_catalog_version()
+
+    def test_flow_without_session_writes(self):
+        with CaptureQueriesContext(connection) as ctx:
+            response = self.client.post('/individual-menu/?step=1', {'goal': 'lose', 'activity': '1.375'})
+            self.assertRedirects(response, '/individual-menu/?step=2', fetch_redirect_response=False)
+            response = self.client.post('/individual-menu/?step=2', {'age': 30, 'weight': 70, 'height': 175, 'gender': 'female'})
+            self.assertRedirects(response, '/individual-menu/?step=3', fetch_redirect_response=False)
+            response = self.client.post('/individual-menu/?step=3', {'diet': 'all', 'allergies': ['орех']})
+            self.assertRedirects(response, '/results/', fetch_redirect_response=False)
+            response = self.client.get('/results/')
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.context['is_guest'])
+        self.assertEqual([q['sql'] for q in ctx.captured_queries if 'django_session' in q['sql']], [])
+        self.assertFalse(Session.objects.exists())
+        self.assertNotIn(settings.SESSION_COOKIE_NAME, self.client.cookies)
+
+    def test_tampered_cookie_is_empty_questionnaire(self):
+        fill_questionnaire(self.client)
+        value = self.client.cookies[QUESTIONNAIRE_COOKIE].value
+        self.client.cookies[QUESTIONNAIRE_COOKIE] = value[:-1] + ('A' if value[-1] != 'A' else 'B')
+
+        request = RequestFactory().get('/results/')
+        request.COOKIES[QUESTIONNAIRE_COOKIE] = self.client.cookies[QUESTIONNAIRE_COOKIE].value
+        self.assertEqual(load_answers(request), {})
+        self.assertRedirects(self.client.get('/results/'), '/individual-menu/', fetch_redirect_response=False)
+
+
+class PlanApiTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = make_user('api_user')
+        make_catalog(per_meal=3)
+
+    def setUp(self):
+        bump_catalog_version()
+        self.client.force_login(self.user)
+
+    def read_days(self, response):
+        self.assertEqual(response['Content-Type'], 'application/x-ndjson; charset=utf-8')
+        return [json.loads(line) for line in b''.join(response.streaming_content).decode('utf-8').splitlines()]
+
+    def test_filters(self):
+        days = self.read_days(self.client.get('/api/plan/', {'days': '1,3', 'meals': 'breakfast,dinner'}))
+        self.assertEqual([day['day'] for day in days], [1, 3])
+        for day in days:
+            self.assertEqual({meal['type_slug'] for meal in day['meals']}, {'breakfast', 'dinner'})
+
+    def test_filtered_days_match_full_week(self):
+        week = self.read_days(self.client.get('/api/plan/'))
+        days = self.read_days(self.client.get('/api/plan/', {'days': '2,7'}))
+        self.assertEqual(days, [week[1], week[6]])
+
+    def test_bad_params(self):
+        for params in [{'days': '0'}, {'days': '8'}, {'days': 'пн'}, {'days': '1,,2'}, {'meals': 'brunch'}]:
+            self.assertEqual(self.client.get('/api/plan/', params).status_code, 400, params)
+
+    def test_partial_stream_not_stored(self):
+        response = self.client.get('/api/plan/')
+        next(iter(response.streaming_content))
+        response.close()
+        self.assertFalse(WeeklyPlan.objects.exists())
+
+    def test_full_stream_stored_as_results(self):
+        days = self.read_days(self.client.get('/api/plan/'))
+        self.assertEqual(len(days), 7)
+        stored = WeeklyPlan.objects.get(user=self.user).days
+        self.assertEqual([{key: value for key, value in day.items() if key != 'day'} for day in days], stored)
+
+        # results читает сохраненный рацион и добавляет к нему только ключи HTML-фрагментов
+        response = self.client.get('/results/')
+        without_key = lambda value: {key: item for key, item in value.items() if key != 'fragment_key'}
+        shown = [dict(without_key(day), meals=[without_key(meal) for meal in day['meals']]) for day in response.context['weekly_plan']]
+        self.assertEqual(shown, stored)
+        self.assertEqual(WeeklyPlan.objects.count(), 1)
+
+
+class PrunePlansTests(TestCase):
+
+    def test_prunes_weeks_before_current(self):
+        user = User.objects.create_user('prune_user')
+        for iso_year, iso_week in [(2025, 52), (2026, 1), (2026, 2), (2026, 3)]:
+            WeeklyPlan.objects.create(user=user, iso_year=iso_year, iso_week=iso_week, profile_version='v', days=[])
+        # 2026-01-05 - понедельник второй ISO-недели 2026 года
+        self.assertEqual(prune_plans(datetime.date(2026, 1, 5)), 2)
+        self.assertEqual(sorted(WeeklyPlan.objects.values_list('iso_year', 'iso_week')), [(2026, 2), (2026, 3)])
+
+
+class PregeneratePlansCommandTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = make_user('pregen_user')
+        User.objects.filter(pk=cls.user.pk).update(last_login=timezone.now())
+        make_catalog()
+
+    def setUp(self):
+        bump_catalog_version()
+
+    def pregenerate(self):
+        call_command('pregenerate_plans', week_of=datetime.date.today(), workers=1, no_prune=True, stdout=io.StringIO())
+
+    def test_results_serves_pregenerated_plan(self):
+        self.pregenerate()
+        stored = WeeklyPlan.objects.get(user=self.user)
+        self.client.force_login(self.user)
+        with mock.patch('core.views.generate_plan') as generate, mock.patch('core.async_views.generate_plan') as agenerate:
+            response = self.client.get('/results/')
+        self.assertEqual(response.status_code, 200)
+        generate.assert_not_called()
+        agenerate.assert_not_called()
+        self.assertEqual(WeeklyPlan.objects.get(user=self.user).pk, stored.pk)
+        self.assertContains(response, stored.days[0]['meals'][0]['title'])
+
+    def test_rerun_creates_no_duplicates(self):
+        self.pregenerate()
+        self.pregenerate()
+        self.assertEqual(WeeklyPlan.objects.filter(user=self.user).count(), 1)
+
+
+# Асинхронные представления подключаются в core/urls.py только при CORE_ASYNC_VIEWS,
+# для тестов они подставляются поверх синхронных
+urlpatterns = [
+    path('results/', async_views.results, name='results'),
+    path('refresh-meal/', async_views.refresh_meal, name='refresh_meal'),
+    path('api/favorite/toggle/', async_views.toggle_favorite, name='toggle_favorite'),
+    path('api/meal/replace/', async_views.replace_meal_ajax, name='replace_meal'),
+    path('', include('core.urls')),
+]
+
+
+@override_settings(ROOT_URLCONF='core.tests')
+class AsyncViewsLegacySessionTests(TestCase):
+    """Сессии ModelBackend (созданные до ProfileModelBackend) не загружают профиль вместе с пользователем."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = make_user('legacy_user', is_subscribed=True)
+        cls.recipes = make_catalog()
+
+    def setUp(self):
+        bump_catalog_version()
+        self.async_client.force_login(self.user, backend='django.contrib.auth.backends.ModelBackend')
+
+    async def test_results(self):
+        response = await self.async_client.get('/results/')
+        self.assertEqual(response.status_code, 200)
+
+    async def test_toggle_favorite(self):
+        response = await self.async_client.post(
+            '/api/favorite/toggle/', json.dumps({'recipe_id': self.recipes[0].pk}), content_type='application/json',
+        )
+        self.assertEqual(response.status_code, 200)
+
+    async def test_replace_meal(self):
+        response = await self.async_client.post(
+            '/api/meal/replace/', json.dumps({'recipe_id': self.recipes[2].pk, 'meal_type': 'lunch'}),
+            content_type='application/json',
+        )
+        self.assertEqual(response.status_code, 200)
+
+    async def test_replace_meal_malformed_body(self):
+        for body in ['{"recipe_id": ', '[1, 2]', '"lunch"']:
+            response = await self.async_client.post('/api/meal/replace/', body, content_type='application/json')
+            self.assertEqual(response.status_code, 400, body)
+
+    async def test_refresh_meal(self):
+        response = await self.async_client.get('/refresh-meal/')
+        self.assertEqual(response.status_code, 302)
@@ -1,5 +1,9 @@
+from django.conf import settings
 from django.urls import path
-from . import views
+from . import views, async_views
+
+# Под ASGI горячие представления подключаются в асинхронном варианте
+hot_views = async_views if settings.CORE_ASYNC_VIEWS else views
 
 urlpatterns = [
     path('', views.index, name='index'),
@@ -7,10 +11,14 @@ urlpatterns = [
     path('register/', views.register, name='register'),
     path('login/', views.user_login, name='user_login'),
     path('individual-menu/', views.individual_menu, name='individual_menu'),
-    path('results/', views.results, name='results'),
-    path('refresh-meal/', views.refresh_meal, name='refresh_meal'),
-    path('api/favorite/toggle/', views.toggle_favorite, name='toggle_favorite'),
-    path('api/meal/replace/', views.replace_meal_ajax, name='replace_meal'),
+    path('results/', hot_views.results, name='results'),
+    path('refresh-meal/', hot_views.refresh_meal, name='refresh_meal'),
+    path('api/favorite/toggle/', hot_views.toggle_favorite, name='toggle_favorite'),
+    path('api/favorite/add/', views.add_favorite, name='add_favorite'),
+    path('api/favorite/remove/', views.remove_favorite, name='remove_favorite'),
+    path('api/favorite/sync/', views.sync_favorites, name='sync_favorites'),
+    path('api/plan/', views.plan_api, name='plan_api'),
+    path('api/meal/replace/', hot_views.replace_meal_ajax, name='replace_meal'),
     path('profile/', views.profile_view, name='profile'),
     path('logout/', views.user_logout, name='user_logout'),
     path('verify-email/', views.verify_email, name='verify_email'),
@@ -1,15 +1,15 @@
 
-import datetime
-import random
-import re
 import json
+import random
 from django.shortcuts import render, redirect, get_object_or_404
 from django.contrib.auth import login as auth_login, logout as auth_logout
 from django.contrib.auth.forms import AuthenticationForm
 from django.contrib.auth.decorators import login_required
-from django.views.decorators.http import require_POST
-from django.http import JsonResponse
+from django.views.decorators.cache import cache_control
+from django.views.decorators.http import condition, require_POST
+from django.http import JsonResponse, StreamingHttpResponse
 from django.contrib import messages
+from django.db import transaction
 from django.db.models import Sum
 from django.utils import timezone
 from django.core.mail import send_mail
@@ -19,16 +19,17 @@ from django.contrib.auth import login
 
 from .models import Profile, Recipe
 from .forms import RegisterForm
+from .etags import profile_etag, results_etag
+from .favorites import favorite_ids, is_favorite, parse_recipe_ids
+from .questionnaire import QUESTIONNAIRE_KEYS, load_answers, save_answers
 from .logic import calculate_macros
+from .catalog import get_catalog, request_catalog
+from .replacement import replacement_meal
+from .planner import DAYS, MEAL_DIST
+from .plans import get_stored_plan, store_plan, invalidate_plans, generate_plan, iter_plan, plan_inputs, results_context
 
-# --- ВСПОМОГАТЕЛЬНЫЕ ФУНКЦИИ ---
-def scale_ingredients(description, multiplier):
-    """Пересчет граммовки ингредиентов."""
-    if not description: return ""
-    def replace(match):
-        value = float(match.group(1))
-        return f"{round(value * multiplier)}"
-    return re.sub(r'(\d+(?:\.\d+)?)(?=\s*(?:г|мл|шт))', replace, description)
+# Бэкенд для входа без authenticate() (регистрация, подтверждение почты)
+LOGIN_BACKEND = 'core.backends.ProfileModelBackend'
 
 # --- ГЛАВНЫЕ СТРАНИЦЫ ---
 def index(request):
@@ -41,10 +42,12 @@ def menu_types(request):
         {'slug': 'vege', 'name': 'Вегетарианское', 'desc': 'Только растительная пища + молоко и яйца.'},
         {'slug': 'vegan', 'name': 'Веганское', 'desc': 'Строго растительный рацион.'},
     ]
+    catalog = get_catalog()
+    rng = random.Random()  # Свой генератор на запрос: глобальное состояние random не разделяется между потоками
     for diet in diet_categories:
-        samples = Recipe.objects.filter(diet_type=diet['slug'])
-        if samples.exists():
-            diet['samples'] = random.sample(list(samples), min(len(samples), 2))
+        samples = catalog.sample(2, diets=[diet['slug']], rng=rng)
+        if samples:
+            diet['samples'] = samples
     return render(request, 'core/menu_types.html', {'diets': diet_categories})
 
 # --- АВТОРИЗАЦИЯ И ВЕРИФИКАЦИЯ ---
@@ -58,12 +61,11 @@ def register(request):
             user.is_active = True  # Пользователь активен сразу после регистрации
             user.save()
 
-            # Создаем или получаем профиль для пользователя
-            profile, created = Profile.objects.get_or_create(user=user)
-            profile.save() # Сохраняем профиль, если он был только что создан или изменен
+            # Профиль создается сигналом post_save при создании пользователя
 
             # --- Автоматический вход пользователя ---
-            login(request, user) # Логиним пользователя сразу после успешной регистрации
+            # Бэкендов аутентификации несколько, поэтому для пользователя без authenticate() он указывается явно
+            login(request, user, backend=LOGIN_BACKEND) # Логиним пользователя сразу после успешной регистрации
             # --------------------------------------------------------------------
 
             messages.success(request, "Аккаунт успешно создан! Вы успешно вошли.")
@@ -94,7 +96,7 @@ def verify_email(request):
             user.profile.is_verified = True
             user.profile.verification_code = None
             user.profile.save()
-            auth_login(request, user)
+            auth_login(request, user, backend=LOGIN_BACKEND)
             messages.success(request, "Почта подтверждена!")
             return redirect('profile')
         else:
@@ -124,10 +126,12 @@ def user_logout(request):
 def individual_menu(request):
     step = request.GET.get('step', '1')
     if request.method == 'POST':
+        # Ответы копятся в подписанной cookie: у гостей анкета не пишет в БД
+        answers = load_answers(request)
         if step == '1':
-            request.session['goal'] = request.POST.get('goal')
-            request.session['activity'] = request.POST.get('activity')
-            return redirect('/individual-menu/?step=2')
+            answers['goal'] = request.POST.get('goal')
+            answers['activity'] = request.POST.get('activity')
+            return save_answers(redirect('/individual-menu/?step=2'), answers)
             
         elif step == '2':
             try:
@@ -145,150 +149,197 @@ def individual_menu(request):
                 if errors:
                     return render(request, 'core/step_2.html', {'errors': errors, 'hide_footer': True})
                 
-                request.session.update({'age': age, 'weight': weight, 'height': height, 'gender': gender})
-                return redirect('/individual-menu/?step=3')
+                answers.update({'age': age, 'weight': weight, 'height': height, 'gender': gender})
+                return save_answers(redirect('/individual-menu/?step=3'), answers)
             except ValueError:
                 return render(request, 'core/step_2.html', {'errors': ["Введите корректные числа"], 'hide_footer': True})
 
         elif step == '3':
-            request.session['diet_pref'] = request.POST.get('diet')
-            request.session['allergies'] = ",".join(request.POST.getlist('allergies'))
+            answers['diet_pref'] = request.POST.get('diet')
+            answers['allergies'] = ",".join(request.POST.getlist('allergies'))
             
             if request.user.is_authenticated:
-                p = request.user.profile
-                p.goal = request.session.get('goal')
-                p.age = request.session.get('age')
-                p.weight = request.session.get('weight')
-                p.height = request.session.get('height')
-                p.gender = request.session.get('gender')
-                p.activity = float(request.session.get('activity', 1.2))
-                p.diet_pref = request.session.get('diet_pref')
-                p.allergies = request.session.get('allergies')
-                res = calculate_macros(p)
-                p.target_kcal, p.target_protein = res['kcal'], res['p']
-                p.target_fat, p.target_carbs = res['f'], res['c']
-                p.save()
-            return redirect('results')
+                values = {key: answers.get(key) for key in QUESTIONNAIRE_KEYS}
+                values['activity'] = float(answers.get('activity', 1.2))
+                res = calculate_macros(values)
+                # Профиль пишется, только если анкета действительно изменилась
+                changed = request.user.profile.save_changes(
+                    **values,
+                    target_kcal=res['kcal'], target_protein=res['p'],
+                    target_fat=res['f'], target_carbs=res['c'],
+                )
+                if changed:
+                    invalidate_plans(request.user)
+            return save_answers(redirect('results'), answers)
             
     return render(request, f'core/step_{step}.html', {'hide_footer': True})
 
 # --- ГЕНЕРАЦИЯ РАЦИОНА ---
+# Браузер всегда перепроверяет страницу, а при совпадении ETag получает 304 без генерации и рендеринга
+@cache_control(private=True, no_cache=True)
+@condition(etag_func=results_etag)
 def results(request):
-    is_guest = not request.user.is_authenticated
-    favorite_recipe_ids = []
-    can_refresh = False
-    days_left = 0
-
-    if not is_guest:
-        profile = request.user.profile
-        source = profile
-        if not profile.target_kcal: return redirect('individual_menu')
-        favorite_recipe_ids = list(profile.favorite_recipes.values_list('id', flat=True))
-        can_refresh = profile.can_refresh_menu()
-        days_left = profile.days_until_next_refresh()
-        is_subscribed = profile.has_active_subscription
-    else:
-        source = request.session
-        if not source.get('age'): return redirect('individual_menu')
-        is_subscribed = False
+    inputs = plan_inputs(request)
+    if inputs is None: return redirect('individual_menu')
+    profile = inputs.profile
 
-    res_macros = calculate_macros(source)
-    target_kcal = res_macros['kcal']
+    # Сохраненный рацион читается одним запросом, генерация - только при промахе.
+    # Один снимок каталога на весь запрос: рацион, построенный по нему, сохраняется под его же версией
+    catalog = request_catalog(request)
+    weekly_plan = get_stored_plan(profile, catalog=catalog) if profile else None
+    if weekly_plan is None:
+        weekly_plan = generate_plan(catalog, inputs.diet_pref, inputs.allergies, inputs.macros, inputs.seed)
+        if weekly_plan is None:
+            return render(request, 'core/results.html', {'error_message': "Нет рецептов под ваши фильтры."})
+        if profile:
+            store_plan(profile, weekly_plan, catalog=catalog)
 
-    # Фильтрация по диете и аллергиям
-    diet_pref = source.diet_pref if not is_guest else source.get('diet_pref')
-    allergies = source.allergies if not is_guest else source.get('allergies', '')
-    
-    diet_map = {'vegan': ['vegan'], 'vege': ['vegan', 'vege'], 'pesca': ['vegan', 'vege', 'pesca'], 'all': ['vegan', 'vege', 'pesca', 'all']}
-    allowed = diet_map.get(diet_pref, ['all'])
-    
-    recipes_query = Recipe.objects.filter(diet_type__in=allowed)
-    if allergies:
-        for a in allergies.split(','):
-            if a.strip():
-                recipes_query = recipes_query.exclude(description__icontains=a.strip())
-    
-    all_recipes = list(recipes_query)
-    if not all_recipes:
-        return render(request, 'core/results.html', {'error_message': "Нет рецептов под ваши фильтры."})
-
-    meal_dist = {
-        'breakfast': {'ratio': 0.25, 'label': 'ЗАВТРАК'},
-        'snack': {'ratio': 0.15, 'label': 'ПЕРЕКУС'},
-        'lunch': {'ratio': 0.35, 'label': 'ОБЕД'},
-        'dinner': {'ratio': 0.25, 'label': 'УЖИН'},
-    }
-    days = ['Понедельник', 'Вторник', 'Среда', 'Четверг', 'Пятница', 'Суббота', 'Воскресенье']
+    favorite_recipe_ids = sorted(favorite_ids(profile)) if profile else []
+    return render(request, 'core/results.html', results_context(inputs, weekly_plan, favorite_recipe_ids))
+
+# --- API РАЦИОНА (NDJSON) ---
+
+def _parse_list(value, allowed, cast=str):
+    """Разбор параметра вида "1,3,5" с проверкой допустимых значений; None, если параметр не задан."""
+    if not value:
+        return None
+    items = {cast(item.strip()) for item in value.split(',')}
+    if not items <= set(allowed):
+        raise ValueError(value)
+    return items
+
+
+def _stored_after_stream(profile, catalog, days):
+    """Отдает дни дальше и сохраняет неделю целиком (под версией каталога catalog), когда поток дошел до конца."""
     weekly_plan = []
-    
-    user_seed = request.user.id if not is_guest else "guest"
-    refresh_seed = int(profile.last_weekly_refresh.timestamp()) if not is_guest and profile.last_weekly_refresh else 0
-    random.seed(f"{user_seed}-{datetime.date.today().isocalendar()[1]}-{refresh_seed}")
+    for day in days:
+        weekly_plan.append(day)
+        yield day
+    store_plan(profile, weekly_plan, catalog=catalog)
 
-    pools = {m: [r for r in all_recipes if r.meal_type == m] for m in meal_dist.keys()}
-    for p in pools.values(): random.shuffle(p)
-    iterators = {m: iter(p) for m, p in pools.items()}
 
-    for day_name in days:
-        day_meals = []
-        for m_slug, details in meal_dist.items():
-            try:
-                recipe = next(iterators[m_slug])
-            except (StopIteration, KeyError):
-                if not pools.get(m_slug): continue
-                random.shuffle(pools[m_slug])
-                iterators[m_slug] = iter(pools[m_slug])
-                recipe = next(iterators[m_slug])
-            
-            multiplier = (target_kcal * details['ratio']) / recipe.calories if recipe.calories > 0 else 1
-            day_meals.append({
-                'id': recipe.id,
-                'type': details['label'],
-                'type_slug': m_slug,
-                'title': recipe.title,
-                'weight': round(100 * multiplier),
-                'kcal': round(recipe.calories * multiplier),
-                'p': round(recipe.protein * multiplier),
-                'f': round(recipe.fat * multiplier),
-                'c': round(recipe.carbs * multiplier),
-                'image': recipe.image_url,
-                'ingredients': scale_ingredients(recipe.description, multiplier),
-            })
-        weekly_plan.append({'day_name': day_name, 'meals': day_meals})
-
-    return render(request, 'core/results.html', {
-        'weekly_plan': weekly_plan,
-        'macros': res_macros,
-        'kcal': target_kcal,
-        'is_guest': is_guest,
-        'can_refresh': can_refresh,
-        'days_left': days_left,
-        'favorite_recipe_ids': favorite_recipe_ids,
-        'is_subscribed': is_subscribed,
-        'hide_footer': True
-    })
+def _ndjson_days(days, meals):
+    for day in days:
+        if meals is not None:
+            day = {**day, 'meals': [meal for meal in day['meals'] if meal['type_slug'] in meals]}
+        yield json.dumps({'day': DAYS.index(day['day_name']) + 1, **day}, ensure_ascii=False) + "\n"
+
+
+def plan_api(request):
+    """
+    Тот же рацион, что и на странице results, в формате NDJSON: одна строка JSON на день,
+    дни отдаются по мере генерации. ?days=1,3 - только эти дни (1 - понедельник),
+    ?meals=breakfast,dinner - только эти приемы пищи.
+    """
+    try:
+        days = _parse_list(request.GET.get('days'), range(1, len(DAYS) + 1), int)
+        meals = _parse_list(request.GET.get('meals'), MEAL_DIST)
+    except ValueError:
+        return JsonResponse({'status': 'error', 'message': 'Некорректные параметры days или meals'}, status=400)
+
+    inputs = plan_inputs(request)
+    if inputs is None:
+        return JsonResponse({'status': 'error', 'message': 'Сначала заполните анкету'}, status=400)
+    profile = inputs.profile
+
+    catalog = request_catalog(request)
+    weekly_plan = get_stored_plan(profile, catalog=catalog) if profile else None
+    if weekly_plan is not None:
+        plan_days = (day for number, day in enumerate(weekly_plan, 1) if days is None or number in days)
+    else:
+        plan_days = iter_plan(
+            catalog, inputs.diet_pref, inputs.allergies, inputs.macros, inputs.seed,
+            days={number - 1 for number in days} if days else None,
+        )
+        if plan_days is None:
+            return JsonResponse({'status': 'error', 'message': 'Нет рецептов под ваши фильтры.'}, status=404)
+        if profile and days is None:
+            plan_days = _stored_after_stream(profile, catalog, plan_days)
+
+    return StreamingHttpResponse(_ndjson_days(plan_days, meals), content_type='application/x-ndjson; charset=utf-8')
 
 # --- AJAX И ФИЧИ ---
 
+def json_object(request):
+    """Объект из JSON-тела запроса или None, если тело не JSON или не объект (общий разбор и для async_views)."""
+    try:
+        data = json.loads(request.body)
+    except ValueError:
+        return None
+    return data if isinstance(data, dict) else None
+
+
+def json_recipe_id(data):
+    """id рецепта из объекта запроса (json_object) или None, если его нет или он некорректен."""
+    try:
+        return int(data.get('recipe_id'))
+    except (AttributeError, TypeError, ValueError):
+        return None
+
+
 @login_required
 @require_POST
 def toggle_favorite(request):
-    data = json.loads(request.body)
-    recipe = get_object_or_404(Recipe, id=data.get('recipe_id'))
+    recipe_id = json_recipe_id(json_object(request))
+    if recipe_id is None or not Recipe.objects.filter(pk=recipe_id).exists():
+        return JsonResponse({'status': 'error', 'message': 'Рецепт не найден'}, status=404)
     profile = request.user.profile
-    if recipe in profile.favorite_recipes.all():
-        profile.favorite_recipes.remove(recipe)
+    if is_favorite(profile, recipe_id):
+        profile.favorite_recipes.remove(recipe_id)
         return JsonResponse({'status': 'success', 'action': 'removed'})
     else:
-        profile.favorite_recipes.add(recipe)
+        profile.favorite_recipes.add(recipe_id)
         return JsonResponse({'status': 'success', 'action': 'added'})
 
+# Идемпотентные добавление и удаление: повторный запрос (например, двойной клик) ничего не меняет
+@login_required
+@require_POST
+def add_favorite(request):
+    recipe_id = json_recipe_id(json_object(request))
+    if recipe_id is None or not Recipe.objects.filter(pk=recipe_id).exists():
+        return JsonResponse({'status': 'error', 'message': 'Рецепт не найден'}, status=404)
+    request.user.profile.favorite_recipes.add(recipe_id)
+    return JsonResponse({'status': 'success', 'action': 'added'})
+
+@login_required
+@require_POST
+def remove_favorite(request):
+    recipe_id = json_recipe_id(json_object(request))
+    if recipe_id is None:
+        return JsonResponse({'status': 'error', 'message': 'Рецепт не найден'}, status=404)
+    request.user.profile.favorite_recipes.remove(recipe_id)
+    return JsonResponse({'status': 'success', 'action': 'removed'})
+
+@login_required
+@require_POST
+def sync_favorites(request):
+    """
+    Пакетное изменение избранного в одной транзакции: {"add": [id, ...], "remove": [id, ...]}.
+    Сначала удаление, затем добавление; несуществующие рецепты пропускаются.
+    Возвращает итоговый список избранного.
+    """
+    data = json_object(request)
+    try:
+        to_add = parse_recipe_ids(data.get('add', []))
+        to_remove = parse_recipe_ids(data.get('remove', []))
+    except (TypeError, ValueError, AttributeError):
+        return JsonResponse({'status': 'error', 'message': 'Ожидаются списки id в полях add и remove'}, status=400)
+
+    profile = request.user.profile
+    with transaction.atomic():
+        if to_remove:
+            profile.favorite_recipes.remove(*to_remove)
+        if to_add:
+            profile.favorite_recipes.add(*Recipe.objects.filter(pk__in=to_add).values_list('pk', flat=True))
+    return JsonResponse({'status': 'success', 'favorite_ids': sorted(favorite_ids(profile))})
+
 @login_required
 def refresh_meal(request):
     profile = request.user.profile
     if profile.can_refresh_menu():
         profile.last_weekly_refresh = timezone.now()
-        profile.save()
+        profile.save(update_fields=['last_weekly_refresh'])
+        invalidate_plans(request.user)
         messages.success(request, "Меню успешно обновлено на неделю!")
     else:
         messages.error(request, f"Бесплатное обновление будет доступно через {profile.days_until_next_refresh()} дн.")
@@ -301,39 +352,34 @@ def replace_meal_ajax(request):
     if not profile.has_active_subscription:
         return JsonResponse({'status': 'error', 'message': 'Нужна подписка Premium'}, status=403)
     
-    data = json.loads(request.body)
+    data = json_object(request)
+    if data is None:
+        return JsonResponse({'status': 'error', 'message': 'Некорректный запрос'}, status=400)
     meal_type = data.get('meal_type')
-    old_id = data.get('recipe_id')
+    old_id = json_recipe_id(data)
     
-    recipes = Recipe.objects.filter(meal_type=meal_type, diet_type__in=[profile.diet_pref, 'all']).exclude(id=old_id)
-    if not recipes.exists():
-        return JsonResponse({'status': 'error', 'message': 'Нет вариантов для замены'}, status=404)
+    if not profile.target_kcal:
+        return JsonResponse({'status': 'error', 'message': 'Сначала заполните анкету'}, status=400)
     
-    new_recipe = random.choice(recipes)
-    target_kcal = calculate_macros(profile)['kcal']
-    meal_ratios = {'breakfast': 0.25, 'snack': 0.15, 'lunch': 0.35, 'dinner': 0.25}
-    multiplier = (target_kcal * meal_ratios.get(meal_type, 0.25)) / new_recipe.calories
+    new_meal = replacement_meal(get_catalog(), profile, meal_type, old_id)
+    if new_meal is None:
+        return JsonResponse({'status': 'error', 'message': 'Нет вариантов для замены'}, status=404)
     
-    return JsonResponse({
-        'status': 'success',
-        'new_meal': {
-            'id': new_recipe.id,
-            'title': new_recipe.title,
-            'kcal': round(new_recipe.calories * multiplier),
-            'p': round(new_recipe.protein * multiplier),
-            'f': round(new_recipe.fat * multiplier),
-            'c': round(new_recipe.carbs * multiplier),
-            'weight': round(100 * multiplier),
-            'ingredients': scale_ingredients(new_recipe.description, multiplier),
-            'image': new_recipe.image_url
-        }
-    })
+    return JsonResponse({'status': 'success', 'new_meal': new_meal})
 
 @login_required
+@cache_control(private=True, no_cache=True)
+@condition(etag_func=profile_etag)
 def profile_view(request):
-    user_profile, _ = Profile.objects.get_or_create(user=request.user)
+    try:
+        user_profile = request.user.profile  # Уже загружен вместе с пользователем
+    except Profile.DoesNotExist:
+        user_profile = Profile.objects.create(user=request.user)
+    # Карточки избранного берутся из снимка каталога по кэшированному набору id, без запросов к БД
+    catalog = request_catalog(request)
+    favorite_recipes = [recipe for recipe in map(catalog.get, sorted(favorite_ids(user_profile))) if recipe is not None]
     return render(request, 'core/profile.html', {
         'profile': user_profile,
-        'favorite_recipes': user_profile.favorite_recipes.all(),
+        'favorite_recipes': favorite_recipes,
         'days_left': user_profile.days_until_next_refresh()
     })
@@ -78,6 +78,7 @@ def seed():
         total_recipes_created += 1
 
     print(f"Успех! В базе теперь {total_recipes_created} рецептов.")
+    print("Фото скачаются и сожмутся в миниатюры командой: python manage.py build_thumbnails")
 
 if __name__ == "__main__":
     seed()
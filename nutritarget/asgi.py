@@ -12,5 +12,7 @@ import os
 from django.core.asgi import get_asgi_application
 
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'nutritarget.settings')
+# Под ASGI постоянные соединения с БД отключаются (nutritarget/sqlite.py)
+os.environ.setdefault('NUTRITARGET_ASGI', '1')
 
 application = get_asgi_application()
@@ -0,0 +1,125 @@
+"""
+Замер времени запросов: SQL, рендеринг шаблонов и остальной код представления.
+
+PerformanceMiddleware отдает результат в заголовке Server-Timing и копит
+гистограммы по имени URL в nutritarget.metrics.registry. Рендеринг шаблонов
+замеряется бэкендом InstrumentedDjangoTemplates (подключается в TEMPLATES).
+"""
+import contextvars
+import time
+from contextlib import ExitStack
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction, sync_to_async
+from django.db import connections
+from django.template.backends.django import DjangoTemplates
+
+from .metrics import registry
+
+_current = contextvars.ContextVar('request_timings', default=None)
+
+
+class RequestTimings:
+    __slots__ = ('db_time', 'db_queries', 'template_time')
+
+    def __init__(self):
+        self.db_time = 0.0
+        self.db_queries = 0
+        self.template_time = 0.0
+
+    def sql_wrapper(self, execute, sql, params, many, context):
+        started = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.db_time += time.perf_counter() - started
+            self.db_queries += 1
+
+
+def _wrap_connections(stack, timings):
+    for connection in connections.all():
+        stack.enter_context(connection.execute_wrapper(timings.sql_wrapper))
+
+
+class PerformanceMiddleware:
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.async_mode = iscoroutinefunction(get_response)
+        if self.async_mode:
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if self.async_mode:
+            return self.__acall__(request)
+        timings = RequestTimings()
+        token = _current.set(timings)
+        started = time.perf_counter()
+        try:
+            with ExitStack() as stack:
+                _wrap_connections(stack, timings)
+                response = self.get_response(request)
+        finally:
+            _current.reset(token)
+        return self._finish(request, response, timings, started)
+
+    async def __acall__(self, request):
+        timings = RequestTimings()
+        token = _current.set(timings)
+        started = time.perf_counter()
+        try:
+            # Соединения принадлежат потоку, в котором async ORM выполняет запросы,
+            # поэтому обертки ставятся и снимаются в нем же
+            stack = ExitStack()
+            await sync_to_async(_wrap_connections)(stack, timings)
+            try:
+                response = await self.get_response(request)
+            finally:
+                await sync_to_async(stack.close)()
+        finally:
+            _current.reset(token)
+        return self._finish(request, response, timings, started)
+
+    def _finish(self, request, response, timings, started):
+        total = time.perf_counter() - started
+        app_time = max(total - timings.db_time - timings.template_time, 0.0)
+        response['Server-Timing'] = ", ".join([
+            f'db;dur={timings.db_time * 1000:.2f};desc="{timings.db_queries} queries"',
+            f'tpl;dur={timings.template_time * 1000:.2f}',
+            f'app;dur={app_time * 1000:.2f}',
+            f'total;dur={total * 1000:.2f}',
+        ])
+
+        match = getattr(request, 'resolver_match', None)
+        view = match.url_name if match and match.url_name else 'unmatched'
+        registry.observe(view, response.status_code, total, timings.db_time, timings.db_queries, timings.template_time)
+        return response
+
+
+class InstrumentedTemplate:
+    """Обертка шаблона бэкенда: время render() добавляется к таймингам текущего запроса."""
+
+    def __init__(self, template):
+        self.template = template
+
+    def __getattr__(self, name):
+        return getattr(self.template, name)
+
+    def render(self, context=None, request=None):
+        timings = _current.get()
+        if timings is None:
+            return self.template.render(context, request)
+        started = time.perf_counter()
+        try:
+            return self.template.render(context, request)
+        finally:
+            timings.template_time += time.perf_counter() - started
+
+
+class InstrumentedDjangoTemplates(DjangoTemplates):
+    def from_string(self, template_code):
+        return InstrumentedTemplate(super().from_string(template_code))
+
+    def get_template(self, template_name):
+        return InstrumentedTemplate(super().get_template(template_name))
@@ -0,0 +1,20 @@
+"""
+Раздача загруженных файлов (MEDIA_ROOT) с заголовками кэширования.
+
+Файлы в recipes/ названы по хэшу содержимого (core/images.py) и не меняются,
+поэтому браузер и CDN кэшируют их на год без перепроверки. В продакшене то же
+правило задается в веб-сервере (location /media/recipes/ { expires max; }).
+"""
+from django.conf import settings
+from django.views.static import serve
+
+# Префиксы, где имя файла - хэш содержимого
+IMMUTABLE_PREFIXES = ('recipes/',)
+IMMUTABLE_CACHE_CONTROL = 'public, max-age=31536000, immutable'
+
+
+def media_view(request, path):
+    response = serve(request, path, document_root=settings.MEDIA_ROOT)
+    if path.startswith(IMMUTABLE_PREFIXES) and response.status_code == 200:
+        response['Cache-Control'] = IMMUTABLE_CACHE_CONTROL
+    return response
@@ -0,0 +1,106 @@
+"""
+Агрегация метрик запросов и эндпоинт /metrics в текстовом формате Prometheus.
+
+Метрики хранятся в памяти процесса: при нескольких воркерах каждый отдает свои,
+Prometheus собирает их по отдельности (как обычно для pull-модели).
+"""
+import bisect
+import hmac
+import threading
+
+from django.conf import settings
+from django.http import HttpResponse, HttpResponseForbidden
+
+# Границы корзин гистограммы длительности запроса, секунды
+DURATION_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0)
+
+
+class ViewStats:
+    __slots__ = ('buckets', 'count', 'duration_sum', 'db_sum', 'db_queries', 'template_sum', 'statuses')
+
+    def __init__(self):
+        self.buckets = [0] * (len(DURATION_BUCKETS) + 1)
+        self.count = 0
+        self.duration_sum = 0.0
+        self.db_sum = 0.0
+        self.db_queries = 0
+        self.template_sum = 0.0
+        self.statuses = {}
+
+
+class MetricsRegistry:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._views = {}
+
+    def observe(self, view, status, duration, db_time, db_queries, template_time):
+        status_class = f"{status // 100}xx"
+        with self._lock:
+            stats = self._views.get(view)
+            if stats is None:
+                stats = self._views[view] = ViewStats()
+            stats.buckets[bisect.bisect_left(DURATION_BUCKETS, duration)] += 1
+            stats.count += 1
+            stats.duration_sum += duration
+            stats.db_sum += db_time
+            stats.db_queries += db_queries
+            stats.template_sum += template_time
+            stats.statuses[status_class] = stats.statuses.get(status_class, 0) + 1
+
+    def reset(self):
+        with self._lock:
+            self._views.clear()
+
+    def render(self):
+        """Все метрики в текстовом формате Prometheus 0.0.4."""
+        with self._lock:
+            views = sorted(self._views.items())
+            lines = [
+                "# HELP nutritarget_request_duration_seconds Request latency by URL name.",
+                "# TYPE nutritarget_request_duration_seconds histogram",
+            ]
+            for view, stats in views:
+                cumulative = 0
+                for bound, hits in zip(DURATION_BUCKETS + ('+Inf',), stats.buckets):
+                    cumulative += hits
+                    lines.append(f'nutritarget_request_duration_seconds_bucket{{view="{view}",le="{bound}"}} {cumulative}')
+                lines.append(f'nutritarget_request_duration_seconds_sum{{view="{view}"}} {stats.duration_sum:.6f}')
+                lines.append(f'nutritarget_request_duration_seconds_count{{view="{view}"}} {stats.count}')
+
+            for name, help_text, attr in (
+                ('nutritarget_request_db_seconds_total', 'Time spent in SQL queries.', 'db_sum'),
+                ('nutritarget_request_db_queries_total', 'Number of SQL queries.', 'db_queries'),
+                ('nutritarget_request_template_seconds_total', 'Time spent rendering templates.', 'template_sum'),
+            ):
+                lines.append(f"# HELP {name} {help_text}")
+                lines.append(f"# TYPE {name} counter")
+                for view, stats in views:
+                    value = getattr(stats, attr)
+                    lines.append(f'{name}{{view="{view}"}} {value:.6f}' if isinstance(value, float) else f'{name}{{view="{view}"}} {value}')
+
+            lines.append("# HELP nutritarget_requests_total Responses by URL name and status class.")
+            lines.append("# TYPE nutritarget_requests_total counter")
+            for view, stats in views:
+                for status_class, hits in sorted(stats.statuses.items()):
+                    lines.append(f'nutritarget_requests_total{{view="{view}",status="{status_class}"}} {hits}')
+        return "\n".join(lines) + "\n"
+
+
+registry = MetricsRegistry()
+
+
+def _metrics_allowed(request):
+    token = getattr(settings, 'METRICS_TOKEN', '')
+    if token:
+        return hmac.compare_digest(request.headers.get('Authorization', '').encode(), f"Bearer {token}".encode())
+    return request.META.get('REMOTE_ADDR') in getattr(settings, 'METRICS_ALLOWED_IPS', ('127.0.0.1', '::1'))
+
+
+def metrics_view(request):
+    """
+    Метрики для Prometheus. Если задан METRICS_TOKEN - только с заголовком "Authorization: Bearer <токен>",
+    иначе только с адресов из METRICS_ALLOWED_IPS.
+    """
+    if not _metrics_allowed(request):
+        return HttpResponseForbidden()
+    return HttpResponse(registry.render(), content_type='text/plain; version=0.0.4; charset=utf-8')
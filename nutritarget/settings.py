@@ -10,8 +10,11 @@ For the full list of settings and their values, see
 https://docs.djangoproject.com/en/6.0/ref/settings/
 """
 
+import os
 from pathlib import Path
 
+from .sqlite import sqlite_database
+
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
 BASE_DIR = Path(__file__).resolve().parent.parent
 
@@ -44,7 +47,9 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'nutritarget.instrumentation.PerformanceMiddleware', # Server-Timing и метрики (первым, чтобы учесть все остальные)
     'django.middleware.security.SecurityMiddleware',
+    'nutritarget.staticfiles.PrecompressedStaticMiddleware', # Собранная статика (до сессий и CSRF)
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
@@ -57,7 +62,7 @@ ROOT_URLCONF = 'nutritarget.urls'
 
 TEMPLATES = [
     {
-        'BACKEND': 'django.template.backends.django.DjangoTemplates',
+        'BACKEND': 'nutritarget.instrumentation.InstrumentedDjangoTemplates', # DjangoTemplates с замером рендеринга
         'DIRS': [],
         'APP_DIRS': True,
         'OPTIONS': {
@@ -77,14 +82,42 @@ WSGI_APPLICATION = 'nutritarget.wsgi.application'
 # Database
 # https://docs.djangoproject.com/en/6.0/ref/settings/#databases
 
+# NUTRITARGET_DB_PATH - файл базы, NUTRITARGET_SQLITE_PROFILE - профиль настроек из nutritarget/sqlite.py:
+# 'tuned' (WAL, pragma, постоянные соединения, BEGIN IMMEDIATE) или 'default' (как в Django по умолчанию).
+# Под ASGI (nutritarget/asgi.py выставляет NUTRITARGET_ASGI=1) и с асинхронными представлениями
+# постоянные соединения отключаются
 DATABASES = {
-    'default': {
-        'ENGINE': 'django.db.backends.sqlite3',
-        'NAME': BASE_DIR / 'db.sqlite3',
-    }
+    'default': sqlite_database(
+        os.environ.get('NUTRITARGET_DB_PATH', BASE_DIR / 'db.sqlite3'),
+        os.environ.get('NUTRITARGET_SQLITE_PROFILE', 'tuned'),
+        asgi=os.environ.get('NUTRITARGET_ASGI') == '1' or os.environ.get('NUTRITARGET_ASYNC_VIEWS', '0') == '1',
+    )
 }
 
 
+# Профиль загружается вместе с пользователем одним запросом.
+# ModelBackend оставлен для сессий, созданных до его подключения.
+AUTHENTICATION_BACKENDS = [
+    'core.backends.ProfileModelBackend',
+    'django.contrib.auth.backends.ModelBackend',
+]
+
+
+# Кэш по умолчанию хранит наборы id избранного, HTML-фрагменты results лежат отдельно.
+# Ключ фрагмента - хэш его содержимого, ключ набора избранного включает Profile.favorites_version из БД,
+# поэтому кэш каждого процесса не отдает устаревшее; Redis/Memcached нужен лишь для экономии памяти.
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    },
+    'fragments': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': 'fragments',
+        'TIMEOUT': 86400,
+        'OPTIONS': {'MAX_ENTRIES': 20000},
+    },
+}
+
 # Password validation
 # https://docs.djangoproject.com/en/6.0/ref/settings/#auth-password-validators
 
@@ -125,7 +158,44 @@ STATICFILES_DIRS = [
     BASE_DIR / 'static', 
 ]
 
+# collectstatic собирает статику сюда: имена с хэшем содержимого и сжатые копии .gz/.br
+# (nutritarget/staticfiles.py), их отдает PrecompressedStaticMiddleware с Cache-Control: immutable
+STATIC_ROOT = Path(os.environ.get('NUTRITARGET_STATIC_ROOT', BASE_DIR / 'staticfiles'))
+
+STORAGES = {
+    'default': {'BACKEND': 'django.core.files.storage.FileSystemStorage'},
+    'staticfiles': {'BACKEND': 'nutritarget.staticfiles.CompressedManifestStaticFilesStorage'},
+}
+
+# Фото рецептов и миниатюры (manage.py build_thumbnails). Имена миниатюр содержат хэш содержимого,
+# поэтому /media/ отдается с долгим кэшированием (nutritarget/media.py; в продакшене - тем же правилом веб-сервера)
+MEDIA_URL = 'media/'
+MEDIA_ROOT = Path(os.environ.get('NUTRITARGET_MEDIA_ROOT', BASE_DIR / 'media'))
+
+# Ширины адаптивных миниатюр рецептов, пикселей
+RECIPE_THUMBNAIL_SIZES = (320, 640, 960)
+
 CRISPY_ALLOWED_TEMPLATE_PACKS = "bootstrap5"
 CRISPY_TEMPLATE_PACK = "bootstrap5"
 
 LOGIN_URL = 'user_login'
+
+# Адреса, с которых доступен /metrics (Prometheus). Проверяется только REMOTE_ADDR: за обратным прокси
+# все запросы приходят с его адреса (обычно 127.0.0.1), и /metrics становится публичным.
+# Поэтому за прокси нужно задать NUTRITARGET_METRICS_TOKEN: тогда /metrics требует заголовок
+# "Authorization: Bearer <токен>" (bearer_token в конфигурации Prometheus), а адрес не проверяется
+METRICS_ALLOWED_IPS = ['127.0.0.1', '::1']
+METRICS_TOKEN = os.environ.get('NUTRITARGET_METRICS_TOKEN', '')
+
+# Планировщик рациона: 'optimize' - подбор рецептов и порций под все КБЖУ,
+# 'shuffle' - прежний случайный подбор только под калорийность
+PLANNER_ENGINE = 'optimize'
+# Аварийный предел времени генерации недели в режиме 'optimize', секунд. Объем работы оптимизатора
+# задан числом кандидатов и проходов (core/planner.py), поэтому рацион не зависит от загрузки процессора
+PLANNER_TIME_LIMIT = 1.0
+
+# Как часто (секунд) воркер сверяет версию каталога рецептов в БД (core/catalog.py)
+CATALOG_VERSION_CHECK_INTERVAL = 2.0
+
+# Асинхронные представления (core/async_views.py) для запуска под ASGI: NUTRITARGET_ASYNC_VIEWS=1
+CORE_ASYNC_VIEWS = os.environ.get('NUTRITARGET_ASYNC_VIEWS', '0') == '1'
@@ -0,0 +1,46 @@
+"""
+Профили настроек SQLite.
+
+'default' - конфигурация Django по умолчанию. 'tuned' - для работы под нагрузкой:
+WAL (читатели не ждут писателей), pragma на каждое новое соединение, постоянные
+соединения между запросами и BEGIN IMMEDIATE в транзакциях, чтобы писатель брал
+блокировку сразу и ждал ее по busy_timeout, а не падал с "database is locked"
+при повышении блокировки посреди транзакции.
+
+Под ASGI постоянные соединения отключаются (CONN_MAX_AGE=0), как советует документация
+Django: запросы к БД асинхронных запросов выполняются в потоках исполнителя, соединение
+живет в потоке, а не в запросе, и долгоживущие соединения копятся и не закрываются надежно.
+"""
+from django.core.exceptions import ImproperlyConfigured
+
+SQLITE_PROFILES = ('default', 'tuned')
+
+SQLITE_PRAGMAS = {
+    'journal_mode': 'WAL',
+    'synchronous': 'NORMAL',    # В режиме WAL безопасно: при сбое питания теряется только последняя транзакция
+    'busy_timeout': 5000,       # мс ожидания блокировки
+    'cache_size': -65536,       # 64 МБ страничного кэша на соединение
+    'mmap_size': 268435456,     # 256 МБ файла БД читаются через mmap
+    'temp_store': 'MEMORY',
+}
+
+
+def sqlite_database(name, profile='default', asgi=False):
+    """Словарь для DATABASES с настройками выбранного профиля; asgi - запуск под ASGI (без постоянных соединений)."""
+    if profile not in SQLITE_PROFILES:
+        raise ImproperlyConfigured(f"Неизвестный профиль SQLite '{profile}', допустимы: {', '.join(SQLITE_PROFILES)}")
+    config = {
+        'ENGINE': 'django.db.backends.sqlite3',
+        'NAME': name,
+    }
+    if profile == 'tuned':
+        config.update({
+            'CONN_MAX_AGE': 0 if asgi else 600,
+            'CONN_HEALTH_CHECKS': True,
+            'OPTIONS': {
+                'init_command': ";".join(f"PRAGMA {key}={value}" for key, value in SQLITE_PRAGMAS.items()),
+                'transaction_mode': 'IMMEDIATE',
+                'timeout': SQLITE_PRAGMAS['busy_timeout'] / 1000,
+            },
+        })
+    return config
@@ -0,0 +1,165 @@
+"""
+Статика с хэшем в имени и заранее сжатыми копиями.
+
+CompressedManifestStaticFilesStorage при collectstatic дает файлам имена с хэшем
+содержимого (style.css -> style.3f2a9c1b.css) и рядом кладет .gz и .br.
+PrecompressedStaticMiddleware отдает из STATIC_ROOT готовую копию под Accept-Encoding
+клиента: на запрос сжатие не тратится, а файлы с хэшем кэшируются как immutable.
+"""
+import gzip
+import mimetypes
+import os
+import posixpath
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.contrib.staticfiles.storage import ManifestStaticFilesStorage
+from django.core.exceptions import MiddlewareNotUsed
+from django.core.files.base import ContentFile
+from django.http import FileResponse
+
+from .media import IMMUTABLE_CACHE_CONTROL
+
+try:
+    import brotli
+except ImportError:  # Без пакета Brotli собираются только .gz
+    brotli = None
+
+# Сжимаются только текстовые форматы: картинки и шрифты уже сжаты
+COMPRESSIBLE_EXTENSIONS = ('.css', '.js', '.mjs', '.map', '.svg', '.json', '.txt', '.html', '.xml', '.ico')
+# Сжатая копия сохраняется, только если она меньше исходника хотя бы на 5%
+MIN_COMPRESSION_RATIO = 0.95
+
+# Кодировки в порядке предпочтения: (значение Content-Encoding, расширение копии)
+ENCODINGS = (('br', '.br'), ('gzip', '.gz'))
+
+# Файлы без хэша в имени (например, прямые ссылки на /static/css/style.css) могут смениться при выкладке
+MUTABLE_CACHE_CONTROL = 'public, max-age=300'
+
+
+def compress(content):
+    """Сжатые варианты содержимого: {'.gz': байты, '.br': байты}. gzip без mtime, чтобы результат не зависел от времени сборки."""
+    variants = {'.gz': gzip.compress(content, compresslevel=9, mtime=0)}
+    if brotli is not None:
+        variants['.br'] = brotli.compress(content, quality=11)
+    return variants
+
+
+class CompressedManifestStaticFilesStorage(ManifestStaticFilesStorage):
+
+    def post_process(self, paths, dry_run=False, **options):
+        yield from super().post_process(paths, dry_run, **options)
+        if dry_run:
+            return
+        # Сжимаются и исходные имена, и имена с хэшем: ссылки без {% static %} тоже получат сжатую копию
+        names = set(paths) | set(self.hashed_files.values())
+        for name in sorted(names):
+            if not name.endswith(COMPRESSIBLE_EXTENSIONS) or not self.exists(name):
+                continue
+            with self.open(name) as original:
+                content = original.read()
+            for suffix, compressed in compress(content).items():
+                if self.exists(name + suffix):
+                    self.delete(name + suffix)
+                if len(compressed) < len(content) * MIN_COMPRESSION_RATIO:
+                    self._save(name + suffix, ContentFile(compressed))
+                    yield name, name + suffix, True
+
+    def stored_name(self, name):
+        # Пока collectstatic не запускался, манифеста нет: ссылки ведут на файлы без хэша,
+        # чтобы локальная разработка и тесты работали без сборки статики
+        if not self.hashed_files:
+            return name
+        return super().stored_name(name)
+
+
+class StaticIndex:
+    """Файлы STATIC_ROOT, их сжатые копии и признак хэша в имени. Строится один раз при старте процесса."""
+
+    def __init__(self, root, hashed_names):
+        self.files = {}
+        if not root or not os.path.isdir(root):
+            return
+        for directory, _, filenames in os.walk(root):
+            present = set(filenames)
+            for filename in filenames:
+                if filename.endswith(('.gz', '.br')) and filename[:-3] in present:
+                    continue
+                path = os.path.join(directory, filename)
+                name = os.path.relpath(path, root).replace(os.sep, '/')
+                content_type, _ = mimetypes.guess_type(filename)
+                variants = {encoding: path + suffix for encoding, suffix in ENCODINGS if filename + suffix in present}
+                self.files[name] = (path, content_type or 'application/octet-stream', variants, name in hashed_names)
+
+    def get(self, name):
+        return self.files.get(name)
+
+
+def accepted_encodings(header):
+    """Кодировки из Accept-Encoding, кроме явно запрещенных (q=0)."""
+    accepted = set()
+    for part in header.split(','):
+        encoding, _, params = part.strip().partition(';')
+        params = params.replace(' ', '')
+        if encoding and params not in ('q=0', 'q=0.0', 'q=0.00', 'q=0.000'):
+            accepted.add(encoding.lower())
+    return accepted
+
+
+def _load_index():
+    from django.contrib.staticfiles.storage import staticfiles_storage
+    hashed_names = set(getattr(staticfiles_storage, 'hashed_files', {}).values())
+    return StaticIndex(settings.STATIC_ROOT, hashed_names)
+
+
+class PrecompressedStaticMiddleware:
+    """
+    Отдает собранную статику из STATIC_ROOT до остальных middleware: сессии, CSRF и
+    представления для нее не выполняются. Файлы, которых нет в индексе, проходят дальше.
+    При DEBUG отключается: runserver отдает исходные файлы из приложений без сборки.
+    """
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        if settings.DEBUG:
+            raise MiddlewareNotUsed
+        self.get_response = get_response
+        self.async_mode = iscoroutinefunction(get_response)
+        if self.async_mode:
+            markcoroutinefunction(self)
+        self.prefix = '/' + settings.STATIC_URL.lstrip('/')
+        self.index = _load_index()
+
+    def __call__(self, request):
+        if self.async_mode:
+            return self.__acall__(request)
+        return self.serve(request) or self.get_response(request)
+
+    async def __acall__(self, request):
+        return self.serve(request) or await self.get_response(request)
+
+    def serve(self, request):
+        if request.method not in ('GET', 'HEAD') or not request.path.startswith(self.prefix):
+            return None
+        name = posixpath.normpath(request.path[len(self.prefix):]).lstrip('/')
+        entry = self.index.get(name)
+        if entry is None:
+            return None
+        path, content_type, variants, immutable = entry
+
+        encoding = None
+        accepted = accepted_encodings(request.headers.get('Accept-Encoding', ''))
+        for candidate, _ in ENCODINGS:
+            if candidate in variants and candidate in accepted:
+                encoding, path = candidate, variants[candidate]
+                break
+
+        response = FileResponse(open(path, 'rb'), content_type=content_type)
+        response.headers.pop('Content-Disposition', None)
+        if encoding:
+            response['Content-Encoding'] = encoding
+        if variants:
+            response['Vary'] = 'Accept-Encoding'
+        response['Cache-Control'] = IMMUTABLE_CACHE_CONTROL if immutable else MUTABLE_CACHE_CONTROL
+        return response